@@ -0,0 +1,133 @@
+"""Connection-scale benchmark for the echo server.
+
+Starts server.py in each requested mode, opens many concurrent connections
+with asyncio and measures echo throughput and round-trip latency.
+
+    python bench.py --connections 10000 --messages 10 --modes threaded,selectors
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from framing import encode_frame
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else max(soft, needed)
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    if target < needed:
+        print(f"warning: fd limit {target} is below the {needed} sockets this run needs")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def start_server(mode, port, backlog, framing, io):
+    proc = subprocess.Popen(
+        [sys.executable, SERVER, "--mode", mode, "--port", str(port),
+         "--backlog", str(backlog), "--framing", framing, "--io", io, "--quiet"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    proc.stdout.readline()  # "Server listening on ..."
+    return proc
+
+
+async def client(host, port, payload, count, latencies, start_gate):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await start_gate.wait()
+        for _ in range(count):
+            sent_at = time.perf_counter()
+            writer.write(payload)
+            await reader.readexactly(len(payload))
+            latencies.append(time.perf_counter() - sent_at)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, connections, messages, size, connect_rate, framing):
+    payload = b"x" * size
+    if framing == "length":
+        # The echo of a frame is the same frame, so the client can compare whole frames.
+        payload = encode_frame(payload)
+    latencies = []
+    start_gate = asyncio.Event()
+    tasks = []
+    connect_started = time.perf_counter()
+    for i in range(connections):
+        tasks.append(asyncio.ensure_future(client(host, port, payload, messages, latencies, start_gate)))
+        if connect_rate and (i + 1) % connect_rate == 0:
+            # Pace connects so the listen backlog, not the client, is the bottleneck.
+            await asyncio.sleep(0.01)
+    # Let all connects settle, then fire every client at once.
+    await asyncio.sleep(0.5)
+    connect_time = time.perf_counter() - connect_started
+    started = time.perf_counter()
+    start_gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for r in results if isinstance(r, BaseException))
+    return latencies, elapsed, connect_time, failed
+
+
+def report(mode, connections, latencies, elapsed, connect_time, failed):
+    count = len(latencies)
+    print(f"[{mode}] connections={connections} failed={failed} messages={count} "
+          f"connect={connect_time:.2f}s elapsed={elapsed:.2f}s "
+          f"throughput={count / elapsed if elapsed else 0:.0f} msg/s")
+    if latencies:
+        print(f"[{mode}] latency ms: mean={statistics.mean(latencies) * 1000:.2f} "
+              f"p50={percentile(latencies, 0.50) * 1000:.2f} "
+              f"p99={percentile(latencies, 0.99) * 1000:.2f} "
+              f"max={max(latencies) * 1000:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12346)
+    parser.add_argument("--modes", default="threaded,selectors",
+                        help="comma-separated server modes to compare")
+    parser.add_argument("--external", action="store_true",
+                        help="benchmark an already running server instead of starting one")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=10, help="echo round trips per connection")
+    parser.add_argument("--size", type=int, default=64, help="payload bytes per message")
+    parser.add_argument("--backlog", type=int, default=4096)
+    parser.add_argument("--framing", choices=["length", "raw"], default="length")
+    parser.add_argument("--io", choices=["copy", "pooled"], default="copy")
+    parser.add_argument("--connect-rate", type=int, default=500,
+                        help="connections opened per 10 ms (0 = as fast as possible)")
+    args = parser.parse_args(argv)
+
+    raise_fd_limit(args.connections + 64)
+    modes = ["external"] if args.external else args.modes.split(",")
+    for mode in modes:
+        proc = None if args.external else start_server(mode, args.port, args.backlog, args.framing, args.io)
+        try:
+            latencies, elapsed, connect_time, failed = asyncio.run(run_load(
+                args.host, args.port, args.connections, args.messages, args.size, args.connect_rate,
+                args.framing))
+            report(mode, args.connections, latencies, elapsed, connect_time, failed)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        # Give the kernel a moment to release the port between modes.
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compares the copying and the pooled (recv_into + memoryview) echo handlers in-process.
+
+For each handler it pumps --messages frames of --size bytes through a socketpair and
+reports throughput, then repeats the run under tracemalloc to report how many bytes
+the handler allocated at peak while echoing.
+
+    python bench_buffers.py --size 1048576 --messages 2000
+"""
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+from framing import HEADER, encode_frame, recv_into_exactly
+from server import BufferPool, handle_client, handle_client_pooled
+
+def pump(handler, frame, reply, messages, window):
+    server_side, client_side = socket.socketpair()
+    handler_thread = threading.Thread(target=handler, args=(server_side,), daemon=True)
+    handler_thread.start()
+
+    slots = threading.Semaphore(window)
+
+    def sender():
+        for _ in range(messages):
+            slots.acquire()
+            client_side.sendall(frame)
+
+    writer = threading.Thread(target=sender, daemon=True)
+    started = time.perf_counter()
+    writer.start()
+    for _ in range(messages):
+        recv_into_exactly(client_side, reply)
+        slots.release()
+    elapsed = time.perf_counter() - started
+    client_side.close()
+    handler_thread.join()
+    return elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    pool = BufferPool()
+    # Client buffers are allocated up front so tracemalloc only sees the handler's allocations.
+    frame = encode_frame(b"x" * args.size)
+    reply = memoryview(bytearray(HEADER.size + args.size))
+    handlers = {
+        "copy": lambda sock: handle_client(sock, "bench", verbose=False),
+        "pooled": lambda sock: handle_client_pooled(sock, "bench", pool, verbose=False),
+    }
+    for name, handler in handlers.items():
+        elapsed = pump(handler, frame, reply, args.messages, args.window)
+        total = args.size * args.messages
+        # Allocation profile: tracemalloc slows everything down, so it gets its own run.
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        pump(handler, frame, reply, min(args.messages, 200), args.window)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"[{name}] {args.messages} x {args.size} B: {elapsed:.2f}s, "
+              f"{args.messages / elapsed:.0f} msg/s, {total / elapsed / 1e6:.0f} MB/s, "
+              f"peak allocated during echo {(peak - baseline) / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
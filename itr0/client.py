@@ -1,23 +1,31 @@
+import argparse
 import socket
+import threading
+import time
+from collections import deque
+from framing import encode_frame, recv_frame
 
-def main():
-    HOST = '127.0.0.1'
-    PORT = 12345
-
+def interactive(host, port, framed):
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    
+
     try:
-        client.connect((HOST, PORT))
-        print(f"Connected to {HOST}:{PORT}")
+        client.connect((host, port))
+        print(f"Connected to {host}:{port}")
 
         while True:
             message = input("Enter message (or 'quit' to exit): ")
             if message.lower() == 'quit':
                 break
 
-            client.send(message.encode())
-            
-            data = client.recv(1024)
+            if framed:
+                client.sendall(encode_frame(message.encode()))
+                data = recv_frame(client)
+                if data is None:
+                    print("Server closed the connection")
+                    break
+            else:
+                client.send(message.encode())
+                data = client.recv(1024)
             print(f"Received from server: {data.decode()}")
 
     except Exception as e:
@@ -26,5 +34,85 @@ def main():
         client.close()
         print("Connection closed")
 
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def run_connection(host, port, messages, size, window, latencies, errors):
+    """Keeps up to `window` frames in flight on one connection; the echo preserves order."""
+    frame = encode_frame(b"x" * size)
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    slots = threading.Semaphore(window)
+    sent_at = deque()
+    local = []
+
+    def sender():
+        for _ in range(messages):
+            slots.acquire()
+            sent_at.append(time.perf_counter())
+            sock.sendall(frame)
+
+    writer = threading.Thread(target=sender, daemon=True)
+    writer.start()
+    try:
+        for _ in range(messages):
+            if recv_frame(sock) is None:
+                raise ConnectionError("Server closed the connection")
+            local.append(time.perf_counter() - sent_at.popleft())
+            slots.release()
+    except Exception as e:
+        errors.append(e)
+    finally:
+        sock.close()
+    latencies.extend(local)
+
+def load(host, port, connections, messages, size, window):
+    """Non-interactive mode: pipeline frames over several connections and report rate and latency."""
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(target=run_connection,
+                         args=(host, port, messages, size, window, latencies, errors))
+        for _ in range(connections)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    count = len(latencies)
+    print(f"connections={connections} window={window} size={size}B "
+          f"messages={count} errors={len(errors)} elapsed={elapsed:.2f}s")
+    print(f"throughput: {count / elapsed:.0f} msg/s, {count * size / elapsed / 1e6:.1f} MB/s")
+    if latencies:
+        print("latency ms: " + " ".join(
+            f"p{int(p * 1000) / 10:g}={percentile(latencies, p) * 1000:.2f}"
+            for p in (0.5, 0.9, 0.99, 0.999)))
+    for e in errors[:5]:
+        print(f"Error: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Echo client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--framing", choices=["length", "raw"], default="length")
+    parser.add_argument("--load", action="store_true",
+                        help="non-interactive pipelined load instead of reading from stdin")
+    parser.add_argument("--connections", type=int, default=4, help="parallel connections in --load mode")
+    parser.add_argument("--messages", type=int, default=10000, help="frames per connection in --load mode")
+    parser.add_argument("--size", type=int, default=64, help="payload bytes per frame in --load mode")
+    parser.add_argument("--window", type=int, default=32, help="outstanding frames per connection")
+    args = parser.parse_args(argv)
+
+    if args.load:
+        if args.framing != "length":
+            parser.error("--load needs length framing to match replies to requests")
+        load(args.host, args.port, args.connections, args.messages, args.size, args.window)
+    else:
+        interactive(args.host, args.port, args.framing == "length")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
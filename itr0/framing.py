@@ -0,0 +1,96 @@
+"""Length-prefixed framing: every message is a 4-byte big-endian length followed by the payload.
+
+Raw recv(1024) splits messages larger than the buffer and merges messages that
+TCP coalesces; with a length prefix both sides always see whole messages.
+"""
+import struct
+
+HEADER = struct.Struct("!I")
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f"Frame of {len(payload)} bytes exceeds {MAX_FRAME}")
+    return HEADER.pack(len(payload)) + payload
+
+
+def recv_into_exactly(sock, view):
+    """Fill view completely; returns False if the peer closed before sending anything."""
+    received = 0
+    size = len(view)
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return False
+            raise FrameError("Connection closed in the middle of a frame")
+        received += n
+    return True
+
+
+def recv_exactly(sock, size):
+    """Read exactly size bytes; returns None if the peer closed before sending anything."""
+    buf = bytearray(size)
+    if not recv_into_exactly(sock, memoryview(buf)):
+        return None
+    return buf
+
+
+def recv_frame(sock):
+    """Blocking read of one frame; returns None on a clean close between frames."""
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise FrameError(f"Frame of {size} bytes exceeds {MAX_FRAME}")
+    if size == 0:
+        return bytearray()
+    payload = recv_exactly(sock, size)
+    if payload is None:
+        raise FrameError("Connection closed in the middle of a frame")
+    return payload
+
+
+def complete_frames_end(view):
+    """Offset just past the last complete frame in view and the number of frames, without copying."""
+    offset = 0
+    count = 0
+    while len(view) - offset >= HEADER.size:
+        (size,) = HEADER.unpack_from(view, offset)
+        if size > MAX_FRAME:
+            raise FrameError(f"Frame of {size} bytes exceeds {MAX_FRAME}")
+        end = offset + HEADER.size + size
+        if end > len(view):
+            break
+        offset = end
+        count += 1
+    return offset, count
+
+
+class FrameDecoder:
+    """Incremental decoder for non-blocking sockets: feed() bytes, get back complete frames."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (size,) = HEADER.unpack_from(self.buffer, offset)
+            if size > MAX_FRAME:
+                raise FrameError(f"Frame of {size} bytes exceeds {MAX_FRAME}")
+            end = offset + HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        del self.buffer[:offset]
+        return frames
@@ -1,43 +1,310 @@
+import argparse
+import itertools
+import selectors
 import socket
 import threading
+from framing import (HEADER, MAX_FRAME, FrameDecoder, FrameError, complete_frames_end,
+                     encode_frame, recv_frame, recv_into_exactly)
 
-def handle_client(client_socket, address):
-    print(f"New connection from {address}")
+class Sampler:
+    """Prints every Nth received message: 0 disables per-message output, 1 prints all."""
+
+    def __init__(self, every):
+        self.every = every
+        self.counter = itertools.count(1)
+
+    def received(self, address, data):
+        if self.every and next(self.counter) % self.every == 0:
+            preview = bytes(data[:64]).decode(errors='replace')
+            print(f"Received from {address}: {preview}" + (f"... ({len(data)} bytes)" if len(data) > 64 else ""))
+
+class BufferPool:
+    """Preallocated receive buffers shared by connections so the echo path does not allocate per message."""
+
+    def __init__(self, size=65536, max_free=1024):
+        self.size = size
+        self.max_free = max_free
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self, min_size=0):
+        with self.lock:
+            buf = self.free.pop() if self.free else None
+        if buf is None or len(buf) < min_size:
+            buf = bytearray(max(self.size, min_size))
+        return buf
+
+    def release(self, buf):
+        # Oversized buffers from huge frames are dropped rather than pinned in the pool.
+        if len(buf) > self.size * 64:
+            return
+        with self.lock:
+            if len(self.free) < self.max_free:
+                self.free.append(buf)
+
+def handle_client(client_socket, address, verbose=True, framed=True, sampler=None):
+    if verbose:
+        print(f"New connection from {address}")
     while True:
         try:
+            if framed:
+                data = recv_frame(client_socket)
+                if data is None:
+                    break
+                if sampler:
+                    sampler.received(address, data)
+                client_socket.sendall(encode_frame(data))
+                continue
             data = client_socket.recv(1024)
             if not data:
                 break
-            print(f"Received from {address}: {data.decode()}")
-            client_socket.send(data)
+            if sampler:
+                sampler.received(address, data)
+            client_socket.sendall(data)
         except:
             break
-    print(f"Connection closed from {address}")
+    if verbose:
+        print(f"Connection closed from {address}")
     client_socket.close()
 
-def main():
-    HOST = '0.0.0.0'
-    PORT = 12345
-
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
-    server.listen(5)
-    print(f"Server listening on {HOST}:{PORT}")
+def handle_client_pooled(client_socket, address, pool, verbose=True, framed=True, sampler=None):
+    """Echo through a pooled buffer: recv_into + sendall of a memoryview, no per-message bytes or str."""
+    if verbose:
+        print(f"New connection from {address}")
+    buf = pool.acquire()
+    view = memoryview(buf)
+    try:
+        while True:
+            if framed:
+                # Header and payload land next to each other, so the whole frame is echoed with one sendall.
+                if not recv_into_exactly(client_socket, view[:HEADER.size]):
+                    break
+                (size,) = HEADER.unpack_from(buf)
+                if size > MAX_FRAME:
+                    break
+                end = HEADER.size + size
+                if end > len(buf):
+                    view.release()
+                    pool.release(buf)
+                    buf = pool.acquire(end)
+                    view = memoryview(buf)
+                    HEADER.pack_into(buf, 0, size)
+                if size and not recv_into_exactly(client_socket, view[HEADER.size:end]):
+                    break
+                if sampler:
+                    sampler.received(address, view[HEADER.size:end])
+            else:
+                end = client_socket.recv_into(view)
+                if not end:
+                    break
+                if sampler:
+                    sampler.received(address, view[:end])
+            client_socket.sendall(view[:end])
+    except (OSError, FrameError):
+        pass
+    finally:
+        view.release()
+        pool.release(buf)
+        client_socket.close()
+    if verbose:
+        print(f"Connection closed from {address}")
 
+def serve_threaded(server, verbose=True, framed=True, sampler=None, pool=None):
+    """One OS thread per accepted connection."""
     while True:
         try:
             client_socket, address = server.accept()
-            client_handler = threading.Thread(
-                target=handle_client,
-                args=(client_socket, address)
-            )
+            if pool is not None:
+                target, args = handle_client_pooled, (client_socket, address, pool, verbose, framed, sampler)
+            else:
+                target, args = handle_client, (client_socket, address, verbose, framed, sampler)
+            client_handler = threading.Thread(target=target, args=args, daemon=True)
             client_handler.start()
         except KeyboardInterrupt:
             print("\nShutting down server...")
             break
 
+def serve_selectors(server, verbose=True, framed=True, sampler=None, pooled=False):
+    """Single-threaded event loop: one selector multiplexes every connection."""
+    sel = selectors.DefaultSelector()
+    server.setblocking(False)
+    sel.register(server, selectors.EVENT_READ, None)
+    # Per-connection bytes that the kernel did not accept yet.
+    pending = {}
+    decoders = {}
+    # Pooled mode: the loop is single-threaded, so one preallocated buffer serves every recv_into;
+    # only the tail of a frame split across reads is kept per connection.
+    read_buf = bytearray(65536) if pooled else None
+    read_view = memoryview(read_buf) if pooled else None
+    partials = {}
+
+    def close(conn):
+        sel.unregister(conn)
+        pending.pop(conn, None)
+        decoders.pop(conn, None)
+        partials.pop(conn, None)
+        conn.close()
+
+    def echo(conn, data):
+        """Send straight from data while nothing is queued; copy only what the kernel did not take."""
+        if not pending[conn]:
+            try:
+                sent = conn.send(data)
+            except BlockingIOError:
+                sent = 0
+            data = data[sent:]
+        pending[conn] += data
+
+    def read_pooled(conn, address):
+        n = conn.recv_into(read_view)
+        if not n:
+            return False
+        if not framed:
+            if sampler:
+                sampler.received(address, read_view[:n])
+            echo(conn, read_view[:n])
+            return True
+        partial = partials[conn]
+        if not partial:
+            end = echo_frames(conn, address, read_view[:n])
+            partial += read_view[end:n]
+            return True
+        partial += read_view[:n]
+        # Echo straight out of the accumulated buffer; the view must be gone before the bytearray shrinks.
+        with memoryview(partial) as data:
+            end = echo_frames(conn, address, data)
+        del partial[:end]
+        return True
+
+    def echo_frames(conn, address, data):
+        """Echo every complete frame in data, sampling each with its own payload; returns the bytes consumed."""
+        end, _ = complete_frames_end(data)
+        if sampler:
+            offset = 0
+            while offset < end:
+                (size,) = HEADER.unpack_from(data, offset)
+                start = offset + HEADER.size
+                offset = start + size
+                sampler.received(address, data[start:offset])
+        if end:
+            echo(conn, data[:end])
+        return end
+
+    try:
+        while True:
+            for key, mask in sel.select():
+                if key.data is None:
+                    # Accept everything that is queued, not just one connection per wakeup.
+                    while True:
+                        try:
+                            conn, address = server.accept()
+                        except BlockingIOError:
+                            break
+                        conn.setblocking(False)
+                        pending[conn] = bytearray()
+                        if pooled:
+                            partials[conn] = bytearray()
+                        elif framed:
+                            decoders[conn] = FrameDecoder()
+                        sel.register(conn, selectors.EVENT_READ, address)
+                        if verbose:
+                            print(f"New connection from {address}")
+                    continue
+
+                conn, address = key.fileobj, key.data
+                if mask & selectors.EVENT_READ and pooled:
+                    try:
+                        alive = read_pooled(conn, address)
+                    except FrameError as e:
+                        print(f"Protocol error from {address}: {e}")
+                        alive = False
+                    except ConnectionError:
+                        alive = False
+                    if not alive:
+                        if verbose:
+                            print(f"Connection closed from {address}")
+                        close(conn)
+                        continue
+                elif mask & selectors.EVENT_READ:
+                    try:
+                        data = conn.recv(65536)
+                    except ConnectionError:
+                        data = b""
+                    if not data:
+                        if verbose:
+                            print(f"Connection closed from {address}")
+                        close(conn)
+                        continue
+                    if framed:
+                        try:
+                            frames = decoders[conn].feed(data)
+                        except FrameError as e:
+                            print(f"Protocol error from {address}: {e}")
+                            close(conn)
+                            continue
+                        for frame in frames:
+                            if sampler:
+                                sampler.received(address, frame)
+                            pending[conn] += encode_frame(frame)
+                    else:
+                        if sampler:
+                            sampler.received(address, data)
+                        pending[conn] += data
+                if pending[conn]:
+                    try:
+                        sent = conn.send(pending[conn])
+                    except BlockingIOError:
+                        sent = 0
+                    except ConnectionError:
+                        close(conn)
+                        continue
+                    del pending[conn][:sent]
+                # Wait for writability only while there is something left to flush.
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending[conn] else 0)
+                if events != key.events:
+                    sel.modify(conn, events, address)
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        sel.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Echo server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--mode", choices=["threaded", "selectors"], default="threaded",
+                        help="thread per connection, or a single selectors event loop")
+    parser.add_argument("--backlog", type=int, default=5,
+                        help="listen() backlog; raise it for many simultaneous connects")
+    parser.add_argument("--framing", choices=["length", "raw"], default="length",
+                        help="4-byte length-prefixed frames, or raw recv(1024) chunks")
+    parser.add_argument("--io", choices=["copy", "pooled"], default="copy",
+                        help="allocate per recv, or recv_into preallocated buffers and echo memoryviews")
+    parser.add_argument("--sample", type=int, default=1,
+                        help="print every Nth received message (0 = never)")
+    parser.add_argument("--quiet", action="store_true", help="do not print connection or message events")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((args.host, args.port))
+    server.listen(args.backlog)
+    print(f"Server listening on {args.host}:{args.port} "
+          f"({args.mode}, {args.framing} framing, {args.io} io, backlog {args.backlog})", flush=True)
+
+    framed = args.framing == "length"
+    verbose = not args.quiet
+    sampler = Sampler(args.sample) if verbose and args.sample else None
+    if args.mode == "selectors":
+        serve_selectors(server, verbose=verbose, framed=framed, sampler=sampler, pooled=args.io == "pooled")
+    else:
+        pool = BufferPool() if args.io == "pooled" else None
+        serve_threaded(server, verbose=verbose, framed=framed, sampler=sampler, pool=pool)
+
     server.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
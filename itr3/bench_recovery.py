@@ -0,0 +1,328 @@
+"""Бенчмарк наздоганяння: скільки часу вторинному вузлу треба, щоб зійтися з
+майстром після простою.
+
+Запускає локально справжні master.py та два secondary.py (майстер на портах
+5000/50050, як у коді) і:
+
+  1. зупиняє secondary2;
+  2. пише backlog записів пакетами через client.Client (w=--backlog-w);
+  3. чекає, доки secondary1 підтвердить увесь лог, і --baseline секунд міряє
+     затримку живих записів без відновлення;
+  4. запускає secondary2 знову (той самий DATA_DIR, тож він надсилає SYNC зі
+     своїм applied_through) і чекає, доки майстер отримає від нього ACK до
+     останнього id, записаного до перезапуску.
+
+Увесь gRPC-трафік secondary2 (майстер -> вузол і вузол -> майстер, зокрема
+FetchRange) іде через TCP-проксі, що рахують байти. Під час кроків 3–4 окремий
+потік пише живі записи з частотою --live-rate і w=--live-w.
+
+    python bench_recovery.py --backlog 10000
+    python bench_recovery.py --backlog 100000
+    python bench_recovery.py --backlog 1000000 --baseline 5
+    python bench_recovery.py --backlog 100000 --env APPLY_BATCH_SIZE=10000 --env ACK_MODE=received
+
+Орієнтир (один хост, повідомлення по 100 байтів, типові налаштування): backlog
+10k сходиться за ~10 с (~1000 записів/с), 100k — за ~79 с (~1270 записів/с),
+1M — за ~611 с (~1640 записів/с, ~250 байтів трафіку на запис); p99 живих
+записів під час відновлення лишається на рівні baseline.
+
+Звіт: час до збіжності та записів/с, байти в обидва боки (і на запис),
+p50/p95/p99 затримки живих записів до та під час відновлення, їхні помилки.
+Імітовані затримки та збої вторинних вузлів вимкнено (SIMULATED_FAILURE_RATE=0,
+APPLY_DELAY_SECONDS=0), щоб міряти саме наздоганяння; повернути їх можна через
+--env, наприклад --env SIMULATED_FAILURE_RATE=0.1 --env APPLY_DELAY_SECONDS=5,10.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from client import Client
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MASTER_HTTP, MASTER_GRPC = 5000, 50050
+SECONDARIES = {
+    # ім'я: (HTTP-порт, gRPC-порт, на якому вузол слухає насправді)
+    "secondary1": (5001, 50051),
+    "secondary2": (5002, 50062),
+}
+# Адреси, які бачить майстер / вузол; для secondary2 це проксі, що рахують байти.
+SECONDARY2_ADDRESS = "localhost:50052"
+SECONDARY2_MASTER_PROXY = 50060
+
+
+class CountingProxy:
+    """TCP-проксі listen_port -> target_port, що рахує байти в обох напрямках."""
+
+    def __init__(self, listen_port, target_port):
+        self.target_port = target_port
+        self.lock = threading.Lock()
+        self.sent = 0       # від клієнта проксі до цілі
+        self.received = 0   # від цілі до клієнта
+        self.server = socket.create_server(("127.0.0.1", listen_port), reuse_port=True)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.sent = self.received = 0
+
+    def totals(self):
+        with self.lock:
+            return self.sent, self.received
+
+    def _accept(self):
+        while True:
+            client, _ = self.server.accept()
+            try:
+                upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            except OSError:
+                client.close()
+                continue
+            threading.Thread(target=self._pump, args=(client, upstream, "sent"), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, "received"), daemon=True).start()
+
+    def _pump(self, source, target, counter):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                target.sendall(data)
+                with self.lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+        except OSError:
+            pass
+        finally:
+            for sock in (source, target):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def get_json(port, path, timeout=10):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        conn.close()
+
+
+def wait_http(port, path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            get_json(port, path, timeout=2)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Процес на порту {port} не відповів за {timeout} с")
+
+
+class Cluster:
+    def __init__(self, workdir, extra_env):
+        self.workdir = workdir
+        self.extra_env = extra_env
+        self.processes = {}
+
+    def env(self, **values):
+        env = dict(os.environ, LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+                   SIMULATED_FAILURE_RATE="0", APPLY_DELAY_SECONDS="0")
+        env.update(self.extra_env)
+        env.update({key: str(value) for key, value in values.items()})
+        return env
+
+    def start(self, name):
+        if name == "master":
+            env = self.env(SECONDARY_ADDRESSES=f"localhost:{SECONDARIES['secondary1'][1]},{SECONDARY2_ADDRESS}")
+            script, port = "master", MASTER_HTTP
+        else:
+            http_port, grpc_port = SECONDARIES[name]
+            node_address = SECONDARY2_ADDRESS if name == "secondary2" else f"localhost:{grpc_port}"
+            master_port = SECONDARY2_MASTER_PROXY if name == "secondary2" else MASTER_GRPC
+            env = self.env(HTTP_PORT=http_port, GRPC_PORT=grpc_port, NODE_ADDRESS=node_address,
+                           MASTER_ADDRESS=f"localhost:{master_port}",
+                           DATA_DIR=os.path.join(self.workdir, name))
+            script, port = "secondary", http_port
+        log_file = open(os.path.join(self.workdir, f"{name}.log"), "a")
+        self.processes[name] = subprocess.Popen([sys.executable, f"{script}.py"], cwd=os.path.join(ROOT, script),
+                                                env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        wait_http(port, "/messages" if name != "master" else "/limits")
+
+    def stop(self, name):
+        process = self.processes.pop(name)
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stop_all(self):
+        for name in list(self.processes):
+            self.stop(name)
+
+
+class LiveWriter:
+    """Пише по одному запису з заданою частотою й запам'ятовує (фаза, затримка, статус)."""
+
+    def __init__(self, rate, w):
+        self.interval = 1 / rate if rate > 0 else None
+        self.w = w
+        self.phase = "baseline"
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.interval:
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _run(self):
+        sequence = 0
+        body_prefix = {"w": self.w}
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            phase = self.phase
+            # Пакетний ендпоінт відповідає лише id, а не всім логом, як POST /messages.
+            body = json.dumps(dict(body_prefix, messages=[f"live-{sequence}"]))
+            conn = http.client.HTTPConnection("127.0.0.1", MASTER_HTTP, timeout=120)
+            try:
+                conn.request("POST", "/messages/batch", body, {"Content-Type": "application/json"})
+                status = conn.getresponse().status
+            except OSError:
+                status = None
+            finally:
+                conn.close()
+            self.samples.append((phase, time.monotonic() - started, status))
+            sequence += 1
+            self.stopped.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def report(self, phase):
+        latencies = sorted(latency for sample_phase, latency, status in self.samples
+                           if sample_phase == phase and status == 200)
+        errors = sum(1 for sample_phase, _, status in self.samples if sample_phase == phase and status != 200)
+        if not latencies:
+            return f"{phase:>9}: немає успішних записів, помилок {errors}"
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+        return (f"{phase:>9}: {len(latencies)} записів, p50 {percentile(50):.0f} мс, p95 {percentile(95):.0f} мс, "
+                f"p99 {percentile(99):.0f} мс, помилок {errors}")
+
+
+def master_state(addr):
+    _, limits = get_json(MASTER_HTTP, "/limits")
+    return limits["acked_through"][addr], limits
+
+
+def wait_acked(addr, target, timeout, progress=None):
+    """Чекає, доки майстер отримає від addr ACK до id target; повертає витрачений час."""
+    started = time.monotonic()
+    last_report = started
+    while True:
+        acked, _ = master_state(addr)
+        if acked >= target:
+            return time.monotonic() - started
+        now = time.monotonic()
+        if now - started > timeout:
+            raise TimeoutError(f"{addr} підтвердив лише до id {acked} з {target} за {timeout} с")
+        if progress and now - last_report >= 5:
+            print(f"  {progress}: підтверджено до id {acked} з {target}", flush=True)
+            last_report = now
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backlog", type=int, default=10000, help="записів, поки secondary2 недоступний")
+    parser.add_argument("--message-size", type=int, default=100, help="байтів у повідомленні")
+    parser.add_argument("--batch", type=int, default=1000, help="розмір пакета для запису backlog")
+    parser.add_argument("--backlog-w", type=int, default=1, help="write concern при записі backlog")
+    parser.add_argument("--live-rate", type=float, default=10, help="живих записів за секунду (0 — вимкнено)")
+    parser.add_argument("--live-w", type=int, default=2, help="write concern живих записів")
+    parser.add_argument("--baseline", type=float, default=10, help="секунд виміру живих записів до відновлення")
+    parser.add_argument("--timeout", type=float, default=3600, help="межа очікування кожного етапу, с")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="змінна середовища для всіх процесів (можна повторювати)")
+    parser.add_argument("--keep", action="store_true", help="не видаляти тимчасовий каталог із логами")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    workdir = tempfile.mkdtemp(prefix="bench-recovery-")
+    cluster = Cluster(workdir, extra_env)
+    to_secondary = CountingProxy(int(SECONDARY2_ADDRESS.rsplit(":", 1)[1]), SECONDARIES["secondary2"][1])
+    to_master = CountingProxy(SECONDARY2_MASTER_PROXY, MASTER_GRPC)
+    live = LiveWriter(args.live_rate, args.live_w)
+    secondary1 = f"localhost:{SECONDARIES['secondary1'][1]}"
+    try:
+        print(f"Каталог запуску: {workdir}", flush=True)
+        for name in ("master", "secondary1", "secondary2"):
+            cluster.start(name)
+        cluster.stop("secondary2")
+
+        payload = "x" * args.message_size
+        print(f"Запис backlog: {args.backlog} записів по {args.message_size} байтів", flush=True)
+        started = time.monotonic()
+        with Client(f"127.0.0.1:{MASTER_HTTP}", w=args.backlog_w, batch_size=args.batch) as client:
+            futures = [client.append(payload) for _ in range(args.backlog)]
+            ids = [future.result() for future in futures]
+        print(f"  записано за {time.monotonic() - started:.1f} с", flush=True)
+        target = max(ids)
+        wait_acked(secondary1, target, args.timeout, progress="secondary1")
+
+        live.start()
+        time.sleep(args.baseline)
+        _, limits = master_state(SECONDARY2_ADDRESS)
+        target = max(target, limits["acked_through"][secondary1])
+        lag = limits["backlog"][SECONDARY2_ADDRESS]
+
+        print(f"Відновлення secondary2: відставання {lag} записів", flush=True)
+        to_secondary.reset()
+        to_master.reset()
+        live.phase = "recovery"
+        started = time.monotonic()
+        cluster.start("secondary2")
+        wait_acked(SECONDARY2_ADDRESS, target, args.timeout, progress="secondary2")
+        elapsed = time.monotonic() - started
+        live.stop()
+
+        sent, received = to_secondary.totals()
+        fetch_sent, fetch_received = to_master.totals()
+        total = sent + received + fetch_sent + fetch_received
+        print()
+        print(f"Збіжність secondary2: {elapsed:.1f} с, {lag / elapsed:.0f} записів/с (відставання {lag})")
+        print(f"Майстер -> secondary2: {sent / 1e3:.1f} КБ запитів, {received / 1e3:.1f} КБ відповідей")
+        print(f"secondary2 -> майстер (SYNC, FetchRange, ACK): {fetch_sent / 1e3:.1f} КБ запитів, "
+              f"{fetch_received / 1e3:.1f} КБ відповідей")
+        print(f"Разом {total / 1e3:.1f} КБ, {total / max(lag, 1):.0f} байтів на запис "
+              f"(корисне навантаження {args.message_size} байтів)")
+        print("Живі записи:")
+        print(live.report("baseline"))
+        print(live.report("recovery"))
+    finally:
+        live.stop()
+        cluster.stop_all()
+        if args.keep:
+            print(f"Логи процесів: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
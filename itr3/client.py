@@ -0,0 +1,479 @@
+"""Клієнт для майстра itr3: синхронний (Client) та asyncio (AsyncClient).
+
+Обидва тримають пул keep-alive з'єднань, збирають append() у мікропакети для
+POST /messages/batch (до batch_size записів або linger_ms очікування) і
+надсилають кілька пакетів паралельно. append() одразу повертає future, що
+отримує id запису, коли для нього виконано write concern, або WriteError.
+
+    with Client("http://localhost:5000", w=2) as client:
+        futures = [client.append(f"msg {i}") for i in range(10000)]
+        ids = [f.result() for f in futures]
+        entries, cursor = client.read(cursor=0)
+
+    async with AsyncClient("http://localhost:5000", w=2) as client:
+        ids = await asyncio.gather(*(client.append(f"msg {i}") for i in range(10000)))
+        async for entry in client.iter_entries(cursor=0):
+            ...
+
+Кожен пакет несе власний Idempotency-Key, тож повтор після обірваного
+з'єднання, таймауту чи 429/503 (з паузою Retry-After) не створює дублікатів;
+пакет повторюється до max_retries разів.
+Читання інкрементне: GET /messages?cursor=N повертає записи в порядку
+додавання та курсор, з якого продовжити.
+
+Лише стандартна бібліотека Python.
+"""
+import asyncio
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+RETRY_STATUSES = (429, 503)
+# Помилки, після яких невідомо, чи дійшов пакет до майстра: повторюємо з тим самим Idempotency-Key.
+RETRY_ERRORS = (OSError, http.client.HTTPException)
+ASYNC_RETRY_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+
+class WriteError(Exception):
+    """Майстер не підтвердив запис: status та body — відповідь HTTP (status None, якщо її не було)."""
+
+    def __init__(self, status, body):
+        super().__init__(f"{status}: {body.get('error', body) if isinstance(body, dict) else body}")
+        self.status = status
+        self.body = body
+
+
+def _split_url(base_url):
+    url = urlsplit(base_url if "//" in base_url else "http://" + base_url)
+    return url.hostname, url.port or 80
+
+
+def _batch_payload(batch, w, timeout_ms, ack):
+    payload = {"messages": batch, "w": w}
+    if timeout_ms is not None:
+        payload["timeout_ms"] = timeout_ms
+    if ack is not None:
+        payload["ack"] = ack
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _resolve(futures, status, body):
+    """Передає результат пакета в future кожного запису."""
+    if status == 200:
+        for future, msg_id in zip(futures, body["ids"]):
+            if not future.done():
+                future.set_result(msg_id)
+        return
+    error = WriteError(status, body)
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
+
+
+def _retry_after(headers, attempt):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return min(2 ** attempt * 0.1, 5)
+
+
+def _decode(data):
+    try:
+        return json.loads(data) if data else {}
+    except ValueError:
+        return {"error": data.decode("utf-8", "replace")}
+
+
+class Client:
+    """Синхронний клієнт; потокобезпечний, один екземпляр на процес-продюсер."""
+
+    def __init__(self, base_url="http://localhost:5000", w=1, ack=None, timeout_ms=None, batch_size=100,
+                 linger_ms=5, pool_size=8, request_timeout=90, max_retries=5):
+        self.host, self.port = _split_url(base_url)
+        self.w, self.ack, self.timeout_ms = w, ack, timeout_ms
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="client-batch")
+        # Не більше pool_size пакетів у польоті: якщо майстер не встигає, наступні записи накопичуються в черзі.
+        self.inflight = threading.BoundedSemaphore(pool_size)
+        self.pending = queue.Queue()
+        self.outstanding = set()
+        self.outstanding_lock = threading.Lock()
+        self.closed = False
+        self.batcher = threading.Thread(target=self._batch_loop, name="client-batcher", daemon=True)
+        self.batcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, method, path, body=None, headers=None):
+        """Один запит через з'єднання з пулу; повертає (status, розібраний JSON, заголовки)."""
+        headers = dict(headers or {})
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        for fresh in (False, True):
+            conn = None
+            if not fresh:
+                try:
+                    conn = self.pool.get_nowait()
+                except queue.Empty:
+                    fresh = True
+            if conn is None:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.request_timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # Сервер закрив з'єднання, що простоювало в пулі: повторюємо на новому.
+                if fresh:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self.pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, _decode(data), response.headers
+
+    def append(self, message):
+        """Ставить запис у наступний пакет; future отримає id або WriteError."""
+        if self.closed:
+            raise RuntimeError("Клієнт закрито")
+        future = Future()
+        with self.outstanding_lock:
+            self.outstanding.add(future)
+        future.add_done_callback(self._forget)
+        self.pending.put((message, future))
+        return future
+
+    def write(self, message):
+        """Записує одне повідомлення й чекає на write concern; повертає id."""
+        return self.append(message).result()
+
+    def _forget(self, future):
+        with self.outstanding_lock:
+            self.outstanding.discard(future)
+
+    def _batch_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.pending.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.put(None)
+                    break
+                batch.append(item)
+            self.inflight.acquire()
+            self.executor.submit(self._send_batch, batch)
+
+    def _send_batch(self, batch):
+        futures = [future for _, future in batch]
+        try:
+            body = _batch_payload([message for message, _ in batch], self.w, self.timeout_ms, self.ack)
+            headers = {"Idempotency-Key": uuid.uuid4().hex}
+            for attempt in range(self.max_retries + 1):
+                try:
+                    status, reply, response_headers = self._request("POST", "/messages/batch", body, headers)
+                except RETRY_ERRORS:
+                    # Обірване з'єднання чи таймаут: пакет міг дійти до майстра, тож повтор
+                    # іде з тим самим Idempotency-Key.
+                    if attempt == self.max_retries:
+                        raise
+                    time.sleep(_retry_after({}, attempt))
+                    continue
+                if status not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                time.sleep(_retry_after(response_headers, attempt))
+            _resolve(futures, status, reply)
+        except Exception as e:
+            _resolve(futures, None, {"error": str(e)})
+        finally:
+            self.inflight.release()
+
+    def flush(self, timeout=None):
+        """Чекає, доки всі вже поставлені записи отримають результат."""
+        with self.outstanding_lock:
+            waiting = list(self.outstanding)
+        for future in waiting:
+            try:
+                future.result(timeout)
+            except WriteError:
+                pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.pending.put(None)
+        self.batcher.join()
+        self.executor.shutdown()
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+    def messages(self):
+        """Увесь лог (GET /messages)."""
+        status, body, _ = self._request("GET", "/messages")
+        if status != 200:
+            raise WriteError(status, body)
+        return body["messages"]
+
+    def read(self, cursor=0, limit=None):
+        """Записи з позиції cursor: повертає ([{"id", "message"}, ...], курсор наступного читання)."""
+        path = f"/messages?cursor={cursor}" + (f"&limit={limit}" if limit else "")
+        status, body, _ = self._request("GET", path)
+        if status != 200:
+            raise WriteError(status, body)
+        return body["entries"], body["cursor"]
+
+    def iter_entries(self, cursor=0, follow=False, poll_interval=0.5):
+        """Генератор записів від cursor; з follow=True чекає на нові записи замість завершення."""
+        while True:
+            entries, cursor = self.read(cursor)
+            yield from entries
+            if not entries:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+
+
+class _AsyncConnection:
+    """Мінімальне HTTP/1.1 з'єднання поверх asyncio streams (лише JSON-відповіді майстра)."""
+
+    def __init__(self, reader, writer, host):
+        self.reader, self.writer, self.host = reader, writer, host
+
+    async def request(self, method, path, body=None, headers=None):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body or b'')}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Сервер закрив з'єднання")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            response_headers[name.strip().title()] = value.strip()
+        if response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            data = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                data += await self.reader.readexactly(size)
+                await self.reader.readline()
+        elif "Content-Length" in response_headers:
+            data = await self.reader.readexactly(int(response_headers["Content-Length"]))
+        else:
+            data = await self.reader.read()
+            response_headers["Connection"] = "close"
+        reusable = version == "HTTP/1.1" and response_headers.get("Connection", "").lower() != "close"
+        return int(status), _decode(bytes(data)), response_headers, reusable
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncClient:
+    """asyncio-клієнт з тими самими можливостями; створюється й використовується в одному циклі подій."""
+
+    def __init__(self, base_url="http://localhost:5000", w=1, ack=None, timeout_ms=None, batch_size=100,
+                 linger_ms=5, pool_size=8, request_timeout=90, max_retries=5):
+        self.host, self.port = _split_url(base_url)
+        self.w, self.ack, self.timeout_ms = w, ack, timeout_ms
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.address = None
+        self.idle = []
+        # Черга, семафор і фонове завдання створюються при першому append(): у Python 3.9
+        # примітиви asyncio прив'язуються до циклу подій у момент створення.
+        self.slots = None
+        self.pending = None
+        self.batcher = None
+        self.outstanding = set()
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def _connect(self):
+        # Адресу, до якої вдалося під'єднатися, запам'ятовуємо: інакше кожне нове з'єднання
+        # знову проходить getaddrinfo і, для "localhost", відмову на ::1.
+        if self.address is not None:
+            reader, writer = await asyncio.open_connection(*self.address)
+            return _AsyncConnection(reader, writer, f"{self.host}:{self.port}")
+        infos = await asyncio.get_running_loop().getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        error = None
+        for *_, address in infos:
+            try:
+                reader, writer = await asyncio.open_connection(*address[:2])
+            except OSError as e:
+                error = e
+                continue
+            self.address = address[:2]
+            return _AsyncConnection(reader, writer, f"{self.host}:{self.port}")
+        raise error or OSError(f"Не вдалося визначити адресу {self.host}")
+
+    async def _request(self, method, path, body=None, headers=None):
+        for fresh in (False, True):
+            conn = None if fresh or not self.idle else self.idle.pop()
+            if conn is None:
+                fresh = True
+                conn = await asyncio.wait_for(self._connect(), self.request_timeout)
+            try:
+                status, reply, response_headers, reusable = await asyncio.wait_for(
+                    conn.request(method, path, body, headers), self.request_timeout)
+            except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                conn.close()
+                # Сервер закрив з'єднання, що простоювало в пулі: повторюємо на новому.
+                if fresh:
+                    raise
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            if reusable:
+                self.idle.append(conn)
+            else:
+                conn.close()
+            return status, reply, response_headers
+
+    def append(self, message):
+        """Ставить запис у наступний пакет; повертає asyncio.Future з id або WriteError."""
+        if self.closed:
+            raise RuntimeError("Клієнт закрито")
+        if self.batcher is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+            self.pending = asyncio.Queue()
+            self.batcher = asyncio.ensure_future(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        self.outstanding.add(future)
+        future.add_done_callback(self.outstanding.discard)
+        self.pending.put_nowait((message, future))
+        return future
+
+    async def write(self, message):
+        return await self.append(message)
+
+    async def _batch_loop(self):
+        while True:
+            item = await self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(self.pending.get(), max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    self.pending.put_nowait(None)
+                    break
+                batch.append(item)
+            # Не більше pool_size пакетів у польоті.
+            await self.slots.acquire()
+            asyncio.ensure_future(self._send_batch(batch))
+
+    async def _send_batch(self, batch):
+        futures = [future for _, future in batch]
+        try:
+            body = _batch_payload([message for message, _ in batch], self.w, self.timeout_ms, self.ack)
+            headers = {"Idempotency-Key": uuid.uuid4().hex}
+            for attempt in range(self.max_retries + 1):
+                try:
+                    status, reply, response_headers = await self._request("POST", "/messages/batch", body,
+                                                                          headers)
+                except ASYNC_RETRY_ERRORS:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(_retry_after({}, attempt))
+                    continue
+                if status not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                await asyncio.sleep(_retry_after(response_headers, attempt))
+            _resolve(futures, status, reply)
+        except Exception as e:
+            _resolve(futures, None, {"error": str(e)})
+        finally:
+            self.slots.release()
+
+    async def flush(self):
+        """Чекає, доки всі вже поставлені записи отримають результат."""
+        if self.outstanding:
+            await asyncio.wait(list(self.outstanding))
+
+    async def aclose(self):
+        if self.closed:
+            return
+        await self.flush()
+        self.closed = True
+        if self.batcher is not None:
+            self.pending.put_nowait(None)
+            await self.batcher
+        while self.idle:
+            self.idle.pop().close()
+
+    async def messages(self):
+        status, body, _ = await self._request("GET", "/messages")
+        if status != 200:
+            raise WriteError(status, body)
+        return body["messages"]
+
+    async def read(self, cursor=0, limit=None):
+        path = f"/messages?cursor={cursor}" + (f"&limit={limit}" if limit else "")
+        status, body, _ = await self._request("GET", path)
+        if status != 200:
+            raise WriteError(status, body)
+        return body["entries"], body["cursor"]
+
+    async def iter_entries(self, cursor=0, follow=False, poll_interval=0.5):
+        while True:
+            entries, cursor = await self.read(cursor)
+            for entry in entries:
+                yield entry
+            if not entries:
+                if not follow:
+                    return
+                await asyncio.sleep(poll_interval)
@@ -0,0 +1,143 @@
+"""Багатопроцесний прийом HTTP-запитів зі спільним секвенсором.
+
+Процеси-обробники (ingest workers) слухають один і той самий HTTP-порт через
+SO_REUSEPORT, розбирають та перевіряють JSON і пересилають готові записи
+єдиному процесу-секвенсору через Unix-сокет. Секвенсор призначає id,
+додає запис у лог і займається реплікацією, тож загальний порядок
+повідомлень зберігається.
+
+Кадр IPC: 4 байти довжини (big-endian) + JSON; бінарні записи в ньому — {"base64": ...}
+(logentry.dumps).
+"""
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import logentry
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!I")
+
+
+def send_frame(sock, obj):
+    payload = logentry.dumps(obj).encode("utf-8")
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Сокет закрито посеред кадру")
+        received += n
+    return buf
+
+
+def recv_frame(sock):
+    """Повертає None, якщо співрозмовник закрив з'єднання між кадрами."""
+    try:
+        header = recv_exactly(sock, HEADER.size)
+    except ConnectionError:
+        return None
+    (size,) = HEADER.unpack(header)
+    return logentry.loads(recv_exactly(sock, size))
+
+
+def bind_sequencer(socket_path, dispatch):
+    """Створює Unix-сокет секвенсора, що виконує запити через dispatch(request) -> (body, status).
+
+    Сокет слухає одразу після створення, тож його треба відкрити до fork обробників:
+    запити, що прийшли до serve_forever, просто чекають у черзі прийому.
+    """
+
+    class SequencerHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    request = recv_frame(self.request)
+                except (ConnectionError, OSError):
+                    return
+                if request is None:
+                    return
+                body, status = dispatch(request)
+                send_frame(self.request, {"body": body, "status": status})
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, SequencerHandler)
+    server.daemon_threads = True
+    return server
+
+
+def run_sequencer(server):
+    log.info("Секвенсор слухає %s", server.server_address)
+    server.serve_forever()
+
+
+class SequencerClient:
+    """Пул постійних з'єднань від обробника до секвенсора."""
+
+    def __init__(self, socket_path, pool_size=64):
+        self.socket_path = socket_path
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        return sock
+
+    def call(self, request):
+        try:
+            sock = self.pool.get_nowait()
+        except queue.Empty:
+            sock = self._connect()
+        try:
+            send_frame(sock, request)
+            reply = recv_frame(sock)
+            if reply is None:
+                raise ConnectionError("Секвенсор закрив з'єднання")
+        except Exception:
+            sock.close()
+            raise
+        try:
+            self.pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+        return reply["body"], reply["status"]
+
+
+def reuseport_socket(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def exit_with_parent(parent_pid, interval=1.0):
+    """Завершує обробник, якщо секвенсор загинув, щоб сироти не тримали HTTP-порт."""
+    while True:
+        time.sleep(interval)
+        if os.getppid() != parent_pid:
+            os._exit(0)
+
+
+def serve_worker(app, host, port):
+    """Запускає HTTP-сервер обробника на власному сокеті з SO_REUSEPORT."""
+    threading.Thread(target=exit_with_parent, args=(os.getppid(),), daemon=True).start()
+    sock = reuseport_socket(host, port)
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    log.info("Обробник %d слухає %s:%d", os.getpid(), host, port)
+    server.serve_forever()
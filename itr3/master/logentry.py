@@ -0,0 +1,65 @@
+"""Запис логу: текст (str) або бінарний вміст (bytes).
+
+Бінарний запис зберігається й реплікується як є: у protobuf він їде в полі
+payload (LogEntry, MessageRequest), у msgpack — типом bin. Base64 з'являється
+лише там, де без нього ніяк, — у JSON (відповіді HTTP, рядки логу на диску,
+кадри IPC обробників): там бінарний запис має вигляд {"base64": "..."}.
+
+Файл однаковий для майстра та вторинних вузлів (копія, як і replication_pb2).
+"""
+import base64
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+import replication_pb2
+
+
+def entry_proto(msg_id, message):
+    """LogEntry: текст — у message, бінарний вміст — у payload."""
+    if isinstance(message, bytes):
+        return replication_pb2.LogEntry(id=msg_id, payload=message)
+    return replication_pb2.LogEntry(id=msg_id, message=message)
+
+
+def entry_message(entry):
+    """Вміст LogEntry чи MessageRequest: payload, якщо його задано, інакше текст."""
+    return entry.payload if entry.HasField("payload") else entry.message
+
+
+def message_request(msg_id, message):
+    """MessageRequest для ReplicateMessage: id завжди в префіксі "<id>:" поля message."""
+    if isinstance(message, bytes):
+        return replication_pb2.MessageRequest(message=f"{msg_id}:", payload=message)
+    return replication_pb2.MessageRequest(message=f"{msg_id}:{message}")
+
+
+def json_default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return {"base64": base64.b64encode(obj).decode("ascii")}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_object_hook(obj):
+    """Зворотне до json_default: {"base64": ...} знову стає bytes."""
+    if len(obj) == 1 and "base64" in obj:
+        return base64.b64decode(obj["base64"])
+    return obj
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=json_default)
+
+
+def loads(data):
+    return json.loads(data, object_hook=json_object_hook)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """flask.jsonify, що віддає бінарні записи як {"base64": ...}."""
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, (bytes, bytearray)):
+            return json_default(obj)
+        return DefaultJSONProvider.default(obj)
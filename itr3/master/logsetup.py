@@ -0,0 +1,110 @@
+"""Асинхронне логування з вибірковістю для гарячого шляху.
+
+Записи кладуться в чергу (QueueHandler), а форматує та пише їх фоновий
+QueueListener, тож потоки реплікації не чекають на stderr. Повідомлення
+форматуються ліниво: виклики мають вигляд log.info("... %s", value), і рядок
+збирається лише для записів, що пройшли рівень та фільтри.
+
+Налаштування через змінні середовища:
+    LOG_LEVEL       рівень, напр. DEBUG, INFO, WARNING (типово INFO)
+    LOG_SAMPLE      частка записів, що лишається, по категоріях: "replicate=0.1,read=0.01,*=1"
+    LOG_RATE_LIMIT  максимум записів на секунду по категоріях: "retry=20,*=200"
+
+Категорія задається через extra={"category": "..."}, інакше нею є ім'я логера
+(напр. "werkzeug" для журналу HTTP-запитів). Записи рівня ERROR і вище ніколи
+не відкидаються вибіркою, лише обмеженням частоти.
+
+Файл однаковий для майстра та вторинних вузлів (копія, як і replication_pb2).
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+
+def parse_categories(value, cast):
+    result = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, number = item.partition("=")
+        result[name.strip()] = cast(number)
+    return result
+
+
+class CategoryFilter(logging.Filter):
+    """Вибірка та обмеження частоти (token bucket) окремо для кожної категорії."""
+
+    def __init__(self, sample, rate_limit):
+        super().__init__()
+        self.sample = sample
+        self.rate_limit = rate_limit
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _lookup(self, table, category, default):
+        return table.get(category, table.get("*", default))
+
+    def filter(self, record):
+        category = getattr(record, "category", record.name)
+        if record.levelno < logging.ERROR:
+            keep = self._lookup(self.sample, category, 1.0)
+            if keep < 1.0 and random.random() >= keep:
+                return False
+        rate = self._lookup(self.rate_limit, category, None)
+        if rate is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(category, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self.buckets[category] = (tokens, now)
+                return False
+            self.buckets[category] = (tokens - 1, now)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Не форматує запис у потоці, що логує: це робить слухач у фоні."""
+
+    def prepare(self, record):
+        return record
+
+
+_handler = None
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler()
+    _listener = logging.handlers.QueueListener(_handler.queue, stream)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # Фоновий потік не переживає fork (процеси-обробники): створюємо нову чергу та слухача.
+    _handler.queue = queue.SimpleQueue()
+    _start_listener()
+
+
+def configure():
+    """Ставить асинхронний обробник на кореневий логер; повторні виклики нічого не роблять."""
+    global _handler
+    if _handler is not None:
+        return
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    _handler = DeferredQueueHandler(queue.SimpleQueue())
+    _handler.addFilter(CategoryFilter(
+        parse_categories(os.getenv("LOG_SAMPLE"), float),
+        parse_categories(os.getenv("LOG_RATE_LIMIT"), float),
+    ))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+    _start_listener()
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    atexit.register(lambda: _listener.stop())
@@ -1,162 +1,1226 @@
+import asyncio
+import bisect
 import flask
 import grpc
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import os
 import threading
 import random
 import time
 from concurrent import futures
 import replication_pb2
 import replication_pb2_grpc
-from queue import Queue
+import logentry
+import ingest
+import logsetup
+import merkle
+import profiling
+import replication
+import tracing
+from collections import OrderedDict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = flask.Flask(__name__)
+app.json = logentry.JSONProvider(app)
 messages = []  
 message_id = 0
-secondary_addresses = ["secondary1:50051", "secondary2:50052"]
+log_lock = threading.Lock()
+secondary_addresses = os.getenv("SECONDARY_ADDRESSES", "secondary1:50051,secondary2:50052").split(",")
+logsetup.configure()
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.StreamHandler())
 
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 0))
+SEQUENCER_SOCKET = os.getenv("SEQUENCER_SOCKET", "/tmp/master-sequencer.sock")
+# Встановлюється лише в процесах-обробниках: вони не мають власного логу
+# і пересилають усі операції секвенсору.
+sequencer_client = None
+
+# Контроль допуску: обмеження на відставання кожного вторинного вузла
+# та на кількість записів, що одночасно очікують ACK.
+MAX_SECONDARY_BACKLOG = int(os.getenv("MAX_SECONDARY_BACKLOG", 10000))
+MAX_INFLIGHT_WRITES = int(os.getenv("MAX_INFLIGHT_WRITES", 1000))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 1))
+inflight_writes = 0
+inflight_lock = threading.Lock()
+
+# Скільки запис чекає на write concern, якщо клієнт не передав timeout_ms.
+ACK_WAIT_SECONDS = 60
+ACK_POLL_SECONDS = 0.5
+
+# trace id та момент додавання в лог для нещодавніх записів (лише коли ввімкнено TRACE_FILE).
+MAX_TRACED_MESSAGES = 100000
+message_traces = OrderedDict()
+
+# Коли вторинний вузол може відповісти ACK: "received" (запис прийнято в чергу),
+# "durable" (записано на диск) або "applied" (застосовано). Клієнт обирає режим
+# полем "ack" у POST /messages; ACK_MODE — типовий. Режими, відмінні від типового,
+# запам'ятовуються для нещодавніх записів, щоб ретраї надсилали той самий режим.
+ACK_MODES = ("received", "durable", "applied")
+ACK_MODE = os.getenv("ACK_MODE", "applied")
+ACK_MODE_METADATA_KEY = "x-ack-mode"
+message_ack_modes = OrderedDict()
+# Дедлайни нещодавніх записів із timeout_ms: ними обрізається таймаут RPC, поки клієнт ще чекає.
+message_deadlines = OrderedDict()
+
+# Асинхронні записи ("async": true) отримують відповідь 202 одразу після додавання в лог;
+# їхні w та дедлайн лишаються тут, щоб GET /messages/<id>/status міг сказати, чи запис
+# закомічено, ще очікує чи не встиг до дедлайну.
+write_tickets = OrderedDict()
+# Квитки асинхронних записів, які ще рахуються в inflight_writes: номер -> (ids, w, дедлайн).
+# ticket_reaper знімає квиток, щойно запис закомічено або минув дедлайн.
+open_tickets = {}
+ticket_numbers = itertools.count()
+tickets_open = threading.Event()
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 100000))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 3600))
+
+class IdempotencyConflict(Exception):
+    """Той самий Idempotency-Key прийшов з іншим повідомленням."""
+
+class IdempotencyCache:
+    """Обмежена LRU-мапа Idempotency-Key -> (id, хеш повідомлення) з TTL. Викликається під log_lock.
+
+    Ключ одиночного запису -- рядок, позиції пакета -- кортежі ("batch", key, позиція).
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0], entry[1]
+
+    def put(self, key, msg_id, digest):
+        self.entries[key] = (msg_id, digest, time.monotonic())
+        self.entries.move_to_end(key)
+        while self.entries and (len(self.entries) > self.max_size
+                                or time.monotonic() - next(iter(self.entries.values()))[2] > self.ttl):
+            self.entries.popitem(last=False)
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_SECONDS)
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 1000))
+# Найбільший пакет для POST /messages/batch та сторінка для GET /messages?cursor=.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000))
+
+# Бінарні формати тіла поряд із JSON (Content-Type запиту, Accept відповіді).
+# Protobuf: запис — LogEntry, пакет і читання — RangeResponse (список LogEntry) з
+# replication.proto; w, timeout_ms та ack передаються в query-параметрах, курсор
+# наступного читання — у заголовку X-Next-Cursor. Msgpack: ті самі поля, що й у JSON.
+# Запис може бути бінарним (LogEntry.payload, msgpack bin): він зберігається як bytes,
+# а в JSON-відповідях має вигляд {"base64": "..."} (див. logentry.py).
+# Помилки завжди повертаються як JSON.
+JSON_TYPE = "application/json"
+PROTOBUF_TYPE = "application/x-protobuf"
+MSGPACK_TYPE = "application/msgpack"
+BODY_TYPES = (JSON_TYPE, PROTOBUF_TYPE) + ((MSGPACK_TYPE,) if msgpack else ())
+
+# "fanout": майстер сам надсилає кожен запис кожному вторинному вузлу.
+# "chain": майстер надсилає лише голові ланцюга (порядок SECONDARY_ADDRESSES), кожен вузол
+# пересилає наступному тим самим ReplicateMessage, а ACK повертається назад із кількістю
+# вузлів ланцюга, що застосували запис. Вихідний трафік майстра не залежить від кількості реплік.
+# Кожен вузол із наступниками ще й одразу надсилає Acknowledge з acked_id, тож w зараховує
+# позиції ланцюга в міру застосування, а не лише коли відповідь повернеться від хвоста.
+REPLICATION_TOPOLOGY = os.getenv("REPLICATION_TOPOLOGY", "fanout")
+CHAIN_METADATA_KEY = "x-chain"
+
+# "threads": gRPC-сервер на пулі з GRPC_MAX_WORKERS потоків.
+# "aio": grpc.aio на одному циклі подій, кількість одночасних викликів не обмежена пулом.
+GRPC_MODE = os.getenv("GRPC_MODE", "threads")
+GRPC_MAX_WORKERS = int(os.getenv("GRPC_MAX_WORKERS", 10))
+
+# EWMA тривалості ReplicateMessage для кожного вузла окремо за режимом ACK: у режимі
+# "received" це фактично RTT, у "applied" — ще й час застосування. Невдалий виклик
+# рахується разом із паузою до повторної спроби, тож деградований вузол швидко стає «повільним».
+LATENCY_EWMA_ALPHA = float(os.getenv("LATENCY_EWMA_ALPHA", 0.2))
+replication_latency = replication.LatencyTracker(secondary_addresses, LATENCY_EWMA_ALPHA)
+# Кожен вторинний вузол обслуговує один довгоживучий відправник (GrpcReplicator.run_sender):
+# записи, SYNC і ланцюг лише будять його. Він тримає до REPLICATION_CONCURRENCY
+# одночасних ReplicateMessage до вузла — це gRPC future, а не потоки, тож у режимі
+# "applied" межа може бути високою, — а після невдачі всіх спроб повертає запис у
+# чергу й робить паузу RETRY_PAUSE_SECONDS — дедлайн запису доставку не зупиняє.
+REPLICATION_CONCURRENCY = int(os.getenv("REPLICATION_CONCURRENCY", 256))
+RETRY_PAUSE_SECONDS = float(os.getenv("RETRY_PAUSE_SECONDS", 5))
+# Максимум одночасних ReplicateMessage від майстра (0 — без обмеження). Коли вікно
+# заповнене, звільнений слот першим отримує вузол із найменшою очікуваною затримкою.
+REPLICATION_WINDOW = int(os.getenv("REPLICATION_WINDOW", 0))
+
+# Дерево Меркла над логом для anti-entropy (TreeDigest); оновлюється разом із messages під log_lock.
+merkle_tree = merkle.MerkleTree()
+
+# Черга кожного вузла (записи понад MAX_SECONDARY_BACKLOG дочитуються з логу, коли вона
+# спорожніє) і кумулятивні водяні знаки вузлів (replication.AckTracker).
+queues = {addr: replication.DeliveryQueue(REPLICATION_CONCURRENCY, RETRY_PAUSE_SECONDS, MAX_SECONDARY_BACKLOG)
+          for addr in secondary_addresses}
+acks = replication.AckTracker(secondary_addresses)
+# Поточне втілення кожного вузла (нове після кожного його запуску) та попередні втілення:
+# опустити водяний знак може лише нове втілення, а відповіді попередніх уже не рахуються.
+incarnations = {}
+retired_incarnations = {addr: set() for addr in secondary_addresses}
+incarnations_lock = threading.Lock()
 
-pending_messages = {addr: Queue() for addr in secondary_addresses}
-last_acked_message = {addr: -1 for addr in secondary_addresses}  
+# Стійкий стан майстра: лог у DATA_DIR/messages.jsonl (fsync до реплікації запису) та
+# водяні знаки вузлів і commit index у DATA_DIR/replication_state.json. Стан
+# переписується фоновим потоком не частіше ніж раз на STATE_FLUSH_SECONDS: застарілий
+# водяний знак лише змусить дослати трохи більше, а вторинні вузли відкидають дублікати.
+DATA_DIR = os.getenv("DATA_DIR")
+LOG_PATH = os.path.join(DATA_DIR, "messages.jsonl") if DATA_DIR else None
+STATE_PATH = os.path.join(DATA_DIR, "replication_state.json") if DATA_DIR else None
+STATE_FLUSH_SECONDS = float(os.getenv("STATE_FLUSH_SECONDS", 0.5))
+state_dirty = threading.Event()
 
 class ReplicationServiceServicer(replication_pb2_grpc.ReplicationServiceServicer):
     def ReplicateMessage(self, request, context):
         global message_id
-        log.info(f"Майстер отримав повідомлення для реплікації: {request.message}")
+        log.info("Майстер отримав повідомлення для реплікації: %s", request.message,
+                 extra={"category": "replicate"})
         time.sleep(random.uniform(1, 3))
-        msg_id, message = request.message.split(":", 1)
-        msg_id = int(msg_id)
+        return store_replicated(request)
 
-        if message.startswith("SYNC_"):
-            addr = f"secondary{msg_id+1}:{message.split('_')[1]}"  
-            log.info(f"Отримано SYNC від {addr}, запускаємо синхронізацію")
-            sync_missing_messages(addr)
-            process_pending_messages(addr)
-            return replication_pb2.AckResponse(success=True)
+    def Sync(self, request, context):
+        """Вторинний вузол повідомляє свою адресу та останній безперервно застосований id."""
+        addr = request.address
+        if addr not in secondary_addresses:
+            log.error("Отримано SYNC від невідомого вузла %s", addr, extra={"category": "sync"})
+            return replication_pb2.SyncResponse(success=False)
 
+        # Вторинний вузол — джерело істини щодо того, що він уже має:
+        # після перезапуску майстра чи вторинного вузла довіряємо його водяному знаку.
+        record_watermark(addr, request.incarnation, request.applied_through, sync=True)
+        resend_count = sync_missing_messages(addr)
+        log.info("Отримано SYNC від %s (застосовано до id %d), до повторного надсилання: %d",
+                 addr, request.applied_through, resend_count, extra={"category": "sync"})
+        replicator.wake(addr)
+        return replication_pb2.SyncResponse(success=True, resend_count=resend_count)
+
+    def FetchRange(self, request, context):
+        """Віддає вторинному вузлу записи з id у межах [start, end], яких йому бракує."""
+        entries = [logentry.entry_proto(msg_id, msg) for msg_id, msg in log_range(request.start, request.end)]
+        log.info("%s запитав пропущені id %d..%d, надсилаємо %d",
+                 request.address, request.start, request.end, len(entries), extra={"category": "sync"})
+        return replication_pb2.RangeResponse(entries=entries)
+
+    def Acknowledge(self, request, context):
+        """Кумулятивний ACK: вузол застосував усі id до request.applied_through включно.
+
+        acked_id — ACK одного запису від позиції ланцюга, яка щойно його обробила.
+        """
+        if request.address not in secondary_addresses:
+            log.error("Отримано ACK від невідомого вузла %s", request.address, extra={"category": "ack"})
+            return replication_pb2.AckResponse(success=False)
+        if (record_watermark(request.address, request.incarnation, request.applied_through)
+                and request.HasField("acked_id")):
+            record_ack(request.address, request.acked_id)
+        log.debug("Кумулятивний ACK від %s: до id %d", request.address, request.applied_through,
+                  extra={"category": "ack"})
+        return replication_pb2.AckResponse(success=True)
+
+    def TreeDigest(self, request, context):
+        """Хеші вузлів дерева Меркла для перших request.buckets кошиків (anti-entropy)."""
+        if request.bucket_size != merkle_tree.bucket_size:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"MERKLE_BUCKET_SIZE майстра {merkle_tree.bucket_size}, а не {request.bucket_size}")
+        hashes = merkle_tree.hashes(request.buckets, request.level, request.nodes)
+        log.debug("%s запитав %d хешів рівня %d", request.address, len(hashes), request.level,
+                  extra={"category": "sync"})
+        return replication_pb2.TreeResponse(hashes=hashes)
+
+class AsyncReplicationServiceServicer(ReplicationServiceServicer):
+    """Ті самі RPC для grpc.aio: очікування не займає потік, а робота з усім логом
+    (Sync, FetchRange) виконується в пулі asyncio.to_thread, щоб не блокувати цикл подій."""
+
+    async def ReplicateMessage(self, request, context):
+        log.info("Майстер отримав повідомлення для реплікації: %s", request.message,
+                 extra={"category": "replicate"})
+        await asyncio.sleep(random.uniform(1, 3))
+        return store_replicated(request)
+
+    async def Sync(self, request, context):
+        return await asyncio.to_thread(super().Sync, request, context)
+
+    async def FetchRange(self, request, context):
+        return await asyncio.to_thread(super().FetchRange, request, context)
+
+    async def Acknowledge(self, request, context):
+        return super().Acknowledge(request, context)
+
+    async def TreeDigest(self, request, context):
+        if request.bucket_size != merkle_tree.bucket_size:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                                f"MERKLE_BUCKET_SIZE майстра {merkle_tree.bucket_size}, а не {request.bucket_size}")
+        # Перший запит після старту може перерахувати все дерево: не блокуємо цикл подій.
+        hashes = await asyncio.to_thread(merkle_tree.hashes, request.buckets, request.level, request.nodes)
+        return replication_pb2.TreeResponse(hashes=hashes)
+
+def store_replicated(request):
+    msg_id, message = request.message.split(":", 1)
+    msg_id = int(msg_id)
+    if request.HasField("payload"):
+        message = request.payload
+
+    with log_lock:
         if not any(m[0] == msg_id for m in messages):
+            persist_entries([(msg_id, message)])
             messages.append((msg_id, message))
-        return replication_pb2.AckResponse(success=True)
+            merkle_tree.add(msg_id, message)
+    return replication_pb2.AckResponse(success=True)
 
 def run_grpc_server():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    if GRPC_MODE == "aio":
+        asyncio.run(serve_grpc_aio())
+        return
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS))
     replication_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServiceServicer(), server)
     server.add_insecure_port("[::]:50050")
     log.info("Майстер gRPC сервер запущено на порту 50050")
     server.start()
     server.wait_for_termination()
 
-def replicate_to_secondary(addr, message, msg_id, timeout=10, max_attempts=5):
-    attempt = 1
-    while attempt <= max_attempts:
+async def serve_grpc_aio():
+    server = grpc.aio.server()
+    replication_pb2_grpc.add_ReplicationServiceServicer_to_server(AsyncReplicationServiceServicer(), server)
+    server.add_insecure_port("[::]:50050")
+    log.info("Майстер gRPC сервер (grpc.aio) запущено на порту 50050")
+    await server.start()
+    await server.wait_for_termination()
+
+def record_ack(addr, msg_id=None, applied_through=None):
+    """Просуває стан вузла (див. AckTracker.record); новий водяний знак потрапить у стан на диску."""
+    previous, through = acks.record(addr, msg_id, applied_through)
+    if through != previous:
+        state_dirty.set()
+
+def record_watermark(addr, incarnation, applied_through, sync=False):
+    """Водяний знак, який повідомив сам вузол: SYNC, Acknowledge чи відповідь на ReplicateMessage.
+
+    Нове втілення (вузол перезапустився й міг втратити незбережене) — джерело істини,
+    і його водяний знак замінює попередній, навіть менший. Від уже відомого втілення
+    запізнілий запит лише піднімає водяний знак. Повертає False для відповіді
+    попереднього втілення: вона вже нічого не каже про вузол.
+    Старі вторинні вузли втілення не передають: їхній SYNC, як і раніше, замінює водяний знак.
+    """
+    with incarnations_lock:
+        current = incarnations.get(addr)
+        if incarnation and incarnation in retired_incarnations[addr]:
+            return False
+        restarted = (incarnation != current) if incarnation else sync
+        if restarted:
+            if current:
+                retired_incarnations[addr].add(current)
+            incarnations[addr] = incarnation
+            acks.reset(addr, applied_through)
+            state_dirty.set()
+        else:
+            record_ack(addr, applied_through=applied_through)
+    return True
+
+def is_acked(addr, msg_id):
+    return acks.is_acked(addr, msg_id)
+
+def commit_index():
+    return acks.commit_index(message_id - 1)
+
+def persist_entries(entries):
+    """Дописує записи в лог на диску одним write та fsync; викликається під log_lock,
+    до того як записи потраплять у черги реплікації."""
+    if not LOG_PATH:
+        return
+    with open(LOG_PATH, "a", encoding="utf-8") as f:
+        f.write("".join(logentry.dumps({"id": msg_id, "message": message}) + "\n"
+                        for msg_id, message in entries))
+        f.flush()
+        os.fsync(f.fileno())
+
+def save_state():
+    """Атомарно переписує водяні знаки вузлів і commit index (через тимчасовий файл і os.replace)."""
+    with acks.lock:
+        state = {"acked": dict(acks.watermark), "commit_index": commit_index()}
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, STATE_PATH)
+
+def state_writer():
+    """Фоновий потік: зливає зміни водяних знаків в один запис стану раз на STATE_FLUSH_SECONDS."""
+    while True:
+        state_dirty.wait()
+        state_dirty.clear()
         try:
-            with grpc.insecure_channel(addr) as channel:
-                stub = replication_pb2_grpc.ReplicationServiceStub(channel)
-                log.info(f"Надсилання повідомлення {message} з id {msg_id} до {addr} (спроба {attempt})")
-                response = stub.ReplicateMessage(
-                    replication_pb2.MessageRequest(message=f"{msg_id}:{message}"),
-                    timeout=timeout
-                )
-                log.info(f"Отримано ACK від {addr} для повідомлення {message}")
-                last_acked_message[addr] = max(last_acked_message[addr], msg_id)
-                return response.success
-        except grpc.RpcError as e:
-            log.error(f"Не вдалося реплікувати до {addr}: {e}")
-            if attempt == max_attempts:
-                log.error(f"Досягнуто максимальної кількості спроб ({max_attempts}) для {addr}")
-                return False
-            time.sleep(min(2 ** attempt, 10))  
-            attempt += 1
-    return False
+            save_state()
+        except OSError as e:
+            log.error("Не вдалося зберегти стан реплікації: %s", e, extra={"category": "sync"})
+            state_dirty.set()
+        time.sleep(STATE_FLUSH_SECONDS)
+
+def load_state():
+    """Відновлює лог, дерево Меркла та водяні знаки вузлів після перезапуску майстра."""
+    global message_id
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if os.path.exists(LOG_PATH):
+        with open(LOG_PATH, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = logentry.loads(line)
+                except ValueError:
+                    # Обірваний останній рядок після аварійного завершення: запис не підтверджено клієнту.
+                    break
+                messages.append((entry["id"], entry["message"]))
+                merkle_tree.add(entry["id"], entry["message"])
+        message_id = max((msg_id for msg_id, _ in messages), default=-1) + 1
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, encoding="utf-8") as f:
+            state = json.load(f)
+        for addr, through in state.get("acked", {}).items():
+            if addr in secondary_addresses:
+                acks.reset(addr, min(through, message_id - 1))
+    log.info("Відновлено %d повідомлень з %s, commit index %d, водяні знаки: %s", len(messages), LOG_PATH,
+             commit_index(), acks.watermark, extra={"category": "sync"})
+
+def start_persistence():
+    """Запускає запис стану і досилає кожному вузлу лише непідтверджений хвіст логу."""
+    threading.Thread(target=state_writer, daemon=True).start()
+    for addr in secondary_addresses:
+        resend_count = sync_missing_messages(addr)
+        if resend_count:
+            log.info("Після перезапуску досилаємо %s %d повідомлень", addr, resend_count,
+                     extra={"category": "sync"})
+            replicator.wake(addr)
+
+def expected_latency(addr, ack_mode=ACK_MODE):
+    """Очікувана тривалість ReplicateMessage до вузла; без вимірів — 0, щоб вузол спробували."""
+    return replication_latency.expected(addr, ack_mode)
+
+def expected_write_latency(ack_mode=ACK_MODE):
+    """Очікувана затримка запису для кожного w: w-1 найшвидших вторинних вузлів (майстер — миттєво)."""
+    fastest = sorted(expected_latency(addr, ack_mode) for addr in secondary_addresses)
+    return {w: (fastest[w - 2] if w > 1 else 0.0) for w in range(1, len(secondary_addresses) + 2)}
+
+def by_latency(addrs):
+    return replication_latency.order(addrs, ACK_MODE)
+
+send_window = replication.SendWindow(REPLICATION_WINDOW)
+retry_policy = replication.RetryPolicy(timeout=10, max_attempts=5)
+replication_stubs = {}
+stubs_lock = threading.Lock()
+
+def replication_targets():
+    """Вузли, яким майстер надсилає новий запис сам, від найшвидшого."""
+    if REPLICATION_TOPOLOGY == "chain":
+        return secondary_addresses[:1]
+    return by_latency(secondary_addresses)
+
+def is_chain_head(addr):
+    return REPLICATION_TOPOLOGY == "chain" and addr == secondary_addresses[0]
+
+def replication_stub(addr):
+    """Один довгоживучий канал на вузол: gRPC сам перепідключається після збою, а новий
+    канал на кожен ReplicateMessage коштував би TCP-з'єднання на запис."""
+    with stubs_lock:
+        stub = replication_stubs.get(addr)
+        if stub is None:
+            stub = replication_stubs[addr] = replication_pb2_grpc.ReplicationServiceStub(
+                grpc.insecure_channel(addr))
+        return stub
+
+def remaining(deadline):
+    """Залишок бюджету запису в секундах; None, якщо клієнт не задав timeout_ms."""
+    return None if deadline is None else deadline - time.monotonic()
+
+def log_range(start, end):
+    """Записи з id у межах [start, end] у порядку id.
+
+    Записи додаються під log_lock з послідовними id, тож id збігається з позицією в
+    messages і діапазон — це зріз. Якщо інваріант порушено (записи, прийняті через
+    ReplicateMessage), шукаємо межі бінарним пошуком у відсортованій копії логу.
+    """
+    first, last = max(start, 0), min(end, len(messages) - 1)
+    entries = messages[first:last + 1] if first <= last else []
+    if entries and entries[0][0] == first and entries[-1][0] == last:
+        return entries
+    if not entries and (not messages or messages[-1][0] == len(messages) - 1):
+        return entries
+    ordered = sorted(messages)
+    ids = [msg_id for msg_id, _ in ordered]
+    return ordered[bisect.bisect_left(ids, start):bisect.bisect_right(ids, end)]
 
 def sync_missing_messages(addr):
-    """Надсилає пропущені повідомлення до вторинного вузла після його відновлення."""
-    last_acked = last_acked_message[addr]
-    for msg_id, msg in sorted(messages):
-        if msg_id > last_acked:
-            log.info(f"Синхронізація пропущеного повідомлення {msg} з id {msg_id} до {addr}")
-            pending_messages[addr].put((msg_id, msg))
-
-def process_pending_messages(addr):
-    """Обробляє черги пропущених повідомлень для вторинного вузла."""
-    while not pending_messages[addr].empty():
-        msg_id, message = pending_messages[addr].get()
-        if replicate_to_secondary(addr, message, msg_id):
-            pending_messages[addr].task_done()
-        else:
-            pending_messages[addr].put((msg_id, message)) 
-            break
+    """Перебудовує чергу вузла з непідтвердженого хвоста логу після його відновлення чи
+    переповнення черги; повертає кількість записів, яких вузлу бракує."""
+    # Усе до водяного знака вузол уже має: переглядаємо лише хвіст логу після нього.
+    return queues[addr].rebuild(log_range(acks.watermark[addr] + 1, message_id - 1),
+                                lambda msg_id: is_acked(addr, msg_id))
 
-@app.route("/messages", methods=["POST"])
-def append_message():
+class GrpcReplicator(replication.Replicator):
+    """replication.Replicator поверх gRPC: спроба — ReplicateMessage.future, паузи між
+    спробами — один потік таймерів, а чергу кожного вузла розбирає свій довгоживучий
+    відправник, якого будить wake(). Потоку на запис чи на RPC немає."""
+
+    def __init__(self):
+        super().__init__(queues, acks, replication_latency, send_window, retry_policy, ACK_MODE)
+        self.wakeups = {addr: threading.Event() for addr in secondary_addresses}
+        self.timers = []
+        self.timer_numbers = itertools.count()
+        self.timers_ready = threading.Condition()
+
+    def start(self):
+        for addr in secondary_addresses:
+            threading.Thread(target=self.run_sender, args=(addr,), daemon=True).start()
+        threading.Thread(target=self.run_timers, daemon=True).start()
+
+    def clock(self):
+        return time.monotonic()
+
+    def wake(self, addr):
+        self.wakeups[addr].set()
+
+    def run_sender(self, addr):
+        wakeup = self.wakeups[addr]
+        while True:
+            wakeup.clear()
+            try:
+                pause = self.pump(addr)
+            except Exception:
+                log.exception("Помилка розбору черги %s", addr, extra={"category": "retry"})
+                pause = RETRY_PAUSE_SECONDS
+            # Після невдачі черга стоїть pause секунд; інакше спимо до наступного wake().
+            wakeup.wait(pause or None)
+
+    def call_later(self, seconds, callback, *args):
+        with self.timers_ready:
+            heapq.heappush(self.timers, (time.monotonic() + seconds, next(self.timer_numbers), callback, args))
+            self.timers_ready.notify()
+
+    def run_timers(self):
+        while True:
+            with self.timers_ready:
+                while not self.timers or self.timers[0][0] > time.monotonic():
+                    self.timers_ready.wait(self.timers[0][0] - time.monotonic() if self.timers else None)
+                _, _, callback, args = heapq.heappop(self.timers)
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("Помилка повторної спроби реплікації", extra={"category": "retry"})
+
+    def rebuild(self, addr):
+        sync_missing_messages(addr)
+
+    def chain_for(self, addr):
+        return secondary_addresses if is_chain_head(addr) else [addr]
+
+    def deadline_of(self, msg_id):
+        return message_deadlines.get(msg_id)
+
+    def ack_mode_of(self, msg_id):
+        return message_ack_modes.get(msg_id, ACK_MODE)
+
+    def record_ack(self, addr, msg_id=None, applied_through=None):
+        record_ack(addr, msg_id, applied_through)
+
+    def transport(self, addr, msg_id, message, chain, step, done):
+        trace_id, appended_ns = message_traces.get(msg_id, (None, None))
+        if step.attempt == 1 and trace_id:
+            tracing.record(trace_id, "queue", appended_ns, time.time_ns(), addr=addr)
+        metadata = list(tracing.metadata(trace_id) or ())
+        metadata.append((ACK_MODE_METADATA_KEY, self.ack_mode_of(msg_id)))
+        if len(chain) > 1:
+            metadata.append((CHAIN_METADATA_KEY, ",".join(chain[1:])))
+        log.info("Надсилання повідомлення %s з id %d до %s (спроба %d)",
+                 message, msg_id, addr, step.attempt, extra={"category": "replicate"})
+        started_ns = time.time_ns()
+        future = replication_stub(addr).ReplicateMessage.future(
+            logentry.message_request(msg_id, message),
+            timeout=step.timeout,
+            metadata=metadata
+        )
+
+        def completed(future):
+            try:
+                response = future.result()
+            except grpc.RpcError as e:
+                tracing.record(trace_id, "grpc.replicate", started_ns, time.time_ns(), addr=addr,
+                               attempt=step.attempt, ok=False)
+                log.error("Не вдалося реплікувати до %s: %s", addr, e, extra={"category": "retry"})
+                reply = None
+            else:
+                tracing.record(trace_id, "grpc.replicate", started_ns, time.time_ns(), addr=addr,
+                               attempt=step.attempt, ok=True)
+                log.info("Отримано ACK від %s для повідомлення %s (вузлів ланцюга: %d)", addr, message,
+                         response.chain_acks, extra={"category": "replicate"})
+                through = response.applied_through if response.HasField("applied_through") else None
+                if through is not None and not record_watermark(addr, response.incarnation, through):
+                    # Відповідь процесу, який уже перезапустився: новому втіленню запис ще потрібен.
+                    reply = None
+                else:
+                    reply = replication.Reply(response.success, through, response.chain_acks)
+            try:
+                done(reply)
+            except Exception:
+                log.exception("Помилка обробки відповіді %s для id %d", addr, msg_id, extra={"category": "retry"})
+
+        future.add_done_callback(completed)
+
+    def delivered(self, addr, msg_id, message, chain, reply):
+        acked, bypass = replication.chain_outcome(chain, reply)
+        if reply is None:
+            log.error("Досягнуто максимальної кількості спроб (%d) для %s, id %d повертається в чергу",
+                      self.policy.max_attempts, addr, msg_id, extra={"category": "retry"})
+        elif bypass:
+            log.error("Ланцюг розірвано після %s, надсилаємо id %d решті напряму", acked[-1], msg_id,
+                      extra={"category": "retry"})
+        super().delivered(addr, msg_id, message, chain, reply)
+
+replicator = GrpcReplicator()
+
+def start_replication():
+    """Фонові потоки секвенсора: відправники вузлів, таймери ретраїв та ticket_reaper."""
+    replicator.start()
+    threading.Thread(target=ticket_reaper, daemon=True).start()
+
+def append_local(message, idempotency_key=None, ack_mode=None, deadline=None):
+    """Призначає наступний id і додає запис у лог та в черги реплікації атомарно.
+
+    Повертає (id, True) для нового запису; якщо Idempotency-Key уже траплявся,
+    нічого не додає і повертає (id оригінального запису, False).
+    """
+    return append_local_batch([message], [idempotency_key], ack_mode, deadline)[0]
+
+def message_digest(message):
+    """Хеш вмісту для Idempotency-Key; текст і bytes з тими самими байтами різні."""
+    if isinstance(message, bytes):
+        return hashlib.blake2b(message, digest_size=16, person=b"bytes").digest()
+    return hashlib.blake2b(message.encode("utf-8"), digest_size=16).digest()
+
+def append_local_batch(batch, idempotency_keys, ack_mode=None, deadline=None):
+    """Те саме для пакета: записи отримують послідовні id під одним log_lock і одним fsync.
+
+    Повертає список (id, створено) у порядку пакета. Якщо хоч один ключ конфліктує,
+    не додається жоден запис.
+    """
     global message_id
-    data = flask.request.json
-    log.info(f"Отримано запит: {flask.request.data}")
+    digests = [message_digest(message) if key else None
+               for message, key in zip(batch, idempotency_keys)]
+    with log_lock:
+        results = []
+        for key, digest in zip(idempotency_keys, digests):
+            cached = idempotency_cache.get(key) if key else None
+            if cached is not None and cached[1] != digest:
+                raise IdempotencyConflict(key)
+            results.append(None if cached is None else (cached[0], False))
+        new_entries = []
+        for index, message in enumerate(batch):
+            if results[index] is None:
+                results[index] = (message_id + len(new_entries), True)
+                new_entries.append((message_id + len(new_entries), message))
+        persist_entries(new_entries)
+        for msg_id, message in new_entries:
+            messages.append((msg_id, message))
+            merkle_tree.add(msg_id, message)
+            if ack_mode and ack_mode != ACK_MODE:
+                message_ack_modes[msg_id] = ack_mode
+                if len(message_ack_modes) > MAX_TRACED_MESSAGES:
+                    message_ack_modes.popitem(last=False)
+            if deadline is not None:
+                message_deadlines[msg_id] = deadline
+                if len(message_deadlines) > MAX_TRACED_MESSAGES:
+                    message_deadlines.popitem(last=False)
+            # Відставання рахуємо до цього запису — так само, як його рахує admission_error.
+            for addr in replication_targets():
+                queues[addr].offer(msg_id, message, replication_lag(addr))
+            message_id = msg_id + 1
+        for key, digest, (msg_id, created) in zip(idempotency_keys, digests, results):
+            if key and created:
+                idempotency_cache.put(key, msg_id, digest)
+    return results
+
+def replication_lag(addr):
+    """Кількість записів логу, які вузол ще не підтвердив (разом із тими, що зараз у ретраях)."""
+    return acks.lag(addr, message_id - 1)
+
+def admission_error(w):
+    """Повертає (body, status), якщо запис треба відхилити через перевантаження, інакше None.
+
+    Викликається під inflight_lock разом зі збільшенням inflight_writes.
+    """
+    reason = replication.admission(inflight_writes, MAX_INFLIGHT_WRITES,
+                                   [replication_lag(addr) for addr in secondary_addresses],
+                                   MAX_SECONDARY_BACKLOG, w)
+    if reason == "inflight":
+        log.error("Відхилено запис: %d записів уже очікують ACK", inflight_writes,
+                  extra={"category": "admission"})
+        return {"error": "Забагато одночасних записів"}, 429
+    if reason == "backlog":
+        log.error("Відхилено запис: забагато вузлів відстають на MAX_SECONDARY_BACKLOG, потрібно w=%d",
+                  w, extra={"category": "admission"})
+        return {"error": "Вторинні вузли перевантажені"}, 503
+    return None
+
+def handle_append(message, w, trace_id=None, idempotency_key=None, deadline=None, ack_mode=None,
+                  wait=True):
+    return admit_write(w, deadline, idempotency_key, lambda: replicate_and_wait(
+        message, w, trace_id, idempotency_key, deadline, ack_mode, wait))
+
+def handle_append_batch(batch, w, trace_id=None, idempotency_key=None, deadline=None, ack_mode=None,
+                        wait=True):
+    return admit_write(w, deadline, idempotency_key, lambda: replicate_and_wait_batch(
+        batch, w, trace_id, idempotency_key, deadline, ack_mode, wait))
+
+def admit_write(w, deadline, idempotency_key, write):
+    """Спільні для одиночного та пакетного запису перевірки бюджету й перевантаження."""
+    global inflight_writes
+    if deadline is not None and remaining(deadline) <= 0:
+        # Бюджет вичерпався ще в черзі секвенсора: запис не додаємо зовсім.
+        return {"error": "Вичерпано timeout_ms до початку запису"}, 504
+    # Перевірка й збільшення лічильника — одна атомарна дія, інакше паралельні запити
+    # разом проходять повз MAX_INFLIGHT_WRITES.
+    with inflight_lock:
+        error = admission_error(w)
+        if error:
+            return error
+        inflight_writes += 1
+    status = None
+    try:
+        body, status = write()
+        return body, status
+    except IdempotencyConflict:
+        log.error("Idempotency-Key %s повторно використано з іншим повідомленням", idempotency_key,
+                  extra={"category": "append"})
+        return {"error": "Idempotency-Key уже використано з іншим повідомленням"}, 422
+    finally:
+        # 202: асинхронний запис лишається в польоті, його зніме ticket_reaper.
+        if status != 202:
+            with inflight_lock:
+                inflight_writes -= 1
+
+def replicate_and_wait(message, w, trace_id=None, idempotency_key=None, deadline=None, ack_mode=None,
+                       wait=True):
+    with tracing.span(trace_id, "append") as attrs:
+        msg_id, created = append_local(message, idempotency_key, ack_mode, deadline)
+        attrs["msg_id"] = msg_id
+    if not created:
+        # Повтор після таймауту клієнта: нового запису немає, лише знову чекаємо на write concern.
+        log.info("Повторний запит з Idempotency-Key %s, повідомлення вже має id %d", idempotency_key, msg_id,
+                 extra={"category": "append"})
+    elif trace_id:
+        with log_lock:
+            message_traces[msg_id] = (trace_id, time.time_ns())
+            if len(message_traces) > MAX_TRACED_MESSAGES:
+                message_traces.popitem(last=False)
+    if created:
+        log.info("Додано повідомлення: %s з id %d та w=%d", message, msg_id, w, extra={"category": "append"})
+
+    for addr in replication_targets():
+        replicator.wake(addr)
+    if not wait:
+        issue_tickets([msg_id], w, deadline)
+        return {"status": "pending", "id": msg_id}, 202
+
+    wait_start_ns = time.time_ns()
+    required_acks = w
+    ack_count = wait_for_acks([msg_id], w, deadline)
+    tracing.record(trace_id, "ack.wait", wait_start_ns, time.time_ns(), w=w, acks=ack_count)
+    if ack_count >= required_acks:
+        log.info("Отримано %d ACK, потрібно %d, успішно", ack_count, required_acks, extra={"category": "ack"})
+        return {"status": "success", "id": msg_id}, 200
+    else:
+        # Запис лишається в лозі під своїм id і буде доставлений пізніше:
+        # вилучення створило б пропуск, на якому зупинились би вторинні вузли.
+        log.error("Не отримано достатньо ACK: отримано %d, потрібно %d", ack_count, required_acks,
+                  extra={"category": "ack"})
+        if deadline is not None:
+            return {"error": "Вичерпано timeout_ms до отримання ACK", "id": msg_id}, 504
+        return {"error": "Недостатньо ACK", "id": msg_id}, 500
+
+def wait_for_acks(msg_ids, w, deadline=None):
+    """Чекає, доки кожен із msg_ids буде щонайменше на w вузлах (разом із майстром), або до
+    дедлайну; повертає найменшу кількість ACK серед записів."""
+    wait_deadline = deadline if deadline is not None else time.monotonic() + ACK_WAIT_SECONDS
+    while True:
+        ack_count = count_acks(msg_ids)
+        budget = remaining(wait_deadline)
+        if ack_count >= w or budget <= 0:
+            return ack_count
+        log.debug("Очікуємо %d ACK, отримано %d", w, ack_count, extra={"category": "ack"})
+        time.sleep(min(ACK_POLL_SECONDS, budget))
+
+def count_acks(msg_ids):
+    """Найменша серед msg_ids кількість вузлів (разом із майстром), на яких є запис."""
+    return 1 + min(sum(1 for addr in secondary_addresses if is_acked(addr, msg_id)) for msg_id in msg_ids)
+
+def issue_tickets(msg_ids, w, deadline=None):
+    """Запам'ятовує write concern асинхронних записів; без timeout_ms дедлайн — ACK_WAIT_SECONDS.
+
+    Запит лишається в inflight_writes, доки ticket_reaper не зніме його квиток.
+    """
+    deadline = deadline if deadline is not None else time.monotonic() + ACK_WAIT_SECONDS
+    with log_lock:
+        for msg_id in msg_ids:
+            write_tickets[msg_id] = (w, deadline)
+        while len(write_tickets) > MAX_TRACED_MESSAGES:
+            write_tickets.popitem(last=False)
+    with inflight_lock:
+        open_tickets[next(ticket_numbers)] = (msg_ids, w, deadline)
+        tickets_open.set()
+
+def ticket_reaper():
+    """Фоновий потік: звільняє місце в inflight_writes, коли асинхронний запис закомічено
+    на w вузлах або минув його дедлайн."""
+    global inflight_writes
+    while True:
+        tickets_open.wait()
+        time.sleep(ACK_POLL_SECONDS)
+        with inflight_lock:
+            tickets = list(open_tickets.items())
+        resolved = [number for number, (msg_ids, w, deadline) in tickets
+                    if count_acks(msg_ids) >= w or remaining(deadline) <= 0]
+        with inflight_lock:
+            for number in resolved:
+                del open_tickets[number]
+            inflight_writes -= len(resolved)
+            if not open_tickets:
+                tickets_open.clear()
+
+def handle_status(msg_id, w=None, wait=0):
+    """Стан запису: committed (є на w вузлах), pending або failed (дедлайн минув раніше).
+
+    Для асинхронного запису w та дедлайн беруться з його квитка; для інших записів
+    або квитків, що вже витіснено, — w із запиту (типово 1), і failed не буває.
+    З wait > 0 відповідь чекає до wait секунд, доки запис не стане committed чи failed.
+    """
+    if not 0 <= msg_id < message_id:
+        return {"error": f"Запису з id {msg_id} немає"}, 404
+    ticket_w, deadline = write_tickets.get(msg_id, (1, None))
+    w = min(w or ticket_w, len(secondary_addresses) + 1)
+    if wait > 0:
+        wait_deadline = time.monotonic() + min(wait, ACK_WAIT_SECONDS)
+        wait_for_acks([msg_id], w, wait_deadline if deadline is None else min(wait_deadline, deadline))
+    acked = [addr for addr in secondary_addresses if is_acked(addr, msg_id)]
+    if 1 + len(acked) >= w:
+        status = "committed"
+    elif deadline is not None and remaining(deadline) <= 0:
+        # Як і після 504 на синхронний запис, запис лишається в лозі й буде доставлений пізніше.
+        status = "failed"
+    else:
+        status = "pending"
+    return {"id": msg_id, "status": status, "w": w, "acks": 1 + len(acked),
+            "acked_replicas": ["master"] + acked}, 200
+
+def replicate_and_wait_batch(batch, w, trace_id=None, idempotency_key=None, deadline=None, ack_mode=None,
+                             wait=True):
+    """Пакетний запис: один прохід секвенсора та одне очікування write concern на весь пакет.
+
+    Idempotency-Key пакета розгортається в ключі ("batch", key, позиція), тож повтор того
+    самого пакета не створює дублікатів, а рядковий ключ одиночного запису на кшталт
+    "abc:0" ніколи не збігається з позицією пакета "abc".
+    """
+    keys = [("batch", idempotency_key, index) if idempotency_key else None for index in range(len(batch))]
+    with tracing.span(trace_id, "append", size=len(batch)) as attrs:
+        results = append_local_batch(batch, keys, ack_mode, deadline)
+        attrs["msg_ids"] = f"{results[0][0]}..{results[-1][0]}"
+    ids = [msg_id for msg_id, _ in results]
+    created = [msg_id for msg_id, is_new in results if is_new]
+    if trace_id and created:
+        with log_lock:
+            for msg_id in created:
+                message_traces[msg_id] = (trace_id, time.time_ns())
+            while len(message_traces) > MAX_TRACED_MESSAGES:
+                message_traces.popitem(last=False)
+    log.info("Додано пакет із %d повідомлень (нових %d) з id %d..%d та w=%d", len(ids), len(created),
+             ids[0], ids[-1], w, extra={"category": "append"})
+
+    for addr in replication_targets():
+        replicator.wake(addr)
+    if not wait:
+        issue_tickets(ids, w, deadline)
+        return {"status": "pending", "ids": ids}, 202
+
+    wait_start_ns = time.time_ns()
+    ack_count = wait_for_acks(ids, w, deadline)
+    tracing.record(trace_id, "ack.wait", wait_start_ns, time.time_ns(), w=w, acks=ack_count)
+    if ack_count >= w:
+        return {"status": "success", "ids": ids}, 200
+    log.error("Не отримано достатньо ACK для пакета: отримано %d, потрібно %d", ack_count, w,
+              extra={"category": "ack"})
+    if deadline is not None:
+        return {"error": "Вичерпано timeout_ms до отримання ACK", "ids": ids}, 504
+    return {"error": "Недостатньо ACK", "ids": ids}, 500
+
+def ordered_log():
+    """Увесь лог у порядку id; зазвичай це просто копія messages без сортування."""
+    return log_range(0, message_id - 1)
+
+def handle_list(with_ids=False):
+    if with_ids:
+        return {"entries": ordered_log()}, 200
+    listed = [msg[1] for msg in ordered_log()]
+    log.info("Список повідомлень: %d записів", len(listed), extra={"category": "read"})
+    log.debug("Список повідомлень: %s", listed, extra={"category": "read"})
+    return {"messages": listed}, 200
+
+def handle_export_snapshot():
+    """Точка знімка для експорту: лог лише дописується, тож перші N записів більше не змінюються."""
+    with log_lock:
+        return {"end": len(messages)}, 200
+
+def handle_export_page(start, stop):
+    return {"entries": messages[start:stop]}, 200
+
+def handle_read(cursor, limit):
+    """Інкрементне читання: записи з позиції cursor у порядку додавання та курсор для наступного виклику."""
+    entries = messages[cursor:cursor + limit]
+    return {"entries": [{"id": msg_id, "message": msg} for msg_id, msg in entries],
+            "cursor": cursor + len(entries)}, 200
+
+def handle_sync(addr):
+    if addr not in secondary_addresses:
+        return {"error": "Невідомий вторинний вузол"}, 400
+    log.info("Синхронізація вузла %s", addr, extra={"category": "sync"})
+    sync_missing_messages(addr)
+    replicator.wake(addr)
+    return {"status": "success"}, 200
+
+def handle_limits():
+    return {
+        "max_inflight_writes": MAX_INFLIGHT_WRITES,
+        "inflight_writes": inflight_writes,
+        "async_pending": len(open_tickets),
+        "max_secondary_backlog": MAX_SECONDARY_BACKLOG,
+        "backlog": {addr: replication_lag(addr) for addr in secondary_addresses},
+        "acked_through": dict(acks.watermark),
+        "queued": {addr: len(queues[addr]) for addr in secondary_addresses},
+        "overflowed": sorted(addr for addr in secondary_addresses if queues[addr].overflowed),
+        "commit_index": commit_index(),
+    }, 200
+
+def handle_latency():
+    return {
+        "ack_mode": ACK_MODE,
+        "secondaries": {addr: {mode: round(seconds * 1000, 1)
+                               for mode, seconds in replication_latency.ewma[addr].items()}
+                        for addr in by_latency(secondary_addresses)},
+        "expected_write_ms": {w: round(seconds * 1000, 1) for w, seconds in expected_write_latency().items()},
+        "window": {"size": REPLICATION_WINDOW, "active": send_window.active, "waiting": len(send_window.waiting)},
+    }, 200
+
+def handle_debug_profile(seconds, fmt):
+    # У режимі обробників профілюється процес секвенсора, де живуть лог і реплікація.
+    try:
+        return {"text": profiling.profile(seconds, fmt)}, 200
+    except profiling.ProfilerBusy:
+        return {"error": "Профілювання вже триває"}, 409
+
+def dispatch(request):
+    """Виконує операцію над логом; у режимі обробників викликається секвенсором."""
+    op = request["op"]
+    if op == "append":
+        return handle_append(request["message"], request["w"], request.get("trace_id"),
+                             request.get("idempotency_key"), request.get("deadline"), request.get("ack"),
+                             not request.get("async", False))
+    if op == "append_batch":
+        return handle_append_batch(request["messages"], request["w"], request.get("trace_id"),
+                                   request.get("idempotency_key"), request.get("deadline"), request.get("ack"),
+                                   not request.get("async", False))
+    if op == "status":
+        return handle_status(request["id"], request.get("w"), request.get("wait", 0))
+    if op == "list":
+        return handle_list(request.get("ids", False))
+    if op == "read":
+        return handle_read(request["cursor"], request["limit"])
+    if op == "sync":
+        return handle_sync(request["addr"])
+    if op == "limits":
+        return handle_limits()
+    if op == "latency":
+        return handle_latency()
+    if op == "debug_profile":
+        return handle_debug_profile(request["seconds"], request["format"])
+    if op == "debug_memory":
+        return {"text": profiling.memory(request["limit"], request["stop"])}, 200
+    if op == "export_snapshot":
+        return handle_export_snapshot()
+    if op == "export_page":
+        return handle_export_page(request["start"], request["stop"])
+    return {"error": f"Невідома операція {op}"}, 400
+
+def execute(request):
+    if sequencer_client is not None:
+        return sequencer_client.call(request)
+    return dispatch(request)
+
+class BadRequest(Exception):
+    """Некоректні параметри запису; текст повертається клієнту з кодом 400."""
+
+def parse_write_options(data):
+    """Спільні для POST /messages та /messages/batch параметри: (w, deadline, ack, async)."""
     try:
-        message = data.get("message")
         w = min(int(data.get("w", 1)), len(secondary_addresses) + 1)
+        timeout_ms = data.get("timeout_ms")
+        timeout_ms = None if timeout_ms is None else int(timeout_ms)
+        ack_mode = data.get("ack", ACK_MODE)
+        # У protobuf-запитах параметри приходять рядками з query.
+        async_write = str(data.get("async", False)).lower() in ("1", "true")
     except Exception as e:
-        log.error(f"Помилка розбору JSON: {e}")
-        return flask.jsonify({"error": "Некоректний JSON"}), 400
+        log.error("Помилка розбору JSON: %s", e, extra={"category": "http"})
+        raise BadRequest("Некоректний JSON")
+    if timeout_ms is not None and timeout_ms <= 0:
+        raise BadRequest("timeout_ms має бути додатним")
+    if ack_mode not in ACK_MODES:
+        raise BadRequest(f"ack має бути одним із {', '.join(ACK_MODES)}")
+    # Бюджет рахується від отримання запиту. CLOCK_MONOTONIC спільний для всіх процесів
+    # машини, тож deadline можна передавати секвенсору в режимі обробників.
+    deadline = None if timeout_ms is None else time.monotonic() + timeout_ms / 1000
+    return w, deadline, ack_mode, async_write
 
-    if not message:
-        return flask.jsonify({"error": "Не вказано повідомлення"}), 400
+class UnsupportedMediaType(Exception):
+    """Content-Type тіла не підтримується (або msgpack не встановлено)."""
 
-    messages.append((message_id, message))
-    log.info(f"Додано повідомлення: {message} з id {message_id} та w={w}")
+def request_body(batch=False):
+    """Розбирає тіло запису відповідно до Content-Type у словник тієї ж форми, що й JSON."""
+    content_type = flask.request.mimetype or JSON_TYPE
+    if content_type == JSON_TYPE:
+        return flask.request.get_json(force=True)
+    if content_type == PROTOBUF_TYPE:
+        data = dict(flask.request.args)
+        if batch:
+            entries = replication_pb2.RangeResponse.FromString(flask.request.get_data()).entries
+            data["messages"] = [logentry.entry_message(entry) for entry in entries]
+        else:
+            data["message"] = logentry.entry_message(replication_pb2.LogEntry.FromString(flask.request.get_data()))
+        return data
+    if content_type == MSGPACK_TYPE and msgpack:
+        return msgpack.unpackb(flask.request.get_data())
+    raise UnsupportedMediaType(content_type)
 
+def unsupported_media_type(e):
+    return flask.jsonify({"error": f"Непідтримуваний Content-Type {e}, очікується один із: "
+                                   f"{', '.join(BODY_TYPES)}"}), 415
 
-    for addr in secondary_addresses:
-        pending_messages[addr].put((message_id, message))
+def response_type():
+    return flask.request.accept_mimetypes.best_match(BODY_TYPES, default=JSON_TYPE)
 
+def encode_response(body, status, to_proto):
+    """Кодує успішну відповідь у формат з Accept; to_proto будує protobuf-повідомлення з body."""
+    mimetype = response_type()
+    if status not in (200, 202) or mimetype == JSON_TYPE:
+        return flask.jsonify(body), status
+    if mimetype == PROTOBUF_TYPE:
+        return flask.Response(to_proto(body).SerializeToString(), mimetype=PROTOBUF_TYPE), status
+    return flask.Response(msgpack.packb(body), mimetype=MSGPACK_TYPE), status
 
-    threads = []
-    for addr in secondary_addresses:
-        t = threading.Thread(target=process_pending_messages, args=(addr,))
-        t.start()
-        threads.append(t)
+def entries_proto(entries):
+    return replication_pb2.RangeResponse(entries=[logentry.entry_proto(msg_id, msg) for msg_id, msg in entries])
 
+def write_response(body, status, to_proto):
+    response, status = encode_response(body, status, to_proto)
+    if status in (429, 503):
+        response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, status
 
-    start_time = time.time()
-    required_acks = w
-    ack_count = 1 
-    while ack_count < required_acks and time.time() - start_time < 60:  
-        for addr in secondary_addresses:
-            if last_acked_message[addr] >= message_id:
-                ack_count += 1
-        if ack_count < required_acks:
-            log.info(f"Очікуємо {required_acks} ACK, отримано {ack_count}")
-            time.sleep(0.5) 
-        else:
-            break
+@app.route("/messages", methods=["POST"])
+def append_message():
+    start_ns = time.time_ns()
+    trace_id = tracing.new_trace_id() if tracing.enabled else None
+    log.info("Отримано запит: %s", flask.request.data, extra={"category": "http"})
+    try:
+        data = request_body()
+        message = data.get("message")
+        w, deadline, ack_mode, async_write = parse_write_options(data)
+    except UnsupportedMediaType as e:
+        return unsupported_media_type(e)
+    except BadRequest as e:
+        return flask.jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error("Помилка розбору тіла запиту: %s", e, extra={"category": "http"})
+        return flask.jsonify({"error": "Некоректне тіло запиту"}), 400
+    if not message or not isinstance(message, (str, bytes)):
+        return flask.jsonify({"error": "Не вказано повідомлення"}), 400
 
-    if ack_count >= required_acks:
-        log.info(f"Отримано {ack_count} ACK, потрібно {required_acks}, успішно")
-        message_id += 1  
-        return flask.jsonify({"status": "success", "messages": [msg[1] for msg in sorted(messages)]}), 200
-    else:
-        log.error(f"Не отримано достатньо ACK: отримано {ack_count}, потрібно {required_acks}")
-        messages.pop()  
-        return flask.jsonify({"error": "Недостатньо ACK"}), 500
+    tracing.record(trace_id, "http.parse", start_ns, time.time_ns())
+    body, status = execute({"op": "append", "message": message, "w": w, "trace_id": trace_id,
+                            "idempotency_key": flask.request.headers.get("Idempotency-Key"),
+                            "deadline": deadline, "ack": ack_mode, "async": async_write})
+    tracing.record(trace_id, "http.append", start_ns, time.time_ns(), w=w, status=status)
+    # Відповідь однакова в обох режимах — id і статус: серіалізація всього логу на кожен
+    # запис була б вузьким місцем. Увесь лог віддає GET /messages.
+    # У protobuf-відповіді лише id запису.
+    return write_response(body, status, lambda body: replication_pb2.LogEntry(id=body["id"]))
+
+@app.route("/messages/batch", methods=["POST"])
+def append_batch():
+    """Пакет {"messages": [...], "w", "timeout_ms", "ack"}: записи отримують послідовні id,
+    відповідь 200 {"ids": [...]} приходить, коли write concern виконано для всього пакета.
+    З "async": true — одразу 202 {"status": "pending", "ids": [...]}."""
+    start_ns = time.time_ns()
+    trace_id = tracing.new_trace_id() if tracing.enabled else None
+    try:
+        data = request_body(batch=True)
+        batch = data.get("messages")
+        w, deadline, ack_mode, async_write = parse_write_options(data)
+    except UnsupportedMediaType as e:
+        return unsupported_media_type(e)
+    except BadRequest as e:
+        return flask.jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error("Помилка розбору тіла запиту: %s", e, extra={"category": "http"})
+        return flask.jsonify({"error": "Некоректне тіло запиту"}), 400
+    if not batch or not isinstance(batch, list) or not all(isinstance(m, (str, bytes)) and m for m in batch):
+        return flask.jsonify({"error": "messages має бути непорожнім списком непорожніх рядків чи bytes"}), 400
+    if len(batch) > MAX_BATCH_SIZE:
+        return flask.jsonify({"error": f"Пакет більший за MAX_BATCH_SIZE={MAX_BATCH_SIZE}"}), 413
+    log.info("Отримано пакет із %d повідомлень", len(batch), extra={"category": "http"})
+
+    tracing.record(trace_id, "http.parse", start_ns, time.time_ns(), size=len(batch))
+    body, status = execute({"op": "append_batch", "messages": batch, "w": w, "trace_id": trace_id,
+                            "idempotency_key": flask.request.headers.get("Idempotency-Key"),
+                            "deadline": deadline, "ack": ack_mode, "async": async_write})
+    tracing.record(trace_id, "http.append", start_ns, time.time_ns(), w=w, status=status, size=len(batch))
+    return write_response(body, status, lambda body: replication_pb2.RangeResponse(
+        entries=[replication_pb2.LogEntry(id=msg_id) for msg_id in body["ids"]]))
 
 @app.route("/messages", methods=["GET"])
 def list_messages():
-    log.info(f"Список повідомлень: {[msg[1] for msg in sorted(messages)]}")
-    return flask.jsonify({"messages": [msg[1] for msg in sorted(messages)]}), 200
+    """Увесь лог; з ?cursor=N[&limit=M] — до M записів, починаючи з позиції N, і курсор наступної сторінки."""
+    if "cursor" not in flask.request.args:
+        if response_type() == PROTOBUF_TYPE:
+            body, status = execute({"op": "list", "ids": True})
+            return encode_response(body, status, lambda body: entries_proto(body["entries"]))
+        body, status = execute({"op": "list"})
+        return encode_response(body, status, None)
+    cursor = flask.request.args.get("cursor", type=int)
+    limit = flask.request.args.get("limit", MAX_BATCH_SIZE, type=int)
+    if cursor is None or cursor < 0 or limit is None or limit <= 0:
+        return flask.jsonify({"error": "cursor та limit мають бути невід'ємним і додатним цілими"}), 400
+    body, status = execute({"op": "read", "cursor": cursor, "limit": min(limit, MAX_BATCH_SIZE)})
+    response, status = encode_response(body, status, lambda body: entries_proto(
+        (entry["id"], entry["message"]) for entry in body["entries"]))
+    response.headers["X-Next-Cursor"] = str(body.get("cursor", cursor))
+    return response, status
+
+@app.route("/messages/<int:msg_id>/status", methods=["GET"])
+def message_status(msg_id):
+    """Стан запису (committed, pending, failed) та вузли, що його підтвердили; ?w=N, ?wait=секунди."""
+    w = flask.request.args.get("w", type=int)
+    wait = flask.request.args.get("wait", 0, type=float)
+    if (w is not None and w < 1) or wait is None or wait < 0:
+        return flask.jsonify({"error": "w має бути додатним, wait — невід'ємним числом секунд"}), 400
+    body, status = execute({"op": "status", "id": msg_id, "w": w, "wait": wait})
+    return flask.jsonify(body), status
+
+@app.route("/messages/export", methods=["GET"])
+def export_messages():
+    """Потоковий NDJSON-експорт логу ({"id", "message"} на рядок) станом на момент запиту.
+
+    Записи читаються сторінками по EXPORT_PAGE_SIZE, тож пам'ять не залежить від розміру логу.
+    """
+    snapshot, _ = execute({"op": "export_snapshot"})
+    end = snapshot["end"]
+    log.info("Експорт логу: %d записів", end, extra={"category": "read"})
+
+    def generate():
+        for start in range(0, end, EXPORT_PAGE_SIZE):
+            page, _ = execute({"op": "export_page", "start": start, "stop": min(end, start + EXPORT_PAGE_SIZE)})
+            yield "".join(logentry.dumps({"id": msg_id, "message": msg}) + "\n" for msg_id, msg in page["entries"])
+
+    response = flask.Response(flask.stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["X-Log-Length"] = str(end)
+    return response
+
+def debug_response(body, status):
+    if status == 200:
+        return flask.Response(body["text"], mimetype="text/plain")
+    return flask.jsonify(body), status
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """Семпли стеків усіх потоків за seconds секунд (collapsed stacks або format=top)."""
+    if not profiling.authorized(flask.request.headers.get("X-Debug-Token")):
+        flask.abort(404)
+    seconds = flask.request.args.get("seconds", 10, type=float)
+    fmt = flask.request.args.get("format", "collapsed")
+    if not seconds or not 0 < seconds <= profiling.MAX_PROFILE_SECONDS or fmt not in ("collapsed", "top"):
+        return flask.jsonify({"error": f"seconds має бути в (0, {profiling.MAX_PROFILE_SECONDS}], "
+                                       "format — collapsed або top"}), 400
+    return debug_response(*execute({"op": "debug_profile", "seconds": seconds, "format": fmt}))
+
+@app.route("/debug/memory", methods=["GET"])
+def debug_memory():
+    """Найбільші виділення пам'яті (tracemalloc) та приріст з попереднього виклику."""
+    if not profiling.authorized(flask.request.headers.get("X-Debug-Token")):
+        flask.abort(404)
+    limit = flask.request.args.get("limit", 20, type=int)
+    stop = flask.request.args.get("stop") == "1"
+    return debug_response(*execute({"op": "debug_memory", "limit": limit, "stop": stop}))
+
+@app.route("/latency", methods=["GET"])
+def latency():
+    """EWMA затримок реплікації по вузлах та очікувана затримка запису для кожного w."""
+    body, status = execute({"op": "latency"})
+    return flask.jsonify(body), status
+
+@app.route("/limits", methods=["GET"])
+def limits():
+    """Поточний стан контролю допуску: записи в польоті та довжини черг реплікації."""
+    body, status = execute({"op": "limits"})
+    return flask.jsonify(body), status
 
 @app.route("/sync/<addr>", methods=["POST"])
 def sync_node(addr):
     """Синхронізація вторинного вузла після його відновлення."""
-    if addr not in secondary_addresses:
-        return flask.jsonify({"error": "Невідомий вторинний вузол"}), 400
-    log.info(f"Синхронізація вузла {addr}")
-    sync_missing_messages(addr)
-    process_pending_messages(addr)
-    return flask.jsonify({"status": "success"}), 200
+    body, status = execute({"op": "sync", "addr": addr})
+    return flask.jsonify(body), status
+
+def run_ingest_worker(sequencer):
+    global sequencer_client
+    # Слухаючий сокет секвенсора дістався у спадок від fork — обробнику він не потрібен.
+    sequencer.socket.close()
+    sequencer_client = ingest.SequencerClient(SEQUENCER_SOCKET)
+    ingest.serve_worker(app, "0.0.0.0", 5000)
+
+def run_with_ingest_workers(worker_count):
+    """N процесів приймають HTTP на порту 5000, цей процес — єдиний секвенсор і реплікатор."""
+    import multiprocessing
+    # Обробники створюються до запуску gRPC: fork після старту gRPC небезпечний.
+    # Сокет секвенсора відкриваємо до fork: обробники приймають HTTP одразу після старту.
+    sequencer = ingest.bind_sequencer(SEQUENCER_SOCKET, dispatch)
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=run_ingest_worker, args=(sequencer,), daemon=True)
+               for _ in range(worker_count)]
+    for worker in workers:
+        worker.start()
+    grpc_thread = threading.Thread(target=run_grpc_server, daemon=True)
+    grpc_thread.start()
+    start_replication()
+    if DATA_DIR:
+        start_persistence()
+    log.info("Запущено %d процесів-обробників HTTP", worker_count)
+    ingest.run_sequencer(sequencer)
 
 if __name__ == "__main__":
+    if DATA_DIR:
+        load_state()
+    if INGEST_WORKERS > 0:
+        run_with_ingest_workers(INGEST_WORKERS)
     grpc_thread = threading.Thread(target=run_grpc_server, daemon=True)
     grpc_thread.start()
+    start_replication()
+    if DATA_DIR:
+        start_persistence()
     app.run(host="0.0.0.0", port=5000)
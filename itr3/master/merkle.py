@@ -0,0 +1,99 @@
+"""Дерево Меркла над логом для anti-entropy між майстром та вторинними вузлами.
+
+Id логу поділено на кошики по MERKLE_BUCKET_SIZE записів. Хеш кошика — XOR
+хешів його записів, тож додавання чи заміна запису змінює лише один лист за O(1)
+незалежно від порядку надходження. Над листками будується бінарне дерево;
+вузли повністю заповненої частини кешуються й скидаються лише на шляху від
+зміненого листка.
+
+Дерево завжди порівнюють для перших N кошиків (N задає вторинний вузол за своїм
+applied_through), решта листків вважається порожньою. Тож обидві сторони рахують
+однакову форму дерева, а хвіст, що ще реплікується, не дає хибних розбіжностей.
+
+Файл однаковий для майстра та вторинних вузлів (копія, як і replication_pb2).
+"""
+import hashlib
+import os
+import threading
+
+MERKLE_BUCKET_SIZE = int(os.getenv("MERKLE_BUCKET_SIZE", 1024))
+DIGEST_SIZE = 16
+
+
+def entry_digest(msg_id, message):
+    # Бінарний запис має інший роздільник: текст "abc" і bytes b"abc" не збігаються.
+    if isinstance(message, bytes):
+        data = f"{msg_id}#".encode("utf-8") + message
+    else:
+        data = f"{msg_id}:{message}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest(), "big")
+
+
+def combine(left, right):
+    return hashlib.blake2b(left + right, digest_size=DIGEST_SIZE).digest()
+
+
+def height(buckets):
+    """Кількість рівнів над листками в дереві з buckets листками."""
+    return max(0, (buckets - 1).bit_length())
+
+
+class MerkleTree:
+    def __init__(self, bucket_size=MERKLE_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.leaves = []
+        self.cache = {}
+        self.empty = [bytes(DIGEST_SIZE)]
+        self.lock = threading.Lock()
+
+    def add(self, msg_id, message):
+        self._toggle(msg_id, entry_digest(msg_id, message))
+
+    def remove(self, msg_id, message):
+        # XOR сам собі обернений: повторне «додавання» прибирає запис з кошика.
+        self._toggle(msg_id, entry_digest(msg_id, message))
+
+    def _toggle(self, msg_id, digest):
+        bucket = msg_id // self.bucket_size
+        with self.lock:
+            if bucket >= len(self.leaves):
+                self.leaves.extend([0] * (bucket + 1 - len(self.leaves)))
+            self.leaves[bucket] ^= digest
+            level, index = 1, bucket >> 1
+            while (1 << (level - 1)) < len(self.leaves):
+                self.cache.pop((level, index), None)
+                level, index = level + 1, index >> 1
+
+    def bucket_range(self, bucket):
+        """Id (включно), що належать кошику."""
+        return bucket * self.bucket_size, (bucket + 1) * self.bucket_size - 1
+
+    def complete_buckets(self, applied_through):
+        """Скільки кошиків повністю покрито id 0..applied_through."""
+        return (applied_through + 1) // self.bucket_size
+
+    def hashes(self, buckets, level, nodes):
+        """Хеші вузлів рівня level (0 — листки) у дереві з перших buckets кошиків."""
+        with self.lock:
+            return [self._node(level, index, buckets) for index in nodes]
+
+    def _empty(self, level):
+        while len(self.empty) <= level:
+            self.empty.append(combine(self.empty[-1], self.empty[-1]))
+        return self.empty[level]
+
+    def _node(self, level, index, buckets):
+        start, end = index << level, (index + 1) << level
+        if start >= buckets:
+            return self._empty(level)
+        if level == 0:
+            value = self.leaves[index] if index < len(self.leaves) else 0
+            return value.to_bytes(DIGEST_SIZE, "big")
+        # Вузли, що перетинають межу buckets, залежать від N і не кешуються: їх лише один на рівень.
+        cacheable = end <= buckets and end <= len(self.leaves)
+        if cacheable and (level, index) in self.cache:
+            return self.cache[(level, index)]
+        value = combine(self._node(level - 1, 2 * index, buckets), self._node(level - 1, 2 * index + 1, buckets))
+        if cacheable:
+            self.cache[(level, index)] = value
+        return value
@@ -0,0 +1,411 @@
+"""Логіка доставки записів від майстра до вторинних вузлів без мережі та годинника.
+
+Тут зібрано те, що визначає поведінку реплікації: облік ACK (кумулятивний
+водяний знак і окремі ACK наперед), черга вузла з обмеженням одночасних
+доставок і паузою після невдачі, ретраї з паузою min(2**спроба, 10) с і
+таймаутом RPC, обрізаним дедлайном запису, розбір відповіді ланцюга, вікно
+надсилання з пріоритетом найшвидшого вузла, EWMA затримок і контроль допуску.
+
+Усе це складає Replicator, а транспорт і годинник задає його підклас: master.py
+виконує спроби через gRPC future на time.monotonic, simulate.py — подіями на
+віртуальному годиннику. Тому одна доставка — генератор deliver(), що віддає кроки
+Send і Sleep та отримує результат кожного Send (Reply або None, якщо RPC не вдався).
+"""
+import heapq
+import itertools
+import threading
+from collections import deque, namedtuple
+
+# Кроки доставки: надіслати спробу attempt із таймаутом timeout або почекати seconds.
+# clipped — таймаут обрізано дедлайном клієнта; failures — скільки невдач уже зараховано доставці.
+Send = namedtuple("Send", "attempt timeout clipped failures")
+Sleep = namedtuple("Sleep", "seconds")
+# Відповідь вузла на ReplicateMessage; applied_through — None, якщо вузол його не передав.
+Reply = namedtuple("Reply", "ok applied_through chain_acks")
+
+
+def backlog_full(lag, max_backlog):
+    """Чи досягло відставання вузла межі: нові записи тоді не ставляться в його чергу."""
+    return lag >= max_backlog
+
+
+def admission(inflight, max_inflight, lags, max_backlog, w):
+    """Причина відмови запису ("inflight" чи "backlog") або None, якщо його можна прийняти."""
+    if inflight >= max_inflight:
+        return "inflight"
+    if 1 + sum(1 for lag in lags if not backlog_full(lag, max_backlog)) < w:
+        return "backlog"
+    return None
+
+
+class RetryPolicy:
+    def __init__(self, timeout=10, max_attempts=5, max_backoff=10):
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+
+    def backoff(self, attempt):
+        return min(2 ** attempt, self.max_backoff)
+
+    def rpc_timeout(self, timeout, deadline, now):
+        """Поки клієнт чекає, спроба не довша за залишок його бюджету; після дедлайну — звичайний таймаут."""
+        if deadline is None or deadline <= now:
+            return timeout
+        return min(timeout, deadline - now)
+
+    def cut_by_deadline(self, step, deadline, now):
+        """Чи обірвалася невдала спроба лише тому, що настав дедлайн клієнта.
+
+        Така спроба нічого не каже про вузол: вона не витрачає спробу й паузу і не
+        потрапляє в EWMA затримок.
+        """
+        return step.clipped and deadline is not None and now >= deadline
+
+
+def deliver(policy, chain_length, deadline, clock):
+    """Генератор однієї доставки: до policy.max_attempts кроків Send із паузами Sleep між ними.
+
+    ACK ланцюга повертається лише після проходу всіх його вузлів, тож таймаут
+    множиться на довжину ланцюга. Спроба, яку обірвав дедлайн клієнта, не
+    зараховується: наступна йде одразу з повним таймаутом. Повертає Reply першої
+    вдалої спроби або None.
+    """
+    timeout = policy.timeout * chain_length
+    failures = 0
+    for attempt in itertools.count(1):
+        rpc_timeout = policy.rpc_timeout(timeout, deadline, clock())
+        step = Send(attempt, rpc_timeout, rpc_timeout < timeout, failures)
+        reply = yield step
+        if reply is not None:
+            return reply
+        if policy.cut_by_deadline(step, deadline, clock()):
+            continue
+        failures += 1
+        if failures == policy.max_attempts:
+            return None
+        yield Sleep(policy.backoff(failures))
+
+
+def chain_outcome(chain, reply):
+    """(вузли ланцюга, що мають запис; вузли, яким його треба надіслати напряму).
+
+    Старі вторинні вузли не заповнюють chain_acks: їхній ACK рахується за один.
+    """
+    if reply is None:
+        return [], list(chain[1:])
+    acked = max(1, min(reply.chain_acks, len(chain)))
+    return list(chain[:acked]), list(chain[acked:])
+
+
+class AckTracker:
+    """Кумулятивний стан кожного вузла: усі id до watermark[key] включно вже на ньому.
+
+    Окремі ACK записів із більшими id (вони приходять не по порядку) чекають в
+    ahead, доки водяний знак їх не наздожене.
+    """
+
+    def __init__(self, keys):
+        self.watermark = {key: -1 for key in keys}
+        self.ahead = {key: set() for key in keys}
+        self.lock = threading.Lock()
+
+    def record(self, key, msg_id=None, applied_through=None):
+        """Просуває стан вузла одним кроком; повертає (попередній, новий) водяний знак.
+
+        applied_through — кумулятивний ACK (усі id до нього включно), msg_id — ACK
+        одного запису, що може випереджати водяний знак.
+        """
+        with self.lock:
+            previous = through = self.watermark[key]
+            ahead = self.ahead[key]
+            if msg_id is not None and msg_id > through:
+                ahead.add(msg_id)
+            if applied_through is not None and applied_through > through:
+                through = applied_through
+                ahead = self.ahead[key] = {acked for acked in ahead if acked > through}
+            while through + 1 in ahead:
+                through += 1
+                ahead.discard(through)
+            self.watermark[key] = through
+            return previous, through
+
+    def reset(self, key, through):
+        """SYNC: вузол — джерело істини щодо того, що він уже має."""
+        with self.lock:
+            self.watermark[key] = through
+            self.ahead[key] = set()
+
+    def is_acked(self, key, msg_id):
+        return msg_id <= self.watermark[key] or msg_id in self.ahead[key]
+
+    def lag(self, key, last_id):
+        """Кількість записів до last_id включно, які вузол ще не підтвердив кумулятивно."""
+        return last_id - self.watermark[key]
+
+    def commit_index(self, last_id):
+        """Найбільший id, який разом із усіма попередніми є на більшості вузлів (майстер — один із них)."""
+        quorum = (len(self.watermark) + 1) // 2 + 1
+        if quorum <= 1:
+            return last_id
+        watermarks = sorted(self.watermark.values(), reverse=True)
+        return min(last_id, watermarks[quorum - 2])
+
+
+class LatencyTracker:
+    """EWMA тривалості ReplicateMessage для кожного вузла окремо за режимом ACK."""
+
+    def __init__(self, keys, alpha):
+        self.alpha = alpha
+        self.ewma = {key: {} for key in keys}
+        self.lock = threading.Lock()
+
+    def observe(self, key, mode, seconds):
+        with self.lock:
+            previous = self.ewma[key].get(mode)
+            self.ewma[key][mode] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def expected(self, key, mode):
+        """Очікувана тривалість; без вимірів — 0, щоб вузол спробували."""
+        return self.ewma[key].get(mode, 0.0)
+
+    def order(self, keys, mode):
+        return sorted(keys, key=lambda key: self.expected(key, mode))
+
+
+class SendWindow:
+    """Обмежує кількість одночасних ReplicateMessage (0 — без обмеження); вільний слот
+    отримує той, хто чекає з найменшим пріоритетом (очікуваною затримкою вузла).
+
+    Не блокує: enqueue і release повертають тих, хто щойно отримав слот, а як їх
+    розбудити, вирішує викликач.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.active = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def enqueue(self, priority, waiter):
+        with self.lock:
+            heapq.heappush(self.waiting, (priority, next(self.counter), waiter))
+            return self._grant()
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            return self._grant()
+
+    def _grant(self):
+        granted = []
+        while self.waiting and (not self.size or self.active < self.size):
+            granted.append(heapq.heappop(self.waiting)[2])
+            self.active += 1
+        return granted
+
+
+class DeliveryQueue:
+    """Черга записів одного вузла.
+
+    Записи беруться по порядку, одночасно доставляється не більше concurrency, а
+    після невдалої доставки (усі спроби вичерпано) запис повертається в кінець черги
+    і черга стоїть retry_pause секунд. Записи понад max_backlog непідтверджених у
+    чергу не потрапляють (overflowed): їх дочитують з логу через rebuild().
+    """
+
+    def __init__(self, concurrency, retry_pause, max_backlog):
+        self.concurrency = concurrency
+        self.retry_pause = retry_pause
+        self.max_backlog = max_backlog
+        self.entries = deque()
+        self.active = 0
+        self.retry_at = 0.0
+        self.overflowed = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def offer(self, msg_id, message, lag):
+        """Ставить новий запис, якщо відставання вузла без нього ще не досягло max_backlog."""
+        with self.lock:
+            if backlog_full(lag, self.max_backlog):
+                self.overflowed = True
+                return False
+            self.entries.append((msg_id, message))
+            return True
+
+    def put(self, msg_id, message):
+        with self.lock:
+            self.entries.append((msg_id, message))
+
+    def rebuild(self, entries, is_acked):
+        """Перебудовує чергу з хвоста логу (SYNC, переповнення), щоб не надсилати запис кілька
+        разів; повертає кількість непідтверджених записів у entries."""
+        with self.lock:
+            self.entries.clear()
+            self.overflowed = False
+            count = 0
+            for msg_id, message in entries:
+                if is_acked(msg_id):
+                    continue
+                if count < self.max_backlog:
+                    self.entries.append((msg_id, message))
+                else:
+                    self.overflowed = True
+                count += 1
+            return count
+
+    def needs_rebuild(self):
+        """Черга спорожніла, а частина записів у неї не вмістилася."""
+        return self.overflowed and not self.entries
+
+    def take(self, now, is_acked):
+        """Наступний непідтверджений запис, якщо є вільний слот і черга не на паузі; інакше None."""
+        with self.lock:
+            if self.active >= self.concurrency or now < self.retry_at:
+                return None
+            while self.entries:
+                msg_id, message = self.entries.popleft()
+                if not is_acked(msg_id):
+                    self.active += 1
+                    return msg_id, message
+            return None
+
+    def finish(self, msg_id, message, delivered, now):
+        with self.lock:
+            self.active -= 1
+            if not delivered:
+                self.entries.append((msg_id, message))
+                self.retry_at = now + self.retry_pause
+
+    def pause(self, now):
+        """Скільки ще черга стоїть після невдалої доставки."""
+        return max(0.0, self.retry_at - now)
+
+
+class Replicator:
+    """Доставка записів із черг DeliveryQueue до вузлів: без потоку на запис чи спробу.
+
+    Кожна доставка — генератор deliver(), який просувають відповіді транспорту та
+    відкладені виклики. Підклас задає середовище:
+      clock() — поточний час у секундах;
+      call_later(seconds, callback, *args) — відкладений виклик (пауза між спробами);
+      transport(key, msg_id, message, chain, step, done) — починає ReplicateMessage до
+          key з таймаутом step.timeout і рівно один раз викликає done(Reply або None);
+      wake(key) — черга key знову може видати записи, хтось має викликати pump(key);
+      rebuild(key) — дочитує в чергу з логу записи, що в неї не вмістилися.
+    """
+
+    def __init__(self, queues, tracker, latency, window, policy, ack_mode):
+        self.queues = queues
+        self.tracker = tracker
+        self.latency = latency
+        self.window = window
+        self.policy = policy
+        self.ack_mode = ack_mode
+
+    def clock(self):
+        raise NotImplementedError
+
+    def call_later(self, seconds, callback, *args):
+        raise NotImplementedError
+
+    def transport(self, key, msg_id, message, chain, step, done):
+        raise NotImplementedError
+
+    def wake(self, key):
+        raise NotImplementedError
+
+    def rebuild(self, key):
+        raise NotImplementedError
+
+    def chain_for(self, key):
+        """Вузли, через які проходить запис, надісланий key (сам key — перший)."""
+        return [key]
+
+    def deadline_of(self, msg_id):
+        return None
+
+    def ack_mode_of(self, msg_id):
+        return self.ack_mode
+
+    def record_ack(self, key, msg_id=None, applied_through=None):
+        self.tracker.record(key, msg_id, applied_through)
+
+    def is_acked(self, key, msg_id):
+        return self.tracker.is_acked(key, msg_id)
+
+    def pump(self, key):
+        """Починає доставки з черги key, доки є вільні слоти й записи; повертає, скільки
+        секунд черга ще стоїть на паузі після невдачі (0 — не стоїть)."""
+        queue = self.queues[key]
+        while True:
+            entry = queue.take(self.clock(), lambda msg_id: self.is_acked(key, msg_id))
+            if entry is not None:
+                self.start_delivery(key, *entry)
+                continue
+            if queue.needs_rebuild():
+                # Черга спорожніла — дочитуємо з логу те, що не вмістилося в неї.
+                self.rebuild(key)
+                continue
+            return queue.pause(self.clock())
+
+    def start_delivery(self, key, msg_id, message):
+        chain = self.chain_for(key)
+        delivery = deliver(self.policy, len(chain), self.deadline_of(msg_id), self.clock)
+        self.advance(key, msg_id, message, chain, delivery, None)
+
+    def advance(self, key, msg_id, message, chain, delivery, result):
+        try:
+            step = delivery.send(result)
+        except StopIteration as stop:
+            self.delivered(key, msg_id, message, chain, stop.value)
+            return
+        if isinstance(step, Sleep):
+            self.call_later(step.seconds, self.advance, key, msg_id, message, chain, delivery, None)
+            return
+        attempt = (key, msg_id, message, chain, delivery, step)
+        if not self.window.size:
+            self.attempt(*attempt)
+            return
+        for granted in self.window.enqueue(self.latency.expected(key, self.ack_mode_of(msg_id)), attempt):
+            self.attempt(*granted)
+
+    def attempt(self, key, msg_id, message, chain, delivery, step):
+        started = self.clock()
+
+        def done(reply):
+            if self.window.size:
+                for granted in self.window.release():
+                    self.attempt(*granted)
+            now = self.clock()
+            if reply is not None or not self.policy.cut_by_deadline(step, self.deadline_of(msg_id), now):
+                elapsed = now - started
+                if reply is None:
+                    # Невдала спроба коштує запису ще й паузу перед наступною.
+                    elapsed += self.policy.backoff(step.failures + 1)
+                self.latency.observe(key, self.ack_mode_of(msg_id), elapsed)
+            self.advance(key, msg_id, message, chain, delivery, reply)
+
+        self.transport(key, msg_id, message, chain, step, done)
+
+    def delivered(self, key, msg_id, message, chain, reply):
+        """Кінець доставки: облік ACK, обхід розриву ланцюга, а невдалий запис — назад у чергу."""
+        acked, bypass = chain_outcome(chain, reply)
+        if reply is not None:
+            # Водяний знак у відповіді описує лише вузол, якому ми надсилали (голову ланцюга).
+            self.record_ack(key, msg_id, reply.applied_through)
+            for other in acked[1:]:
+                self.record_ack(other, msg_id)
+        self.send_directly(bypass, msg_id, message)
+        self.queues[key].finish(msg_id, message, reply is not None and reply.ok, self.clock())
+        self.wake(key)
+
+    def send_directly(self, keys, msg_id, message):
+        """Обхід розриву ланцюга: вузли після нього отримують запис напряму, від найшвидшого."""
+        for key in self.latency.order(keys, self.ack_mode_of(msg_id)):
+            if not self.is_acked(key, msg_id):
+                self.queues[key].put(msg_id, message)
+                self.wake(key)
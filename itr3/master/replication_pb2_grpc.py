@@ -39,6 +39,26 @@ class ReplicationServiceStub(object):
                 request_serializer=replication__pb2.MessageRequest.SerializeToString,
                 response_deserializer=replication__pb2.AckResponse.FromString,
                 _registered_method=True)
+        self.Sync = channel.unary_unary(
+                '/ReplicationService/Sync',
+                request_serializer=replication__pb2.SyncRequest.SerializeToString,
+                response_deserializer=replication__pb2.SyncResponse.FromString,
+                _registered_method=True)
+        self.FetchRange = channel.unary_unary(
+                '/ReplicationService/FetchRange',
+                request_serializer=replication__pb2.RangeRequest.SerializeToString,
+                response_deserializer=replication__pb2.RangeResponse.FromString,
+                _registered_method=True)
+        self.TreeDigest = channel.unary_unary(
+                '/ReplicationService/TreeDigest',
+                request_serializer=replication__pb2.TreeRequest.SerializeToString,
+                response_deserializer=replication__pb2.TreeResponse.FromString,
+                _registered_method=True)
+        self.Acknowledge = channel.unary_unary(
+                '/ReplicationService/Acknowledge',
+                request_serializer=replication__pb2.SyncRequest.SerializeToString,
+                response_deserializer=replication__pb2.AckResponse.FromString,
+                _registered_method=True)
 
 
 class ReplicationServiceServicer(object):
@@ -50,6 +70,30 @@ class ReplicationServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Sync(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def FetchRange(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def TreeDigest(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Acknowledge(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ReplicationServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +102,26 @@ def add_ReplicationServiceServicer_to_server(servicer, server):
                     request_deserializer=replication__pb2.MessageRequest.FromString,
                     response_serializer=replication__pb2.AckResponse.SerializeToString,
             ),
+            'Sync': grpc.unary_unary_rpc_method_handler(
+                    servicer.Sync,
+                    request_deserializer=replication__pb2.SyncRequest.FromString,
+                    response_serializer=replication__pb2.SyncResponse.SerializeToString,
+            ),
+            'FetchRange': grpc.unary_unary_rpc_method_handler(
+                    servicer.FetchRange,
+                    request_deserializer=replication__pb2.RangeRequest.FromString,
+                    response_serializer=replication__pb2.RangeResponse.SerializeToString,
+            ),
+            'TreeDigest': grpc.unary_unary_rpc_method_handler(
+                    servicer.TreeDigest,
+                    request_deserializer=replication__pb2.TreeRequest.FromString,
+                    response_serializer=replication__pb2.TreeResponse.SerializeToString,
+            ),
+            'Acknowledge': grpc.unary_unary_rpc_method_handler(
+                    servicer.Acknowledge,
+                    request_deserializer=replication__pb2.SyncRequest.FromString,
+                    response_serializer=replication__pb2.AckResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'ReplicationService', rpc_method_handlers)
@@ -95,3 +159,111 @@ class ReplicationService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def Sync(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ReplicationService/Sync',
+            replication__pb2.SyncRequest.SerializeToString,
+            replication__pb2.SyncResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def FetchRange(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ReplicationService/FetchRange',
+            replication__pb2.RangeRequest.SerializeToString,
+            replication__pb2.RangeResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def TreeDigest(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ReplicationService/TreeDigest',
+            replication__pb2.TreeRequest.SerializeToString,
+            replication__pb2.TreeResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Acknowledge(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/ReplicationService/Acknowledge',
+            replication__pb2.SyncRequest.SerializeToString,
+            replication__pb2.AckResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
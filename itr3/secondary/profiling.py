@@ -0,0 +1,130 @@
+"""Профілювання на вимогу: /debug/profile та /debug/memory.
+
+Ендпоінти працюють лише коли задано DEBUG_TOKEN, і запит має нести його в
+заголовку X-Debug-Token; інакше вони відповідають 404, ніби їх немає.
+
+Поки ніхто не профілює, накладних витрат немає: семплер живе лише протягом
+запиту /debug/profile, а tracemalloc вмикається першим викликом /debug/memory
+і вимикається через /debug/memory?stop=1.
+
+    curl -H "X-Debug-Token: $DEBUG_TOKEN" "localhost:5000/debug/profile?seconds=10" > master.folded
+    curl -H "X-Debug-Token: $DEBUG_TOKEN" "localhost:5000/debug/memory?limit=20"
+
+Профіль — семпли стеків усіх потоків (sys._current_frames) у форматі collapsed
+stacks, який приймають flamegraph.pl та speedscope; format=top дає зведення
+за функціями.
+
+Файл однаковий для майстра та вторинних вузлів (копія, як і replication_pb2).
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+MAX_PROFILE_SECONDS = 60
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+
+_profile_lock = threading.Lock()
+_memory_lock = threading.Lock()
+_last_snapshot = None
+
+
+class ProfilerBusy(Exception):
+    """Інший запит уже профілює процес."""
+
+
+def authorized(token):
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(token or "", DEBUG_TOKEN)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL):
+    """Знімає стеки всіх потоків кожні interval секунд; повертає Counter колапсованих стеків."""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        own = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _profile_lock.release()
+
+
+def collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top(stacks, limit=30):
+    """Зведення: власні семпли (функція на вершині стека) та загальні (функція будь-де в стеку)."""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for name in set(frames):
+            total[name] += count
+    samples = sum(stacks.values()) or 1
+    lines = [f"{samples} семплів", "", "власні:"]
+    lines += [f"  {count / samples:6.1%}  {name}" for name, count in own.most_common(limit)]
+    lines += ["", "загальні:"]
+    lines += [f"  {count / samples:6.1%}  {name}" for name, count in total.most_common(limit)]
+    return "\n".join(lines) + "\n"
+
+
+def profile(seconds, fmt="collapsed"):
+    stacks = sample_stacks(seconds)
+    return top(stacks) if fmt == "top" else collapsed(stacks)
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def memory(limit=20, stop=False):
+    """Найбільші місця виділення пам'яті та приріст з попереднього виклику.
+
+    Перший виклик лише вмикає tracemalloc: до того він не відстежує виділень.
+    """
+    global _last_snapshot
+    with _memory_lock:
+        if stop:
+            tracemalloc.stop()
+            _last_snapshot = None
+            return "tracemalloc вимкнено\n"
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _last_snapshot = _snapshot()
+            return "tracemalloc увімкнено; повторіть запит, щоб побачити виділення та приріст\n"
+        snapshot = _snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"відстежується {current / 1e6:.1f} МБ, пік {peak / 1e6:.1f} МБ", "", "найбільші:"]
+        lines += [f"  {stat}" for stat in snapshot.statistics("lineno")[:limit]]
+        lines += ["", "приріст з попереднього знімка:"]
+        lines += [f"  {stat}" for stat in snapshot.compare_to(_last_snapshot, "lineno")[:limit]]
+        _last_snapshot = snapshot
+        return "\n".join(lines) + "\n"
@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11replication.proto\"!\n\x0eMessageRequest\x12\x0f\n\x07message\x18\x01 \x01(\t\"\x1e\n\x0b\x41\x63kResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x32I\n\x12ReplicationService\x12\x33\n\x10ReplicateMessage\x12\x0f.MessageRequest\x1a\x0c.AckResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11replication.proto\"C\n\x0eMessageRequest\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x14\n\x07payload\x18\x02 \x01(\x0cH\x00\x88\x01\x01\x42\n\n\x08_payload\"y\n\x0b\x41\x63kResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x12\n\nchain_acks\x18\x02 \x01(\x05\x12\x1c\n\x0f\x61pplied_through\x18\x03 \x01(\x03H\x00\x88\x01\x01\x12\x13\n\x0bincarnation\x18\x04 \x01(\tB\x12\n\x10_applied_through\"p\n\x0bSyncRequest\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x17\n\x0f\x61pplied_through\x18\x02 \x01(\x03\x12\x13\n\x0bincarnation\x18\x03 \x01(\t\x12\x15\n\x08\x61\x63ked_id\x18\x04 \x01(\x03H\x00\x88\x01\x01\x42\x0b\n\t_acked_id\"5\n\x0cSyncResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x14\n\x0cresend_count\x18\x02 \x01(\x03\"I\n\x08LogEntry\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x14\n\x07payload\x18\x03 \x01(\x0cH\x00\x88\x01\x01\x42\n\n\x08_payload\";\n\x0cRangeRequest\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\r\n\x05start\x18\x02 \x01(\x03\x12\x0b\n\x03\x65nd\x18\x03 \x01(\x03\"+\n\rRangeResponse\x12\x1a\n\x07\x65ntries\x18\x01 \x03(\x0b\x32\t.LogEntry\"b\n\x0bTreeRequest\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x13\n\x0b\x62ucket_size\x18\x02 \x01(\x03\x12\x0f\n\x07\x62uckets\x18\x03 \x01(\x03\x12\r\n\x05level\x18\x04 \x01(\x05\x12\r\n\x05nodes\x18\x05 \x03(\x03\"\x1e\n\x0cTreeResponse\x12\x0e\n\x06hashes\x18\x01 \x03(\x0c\x32\xf9\x01\n\x12ReplicationService\x12\x33\n\x10ReplicateMessage\x12\x0f.MessageRequest\x1a\x0c.AckResponse\"\x00\x12%\n\x04Sync\x12\x0c.SyncRequest\x1a\r.SyncResponse\"\x00\x12-\n\nFetchRange\x12\r.RangeRequest\x1a\x0e.RangeResponse\"\x00\x12+\n\nTreeDigest\x12\x0c.TreeRequest\x1a\r.TreeResponse\"\x00\x12+\n\x0b\x41\x63knowledge\x12\x0c.SyncRequest\x1a\x0c.AckResponse\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,9 +32,23 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'replication_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_MESSAGEREQUEST']._serialized_start=21
-  _globals['_MESSAGEREQUEST']._serialized_end=54
-  _globals['_ACKRESPONSE']._serialized_start=56
-  _globals['_ACKRESPONSE']._serialized_end=86
-  _globals['_REPLICATIONSERVICE']._serialized_start=88
-  _globals['_REPLICATIONSERVICE']._serialized_end=161
+  _globals['_MESSAGEREQUEST']._serialized_end=88
+  _globals['_ACKRESPONSE']._serialized_start=90
+  _globals['_ACKRESPONSE']._serialized_end=211
+  _globals['_SYNCREQUEST']._serialized_start=213
+  _globals['_SYNCREQUEST']._serialized_end=325
+  _globals['_SYNCRESPONSE']._serialized_start=327
+  _globals['_SYNCRESPONSE']._serialized_end=380
+  _globals['_LOGENTRY']._serialized_start=382
+  _globals['_LOGENTRY']._serialized_end=455
+  _globals['_RANGEREQUEST']._serialized_start=457
+  _globals['_RANGEREQUEST']._serialized_end=516
+  _globals['_RANGERESPONSE']._serialized_start=518
+  _globals['_RANGERESPONSE']._serialized_end=561
+  _globals['_TREEREQUEST']._serialized_start=563
+  _globals['_TREEREQUEST']._serialized_end=661
+  _globals['_TREERESPONSE']._serialized_start=663
+  _globals['_TREERESPONSE']._serialized_end=693
+  _globals['_REPLICATIONSERVICE']._serialized_start=696
+  _globals['_REPLICATIONSERVICE']._serialized_end=945
 # @@protoc_insertion_point(module_scope)
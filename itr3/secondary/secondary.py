@@ -1,73 +1,699 @@
+import asyncio
 import flask
 import grpc
 import logging
 import os
+import queue
 import threading
 import random
 import time
 from concurrent import futures
 import replication_pb2
 import replication_pb2_grpc
+import logentry
+import logsetup
+import merkle
+import profiling
+import tracing
 
 app = flask.Flask(__name__)
+app.json = logentry.JSONProvider(app)
 messages = [] 
+messages_lock = threading.Lock()
+applied_ids = set()
+applied_through = -1
+ahead_ids = set()
+# Отримані, але ще не застосовані id -> Event, що спрацьовує після застосування.
+in_flight_ids = {}
+apply_queue = queue.Queue()
+persist_lock = threading.Lock()
+gap_detected = threading.Event()
+# Спрацьовує, коли applied_through просунувся: report_applied надсилає кумулятивний ACK.
+applied_advanced = threading.Event()
+# Найбільший applied_through, який майстер уже отримав у відповіді чи через Acknowledge.
+reported_through = -1
+# Довгоживучі канали до майстра та наступних вузлів ланцюга (див. successor_stub).
+master_replication_stub = None
+successor_stubs = {}
+async_successor_stubs = {}
+stubs_lock = threading.Lock()
+logsetup.configure()
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
-log.addHandler(logging.StreamHandler())
 
 HTTP_PORT = int(os.getenv("HTTP_PORT", 5001))
 GRPC_PORT = int(os.getenv("GRPC_PORT", 50051))
+MASTER_ADDRESS = os.getenv("MASTER_ADDRESS", "master:50050")
+NODE_ADDRESS = os.getenv("NODE_ADDRESS", f"secondary{GRPC_PORT - 50050}:{GRPC_PORT}")
+DATA_DIR = os.getenv("DATA_DIR")
+LOG_PATH = os.path.join(DATA_DIR, "messages.jsonl") if DATA_DIR else None
+GAP_GRACE_SECONDS = float(os.getenv("GAP_GRACE_SECONDS", 0.5))
+MAX_RANGE_SIZE = int(os.getenv("MAX_RANGE_SIZE", 1000))
+# Найбільша пауза між спробами SYNC, поки майстер недоступний.
+SYNC_MAX_BACKOFF = 30
+# Втілення вузла: нове після кожного запуску. Майстер опускає водяний знак вузла лише
+# для нового втілення, тож запізнілий SYNC чи ACK цього самого запуску його не відкотить.
+INCARNATION = os.urandom(8).hex()
+CHAIN_METADATA_KEY = "x-chain"
+# Адреса попереднього вузла ланцюга: відповідь на такий виклик майстру не потрапляє.
+CHAIN_FROM_METADATA_KEY = "x-chain-from"
+# Як часто звіряти дерево Меркла з майстром; 0 вимикає anti-entropy.
+ANTI_ENTROPY_INTERVAL = float(os.getenv("ANTI_ENTROPY_INTERVAL", 60))
+merkle_tree = merkle.MerkleTree()
+
+# Коли вузол відповідає майстру ACK: одразу після отримання, після запису на диск
+# (fsync у DATA_DIR) чи після застосування. Майстер обирає режим для кожного запису
+# через метадані x-ack-mode; ACK_MODE — типовий режим, якщо майстер його не передав.
+ACK_MODES = ("received", "durable", "applied")
+ACK_MODE_METADATA_KEY = "x-ack-mode"
+DEFAULT_ACK_MODE = os.getenv("ACK_MODE", "applied")
+APPLY_BATCH_SIZE = int(os.getenv("APPLY_BATCH_SIZE", 100))
+# Імітація нестабільного вузла: частка ReplicateMessage, що завершуються помилкою, та
+# затримка застосування пакета "від,до" в секундах. Бенчмарки вимикають обидві (0).
+SIMULATED_FAILURE_RATE = float(os.getenv("SIMULATED_FAILURE_RATE", 0.1))
+APPLY_DELAY_SECONDS = tuple(float(bound) for bound in os.getenv("APPLY_DELAY_SECONDS", "5,10").split(","))
+# Скільки report_applied чекає, перш ніж надіслати Acknowledge: за цей час водяний знак
+# зазвичай уже поїхав до майстра у відповідях на ReplicateMessage.
+ACK_COALESCE_SECONDS = float(os.getenv("ACK_COALESCE_SECONDS", 0.2))
+
+# "threads": gRPC-сервер на пулі з GRPC_MAX_WORKERS потоків.
+# "aio": grpc.aio на одному циклі подій, кількість одночасних викликів не обмежена пулом.
+GRPC_MODE = os.getenv("GRPC_MODE", "threads")
+GRPC_MAX_WORKERS = int(os.getenv("GRPC_MAX_WORKERS", 10))
+
+def load_messages():
+    """Відновлює застосовані повідомлення з диска, щоб після перезапуску не отримувати весь лог знову."""
+    if not LOG_PATH or not os.path.exists(LOG_PATH):
+        return
+    # Для одного id діє останній рядок: anti-entropy дописує виправлені записи в кінець.
+    entries = {}
+    with open(LOG_PATH, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = logentry.loads(line)
+            except ValueError:
+                # Обірваний останній рядок після аварійного завершення.
+                break
+            entries[entry["id"]] = entry["message"]
+    for msg_id, message in entries.items():
+        apply_message(msg_id, message, persist=False)
+    log.info("Відновлено %d повідомлень з %s", len(messages), LOG_PATH)
+
+def persist_message(msg_id, message):
+    persist_messages([(msg_id, message)])
+
+def persist_messages(entries):
+    """Дописує записи в DATA_DIR одним write та fsync: після повернення вони переживуть перезапуск."""
+    if not LOG_PATH or not entries:
+        return
+    lines = "".join(logentry.dumps({"id": msg_id, "message": message}) + "\n" for msg_id, message in entries)
+    with persist_lock, open(LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+def apply_message(msg_id, message, persist=True):
+    """Додає повідомлення в лог рівно один раз і просуває водяний знак applied_through.
+
+    fsync іде вже після messages_lock: цей лок бере й приймання записів, зокрема з
+    циклу подій grpc.aio. Водяний знак проходить запис, лише коли той уже на диску.
+    """
+    with messages_lock:
+        if msg_id in applied_ids:
+            return False
+        messages.append((msg_id, message))
+        applied_ids.add(msg_id)
+        merkle_tree.add(msg_id, message)
+        if not persist:
+            advance_watermark(msg_id)
+    if persist:
+        persist_message(msg_id, message)
+        with messages_lock:
+            advance_watermark(msg_id)
+    return True
+
+def advance_watermark(msg_id):
+    """Зараховує збережений запис; викликається під messages_lock."""
+    global applied_through
+    ahead_ids.add(msg_id)
+    while applied_through + 1 in ahead_ids:
+        applied_through += 1
+        ahead_ids.discard(applied_through)
+        applied_advanced.set()
+    if ahead_ids:
+        gap_detected.set()
+
+def missing_ranges():
+    """Діапазони id (включно), яких бракує між applied_through та найбільшим отриманим id."""
+    with messages_lock:
+        above = sorted(ahead_ids)
+        expected = applied_through + 1
+        in_flight = sorted(in_flight_ids)
+    ranges = []
+    for msg_id in above:
+        # Id, які зараз застосовуються, не запитуємо — вони вже в дорозі.
+        start = expected
+        for busy in in_flight:
+            if start <= busy < msg_id:
+                if start < busy:
+                    ranges.append((start, busy - 1))
+                start = busy + 1
+        if start < msg_id:
+            ranges.append((start, msg_id - 1))
+        expected = msg_id + 1
+    return ranges
+
+def contiguous_messages():
+    """Повідомлення без пропусків у id, починаючи з 0 (total order)."""
+    sorted_messages = sorted(messages, key=lambda x: x[0])
+    result = []
+    expected_id = 0
+    for msg_id, msg in sorted_messages:
+        if msg_id == expected_id:
+            result.append(msg)
+            expected_id += 1
+        elif msg_id > expected_id:
+            break
+    return result
+
+class SimulatedFailure(Exception):
+    """Симульована внутрішня помилка вузла (частка SIMULATED_FAILURE_RATE записів)."""
 
 class ReplicationServiceServicer(replication_pb2_grpc.ReplicationServiceServicer):
     def ReplicateMessage(self, request, context):
-        msg_id, message = request.message.split(":", 1)
-        msg_id = int(msg_id)
-        log.info(f"Отримано повідомлення для реплікації: {message} з id {msg_id}")
+        trace_id = tracing.trace_id_from_context(context)
+        ack_mode = ack_mode_from_context(context)
+        with tracing.span(trace_id, "secondary.replicate", addr=NODE_ADDRESS, ack_mode=ack_mode) as attrs:
+            response = self.replicate(request, context, attrs, ack_mode, trace_id)
+        successors = chain_successors(context)
+        if successors:
+            acknowledge_position(attrs["msg_id"])
+            response.chain_acks += forward_to_chain(request, successors, trace_id, ack_mode,
+                                                    context.time_remaining())
+        return response
 
-        if any(m[0] == msg_id for m in messages):
-            log.info(f"Повідомлення з id {msg_id} уже існує, пропускаємо")
-            return replication_pb2.AckResponse(success=True)
+    def replicate(self, request, context, attrs, ack_mode, trace_id):
+        try:
+            applied, ack_mode = receive(request, attrs, ack_mode, trace_id)
+        except SimulatedFailure:
+            context.abort(grpc.StatusCode.INTERNAL, "Симульована внутрішня помилка")
+        if ack_mode == "applied" and not applied.wait(context.time_remaining()):
+            attrs["outcome"] = "timeout"
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Повідомлення ще не застосовано")
+        return replication_pb2.AckResponse(success=True, chain_acks=1, applied_through=reply_watermark(context),
+                                           incarnation=INCARNATION)
 
-        if random.random() < 0.1: 
-            log.error(f"Симуляція внутрішньої помилки для повідомлення {msg_id}")
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details("Симульована внутрішня помилка")
-            raise grpc.RpcError("Симульована внутрішня помилка")
+class AsyncReplicationServiceServicer(replication_pb2_grpc.ReplicationServiceServicer):
+    """Той самий ReplicateMessage для grpc.aio: очікування застосування та пересилання
+    в ланцюгу не займають потік, тож сотні викликів обслуговує один цикл подій."""
 
-        time.sleep(random.uniform(5, 10))  
-        messages.append((msg_id, message))
-        return replication_pb2.AckResponse(success=True)
+    async def ReplicateMessage(self, request, context):
+        trace_id = tracing.trace_id_from_context(context)
+        ack_mode = ack_mode_from_context(context)
+        with tracing.span(trace_id, "secondary.replicate", addr=NODE_ADDRESS, ack_mode=ack_mode) as attrs:
+            response = await self.replicate(request, context, attrs, ack_mode, trace_id)
+        successors = chain_successors(context)
+        if successors:
+            acknowledge_position(attrs["msg_id"])
+            response.chain_acks += await forward_to_chain_async(request, successors, trace_id, ack_mode,
+                                                                context.time_remaining())
+        return response
+
+    async def replicate(self, request, context, attrs, ack_mode, trace_id):
+        try:
+            if ack_mode == "durable" and LOG_PATH:
+                # fsync блокує: виконуємо його поза циклом подій.
+                applied, ack_mode = await asyncio.to_thread(receive, request, attrs, ack_mode, trace_id)
+            else:
+                applied, ack_mode = receive(request, attrs, ack_mode, trace_id)
+        except SimulatedFailure:
+            await context.abort(grpc.StatusCode.INTERNAL, "Симульована внутрішня помилка")
+        if ack_mode == "applied":
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def resolve():
+                if not future.done():
+                    future.set_result(None)
+
+            applied.add_done_callback(lambda: loop.call_soon_threadsafe(resolve))
+            try:
+                await asyncio.wait_for(future, context.time_remaining())
+            except asyncio.TimeoutError:
+                attrs["outcome"] = "timeout"
+                await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Повідомлення ще не застосовано")
+        return replication_pb2.AckResponse(success=True, chain_acks=1, applied_through=reply_watermark(context),
+                                           incarnation=INCARNATION)
+
+def receive(request, attrs, ack_mode, trace_id=None):
+    """Швидкий шлях: перевіряє запис і ставить його в чергу застосування, не чекаючи на нього.
+
+    Повертає (ApplyEvent запису, режим ACK, на який треба чекати). Для запису, що вже
+    в черзі від попередньої спроби, "durable" посилюється до "applied": він міг ще не
+    потрапити на диск.
+    """
+    msg_id, message = request.message.split(":", 1)
+    msg_id = int(msg_id)
+    if request.HasField("payload"):
+        message = request.payload
+    attrs["msg_id"] = msg_id
+    log.info("Отримано повідомлення для реплікації: %s з id %d", message, msg_id,
+             extra={"category": "replicate"})
+
+    if msg_id in applied_ids:
+        log.info("Повідомлення з id %d уже існує, пропускаємо", msg_id, extra={"category": "replicate"})
+        attrs["outcome"] = "duplicate"
+        return APPLIED, ack_mode
+
+    with messages_lock:
+        applied = in_flight_ids.get(msg_id)
+    if applied is None:
+        if random.random() < SIMULATED_FAILURE_RATE:
+            log.error("Симуляція внутрішньої помилки для повідомлення %d", msg_id, extra={"category": "replicate"})
+            attrs["outcome"] = "error"
+            raise SimulatedFailure(msg_id)
+        applied = enqueue_apply(msg_id, message, ack_mode == "durable", trace_id)
+    elif ack_mode == "durable":
+        ack_mode = "applied"
+    attrs["outcome"] = ack_mode
+    return applied, ack_mode
+
+class ApplyEvent(threading.Event):
+    """threading.Event, що ще й викликає колбеки після set() — для очікування з циклу подій."""
+
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+        self.callbacks_lock = threading.Lock()
+
+    def add_done_callback(self, callback):
+        with self.callbacks_lock:
+            if not self.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        super().set()
+        with self.callbacks_lock:
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+APPLIED = ApplyEvent()
+APPLIED.set()
+
+def ack_mode_from_context(context):
+    for key, value in context.invocation_metadata():
+        if key == ACK_MODE_METADATA_KEY and value in ACK_MODES:
+            return value
+    return DEFAULT_ACK_MODE
+
+def enqueue_apply(msg_id, message, durable, trace_id=None):
+    """Передає запис етапу застосування; для durable спершу синхронно пише його на диск."""
+    with messages_lock:
+        if msg_id in applied_ids:
+            return APPLIED
+        if msg_id in in_flight_ids:
+            # Та сама спроба прийшла паралельно іншим потоком.
+            return in_flight_ids[msg_id]
+        applied = in_flight_ids[msg_id] = ApplyEvent()
+    if durable:
+        persist_message(msg_id, message)
+    apply_queue.put((msg_id, message, durable, applied, trace_id))
+    return applied
+
+def apply_worker():
+    """Етап застосування: забирає з черги до APPLY_BATCH_SIZE записів і застосовує їх разом.
+
+    Недописані на диск записи пишуться одним fsync на пакет, а симульована затримка
+    застосування (APPLY_DELAY_SECONDS) припадає на пакет, а не на кожне повідомлення.
+    """
+    while True:
+        batch = [apply_queue.get()]
+        while len(batch) < APPLY_BATCH_SIZE:
+            try:
+                batch.append(apply_queue.get_nowait())
+            except queue.Empty:
+                break
+        # Спан secondary.apply — саме застосування пакета (запис на диск, затримка, лог) у
+        # будь-якому режимі ACK, а не лише час обробника ReplicateMessage.
+        started_ns = time.time_ns()
+        persist_messages([(msg_id, message) for msg_id, message, durable, _, _ in batch if not durable])
+        delay = random.uniform(APPLY_DELAY_SECONDS[0], APPLY_DELAY_SECONDS[-1])
+        if delay > 0:
+            time.sleep(delay)
+        for msg_id, message, _, applied, trace_id in batch:
+            # apply_message повторно перевіряє дублікати: id міг прийти ще й через FetchRange.
+            apply_message(msg_id, message, persist=False)
+            with messages_lock:
+                in_flight_ids.pop(msg_id, None)
+            applied.set()
+            tracing.record(trace_id, "secondary.apply", started_ns, time.time_ns(), addr=NODE_ADDRESS,
+                           msg_id=msg_id, batch=len(batch))
+        log.info("Застосовано пакет із %d повідомлень, applied_through=%d", len(batch), applied_through,
+                 extra={"category": "replicate"})
+
+def chain_successors(context):
+    """Вузли після поточного в ланцюговій реплікації (порожньо для звичайного fan-out)."""
+    for key, value in context.invocation_metadata():
+        if key == CHAIN_METADATA_KEY:
+            return [addr for addr in value.split(",") if addr]
+    return []
+
+def forwarded(context):
+    """Виклик прийшов від попереднього вузла ланцюга, а не від майстра."""
+    return any(key == CHAIN_FROM_METADATA_KEY for key, _ in context.invocation_metadata())
+
+def forward_to_chain(request, successors, trace_id, ack_mode, timeout):
+    """Пересилає запис наступному вузлу ланцюга і повертає, скільки вузлів далі його застосували.
+
+    Одна спроба без ретраїв: якщо наступний вузол недоступний, майстер побачить
+    менший chain_acks і надішле запис решті ланцюга напряму.
+    """
+    try:
+        response = successor_stub(successors[0]).ReplicateMessage(
+            request, timeout=timeout, metadata=chain_metadata(successors, trace_id, ack_mode))
+        return response.chain_acks
+    except grpc.RpcError as e:
+        log.error("Не вдалося переслати запис наступному вузлу ланцюга %s: %s", successors[0], e,
+                  extra={"category": "replicate"})
+        return 0
+
+async def forward_to_chain_async(request, successors, trace_id, ack_mode, timeout):
+    """forward_to_chain для grpc.aio."""
+    try:
+        response = await async_successor_stub(successors[0]).ReplicateMessage(
+            request, timeout=timeout, metadata=chain_metadata(successors, trace_id, ack_mode))
+        return response.chain_acks
+    except grpc.RpcError as e:
+        log.error("Не вдалося переслати запис наступному вузлу ланцюга %s: %s", successors[0], e,
+                  extra={"category": "replicate"})
+        return 0
+
+def successor_stub(addr):
+    """Один довгоживучий канал на наступний вузол ланцюга: gRPC сам перепідключається
+    після збою, а новий канал на кожне пересилання коштував би TCP-з'єднання на запис."""
+    with stubs_lock:
+        stub = successor_stubs.get(addr)
+        if stub is None:
+            stub = successor_stubs[addr] = replication_pb2_grpc.ReplicationServiceStub(
+                grpc.insecure_channel(addr))
+        return stub
+
+def async_successor_stub(addr):
+    """successor_stub для grpc.aio: канал прив'язаний до циклу подій сервера, тож блокування не потрібне."""
+    stub = async_successor_stubs.get(addr)
+    if stub is None:
+        stub = async_successor_stubs[addr] = replication_pb2_grpc.ReplicationServiceStub(
+            grpc.aio.insecure_channel(addr))
+    return stub
+
+def master_stub():
+    """Канал до майстра для Acknowledge, спільний для report_applied та ACK позицій ланцюга."""
+    global master_replication_stub
+    with stubs_lock:
+        if master_replication_stub is None:
+            master_replication_stub = replication_pb2_grpc.ReplicationServiceStub(
+                grpc.insecure_channel(MASTER_ADDRESS))
+        return master_replication_stub
+
+def acknowledge_position(msg_id):
+    """ACK цієї позиції ланцюга напряму майстру, щойно запис тут оброблено в потрібному режимі.
+
+    Відповідь на ReplicateMessage повертається лише після хвоста ланцюга, тож без цього
+    навіть w=2 чекало б на всі вузли. Не блокує пересилання: майстер зарахує вузол за
+    acked_id, а chain_acks у відповіді лишається для ретраїв і обходу розірваного ланцюга.
+    """
+    through = applied_through
+    future = master_stub().Acknowledge.future(
+        replication_pb2.SyncRequest(address=NODE_ADDRESS, applied_through=through,
+                                    incarnation=INCARNATION, acked_id=msg_id),
+        timeout=10
+    )
+
+    def completed(future):
+        global reported_through
+        if future.exception() is not None:
+            log.error("Не вдалося надіслати ACK позиції ланцюга для id %d: %s", msg_id, future.exception(),
+                      extra={"category": "ack"})
+        else:
+            # Майстер підтвердив отримання: цей водяний знак report_applied уже не потрібен.
+            reported_through = max(reported_through, through)
+
+    future.add_done_callback(completed)
+
+def chain_metadata(successors, trace_id, ack_mode):
+    metadata = list(tracing.metadata(trace_id) or ())
+    metadata.append((ACK_MODE_METADATA_KEY, ack_mode))
+    metadata.append((CHAIN_FROM_METADATA_KEY, NODE_ADDRESS))
+    if len(successors) > 1:
+        metadata.append((CHAIN_METADATA_KEY, ",".join(successors[1:])))
+    return metadata
 
 def run_grpc_server():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    if GRPC_MODE == "aio":
+        asyncio.run(serve_grpc_aio())
+        return
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS))
     replication_pb2_grpc.add_ReplicationServiceServicer_to_server(ReplicationServiceServicer(), server)
     server.add_insecure_port(f"[::]:{GRPC_PORT}")
-    log.info(f"gRPC сервер запущено на порту {GRPC_PORT}")
+    log.info("gRPC сервер запущено на порту %d", GRPC_PORT)
     server.start()
     server.wait_for_termination()
 
+async def serve_grpc_aio():
+    server = grpc.aio.server()
+    replication_pb2_grpc.add_ReplicationServiceServicer_to_server(AsyncReplicationServiceServicer(), server)
+    server.add_insecure_port(f"[::]:{GRPC_PORT}")
+    log.info("gRPC сервер (grpc.aio) запущено на порту %d", GRPC_PORT)
+    await server.start()
+    await server.wait_for_termination()
+
+def fetch_missing_ranges(ranges):
+    """Запитує в майстра рівно ті діапазони id, яких бракує (NACK), і одразу застосовує їх."""
+    with grpc.insecure_channel(MASTER_ADDRESS) as channel:
+        stub = replication_pb2_grpc.ReplicationServiceStub(channel)
+        for start, end in ranges:
+            while start <= end:
+                chunk_end = min(end, start + MAX_RANGE_SIZE - 1)
+                log.info("Запит пропущених повідомлень з id %d..%d у майстра", start, chunk_end,
+                         extra={"category": "sync"})
+                response = stub.FetchRange(
+                    replication_pb2.RangeRequest(address=NODE_ADDRESS, start=start, end=chunk_end),
+                    timeout=10
+                )
+                for entry in response.entries:
+                    apply_message(entry.id, logentry.entry_message(entry))
+                start = chunk_end + 1
+
+def repair_gaps():
+    """Фоновий цикл: після появи пропуску чекає GAP_GRACE_SECONDS і дозапитує відсутні id."""
+    while True:
+        gap_detected.wait()
+        time.sleep(GAP_GRACE_SECONDS)
+        gap_detected.clear()
+        ranges = missing_ranges()
+        if not ranges:
+            continue
+        try:
+            fetch_missing_ranges(ranges)
+        except grpc.RpcError as e:
+            log.error("Не вдалося отримати пропущені повідомлення %s: %s", ranges, e, extra={"category": "sync"})
+            gap_detected.set()
+            time.sleep(1)
+
+def verify_with_master():
+    """Звіряє дерево Меркла повних кошиків з майстром і виправляє лише кошики, що відрізняються.
+
+    Спуск іде рівень за рівнем одним TreeDigest на рівень і лише вздовж вузлів із
+    різними хешами, тож для збіжних реплік передається один хеш кореня, а для
+    одного зіпсованого кошика — кілька сотень байт плюс сам кошик.
+    """
+    buckets = merkle_tree.complete_buckets(applied_through)
+    if not buckets:
+        return 0
+    level = merkle.height(buckets)
+    nodes = [0]
+    hash_bytes = 0
+    repaired = 0
+    with grpc.insecure_channel(MASTER_ADDRESS) as channel:
+        stub = replication_pb2_grpc.ReplicationServiceStub(channel)
+        while True:
+            response = stub.TreeDigest(
+                replication_pb2.TreeRequest(address=NODE_ADDRESS, bucket_size=merkle_tree.bucket_size,
+                                            buckets=buckets, level=level, nodes=nodes),
+                timeout=10
+            )
+            hash_bytes += sum(len(digest) for digest in response.hashes)
+            local = merkle_tree.hashes(buckets, level, nodes)
+            nodes = [node for node, theirs, ours in zip(nodes, response.hashes, local) if theirs != ours]
+            if not nodes or level == 0:
+                break
+            level -= 1
+            nodes = [child for node in nodes for child in (2 * node, 2 * node + 1) if child << level < buckets]
+        for bucket in nodes:
+            repaired += repair_bucket(stub, bucket)
+    log.info("Anti-entropy: %d кошиків, отримано %d байт хешів, розбіжних кошиків %d, виправлено записів %d",
+             buckets, hash_bytes, len(nodes), repaired, extra={"category": "sync"})
+    return repaired
+
+def repair_bucket(stub, bucket):
+    """Замінює вміст кошика версією майстра: додає відсутні записи та виправляє відмінні."""
+    start, end = merkle_tree.bucket_range(bucket)
+    response = stub.FetchRange(replication_pb2.RangeRequest(address=NODE_ADDRESS, start=start, end=end),
+                               timeout=10)
+    theirs = {entry.id: logentry.entry_message(entry) for entry in response.entries}
+    with messages_lock:
+        ours = {msg_id: msg for msg_id, msg in messages if start <= msg_id <= end}
+    repaired = 0
+    for msg_id, message in theirs.items():
+        if msg_id not in ours:
+            repaired += apply_message(msg_id, message)
+        elif ours[msg_id] != message:
+            replace_message(msg_id, ours[msg_id], message)
+            repaired += 1
+    unknown = sorted(ours.keys() - theirs.keys())
+    if unknown:
+        log.error("Вузол має id %s, яких немає в майстра", unknown, extra={"category": "sync"})
+    return repaired
+
+def replace_message(msg_id, old, new):
+    with messages_lock:
+        index = next(i for i, (existing_id, _) in enumerate(messages) if existing_id == msg_id)
+        messages[index] = (msg_id, new)
+        merkle_tree.remove(msg_id, old)
+        merkle_tree.add(msg_id, new)
+    persist_message(msg_id, new)
+    log.error("Запис з id %d розходився з майстром, замінено", msg_id, extra={"category": "sync"})
+
+def anti_entropy():
+    """Фоновий цикл: раз на ANTI_ENTROPY_INTERVAL секунд звіряє репліку з майстром."""
+    while True:
+        time.sleep(ANTI_ENTROPY_INTERVAL)
+        try:
+            verify_with_master()
+        except grpc.RpcError as e:
+            log.error("Anti-entropy з майстром не вдалося: %s", e, extra={"category": "sync"})
+
 @app.route("/messages", methods=["GET"])
 def list_messages():
-    
-    sorted_messages = sorted(messages, key=lambda x: x[0])
-    display_messages = []
-    expected_id = 0
-    for msg_id, msg in sorted_messages:
-        if msg_id == expected_id:
-            display_messages.append(msg)
-            expected_id += 1
-        else:
-            break  
-    log.info(f"Список реплікованих повідомлень: {display_messages}")
+    display_messages = contiguous_messages()
+    log.info("Список реплікованих повідомлень: %d записів", len(display_messages), extra={"category": "read"})
+    log.debug("Список реплікованих повідомлень: %s", display_messages, extra={"category": "read"})
     return flask.jsonify({"messages": display_messages}), 200
 
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """Семпли стеків усіх потоків за seconds секунд (collapsed stacks або format=top)."""
+    if not profiling.authorized(flask.request.headers.get("X-Debug-Token")):
+        flask.abort(404)
+    seconds = flask.request.args.get("seconds", 10, type=float)
+    fmt = flask.request.args.get("format", "collapsed")
+    if not seconds or not 0 < seconds <= profiling.MAX_PROFILE_SECONDS or fmt not in ("collapsed", "top"):
+        return flask.jsonify({"error": f"seconds має бути в (0, {profiling.MAX_PROFILE_SECONDS}], "
+                                       "format — collapsed або top"}), 400
+    try:
+        return flask.Response(profiling.profile(seconds, fmt), mimetype="text/plain")
+    except profiling.ProfilerBusy:
+        return flask.jsonify({"error": "Профілювання вже триває"}), 409
+
+@app.route("/debug/memory", methods=["GET"])
+def debug_memory():
+    """Найбільші виділення пам'яті (tracemalloc) та приріст з попереднього виклику."""
+    if not profiling.authorized(flask.request.headers.get("X-Debug-Token")):
+        flask.abort(404)
+    text = profiling.memory(flask.request.args.get("limit", 20, type=int), flask.request.args.get("stop") == "1")
+    return flask.Response(text, mimetype="text/plain")
+
+def sync_with_master():
+    """Повідомляє майстру свою адресу та останній безперервно застосований id.
+
+    SYNC — єдиний спосіб для перезапущеного вузла отримати пропущене, тож повторюємо
+    його з паузою до SYNC_MAX_BACKOFF секунд, доки майстер не відповість (він міг
+    ще не запуститися).
+    """
+    attempt = 0
+    with grpc.insecure_channel(MASTER_ADDRESS) as channel:
+        stub = replication_pb2_grpc.ReplicationServiceStub(channel)
+        while True:
+            # applied_through читаємо лише після з'єднання: запит, зібраний до старту майстра,
+            # приніс би водяний знак, який майстер за цей час уже обігнав.
+            grpc.channel_ready_future(channel).result()
+            try:
+                response = stub.Sync(
+                    replication_pb2.SyncRequest(address=NODE_ADDRESS, applied_through=applied_through,
+                                                incarnation=INCARNATION),
+                    timeout=10
+                )
+            except grpc.RpcError as e:
+                attempt += 1
+                backoff = min(2 ** attempt, SYNC_MAX_BACKOFF)
+                log.error("Не вдалося повідомити майстра про запуск (спроба %d), повтор через %d с: %s",
+                          attempt, backoff, e, extra={"category": "sync"})
+                time.sleep(backoff)
+                continue
+            if response.success:
+                log.info("SYNC з майстром: застосовано до id %d, майстер надішле %d повідомлень",
+                         applied_through, response.resend_count, extra={"category": "sync"})
+            else:
+                log.error("Майстер відхилив SYNC для %s", NODE_ADDRESS, extra={"category": "sync"})
+            return
+
+def reply_watermark(context):
+    """applied_through для відповіді на ReplicateMessage; те, що поїхало у відповіді
+    майстру, report_applied окремо вже не надсилає.
+
+    Відповідь попередньому вузлу ланцюга майстра не досягає, а на виклик із дедлайном,
+    що вже минув, майстер перестав чекати: такий водяний знак лишається для Acknowledge.
+    Втрачену відповідь на живий виклик майстер повторить, і повтор знову віднесе водяний знак.
+    """
+    global reported_through
+    through = applied_through
+    time_remaining = context.time_remaining()
+    if (through > reported_through and not forwarded(context)
+            and (time_remaining is None or time_remaining > 0)):
+        reported_through = through
+    return through
+
+def report_applied():
+    """Фоновий цикл: повідомляє майстру applied_through кумулятивним ACK.
+
+    Основний канал водяного знака — відповіді на ReplicateMessage. Acknowledge
+    надсилаємо лише тоді, коли за ACK_COALESCE_SECONDS після застосування жодна
+    відповідь його не віднесла (режим received, кінець потоку записів). Канал і
+    stub живуть увесь час роботи вузла (master_stub).
+    """
+    global reported_through
+    while True:
+        applied_advanced.wait()
+        time.sleep(ACK_COALESCE_SECONDS)
+        applied_advanced.clear()
+        through = applied_through
+        if through <= reported_through:
+            continue
+        try:
+            master_stub().Acknowledge(
+                replication_pb2.SyncRequest(address=NODE_ADDRESS, applied_through=through,
+                                            incarnation=INCARNATION),
+                timeout=10
+            )
+        except grpc.RpcError as e:
+            log.error("Не вдалося надіслати кумулятивний ACK: %s", e, extra={"category": "ack"})
+            applied_advanced.set()
+            time.sleep(1)
+            continue
+        reported_through = max(reported_through, through)
+
 if __name__ == "__main__":
+    if DATA_DIR:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        load_messages()
     grpc_thread = threading.Thread(target=run_grpc_server, daemon=True)
     grpc_thread.start()
-    try:
-        with grpc.insecure_channel("master:50050") as channel:
-            stub = replication_pb2_grpc.ReplicationServiceStub(channel)
-            stub.ReplicateMessage(replication_pb2.MessageRequest(message=f"0:SYNC_{GRPC_PORT}"))
-    except grpc.RpcError as e:
-        log.error(f"Не вдалося повідомити майстра про запуск: {e}")
+    threading.Thread(target=repair_gaps, daemon=True).start()
+    threading.Thread(target=apply_worker, daemon=True).start()
+    if ANTI_ENTROPY_INTERVAL > 0:
+        threading.Thread(target=anti_entropy, daemon=True).start()
+    threading.Thread(target=sync_with_master, daemon=True).start()
+    threading.Thread(target=report_applied, daemon=True).start()
     app.run(host="0.0.0.0", port=HTTP_PORT)
@@ -0,0 +1,94 @@
+"""Легке трасування запису через майстра та вторинні вузли.
+
+Кожен запис отримує trace id, який передається вторинним вузлам у метаданих
+gRPC (ключ TRACE_METADATA_KEY). Спани пишуться фоновим потоком у файл
+TRACE_FILE як JSON-рядки у стилі OTLP; якщо TRACE_FILE не задано, трасування
+вимкнене і span() нічого не робить.
+
+Файл однаковий для майстра та вторинних вузлів (копія, як і replication_pb2).
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+SERVICE_NAME = os.getenv("TRACE_SERVICE", os.getenv("NODE_ADDRESS", "master"))
+TRACE_METADATA_KEY = "x-trace-id"
+
+enabled = bool(TRACE_FILE)
+_spans = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+
+def _write_spans():
+    # Без буфера: кожен рядок — окремий write в O_APPEND, тож рядки кількох процесів
+    # (секвенсор і обробники INGEST_WORKERS пишуть в один TRACE_FILE) не перемішуються.
+    with open(TRACE_FILE, "ab", buffering=0) as f:
+        while True:
+            span = _spans.get()
+            if span is None:
+                break
+            f.write((json.dumps(span, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            # Після fork (процеси-обробники) потік запису треба створити заново.
+            _writer = threading.Thread(target=_write_spans, daemon=True)
+            _writer.start()
+            atexit.register(_spans.put, None)
+
+
+def record(trace_id, name, start_ns, end_ns, **attributes):
+    """Записує спан із уже виміряними межами (наприклад, час у черзі)."""
+    if not enabled or not trace_id:
+        return
+    if _writer is None or not _writer.is_alive():
+        _ensure_writer()
+    _spans.put({
+        "traceId": trace_id,
+        "spanId": os.urandom(8).hex(),
+        "name": name,
+        "service": SERVICE_NAME,
+        "startTimeUnixNano": start_ns,
+        "endTimeUnixNano": end_ns,
+        "attributes": attributes,
+    })
+
+
+@contextmanager
+def span(trace_id, name, **attributes):
+    """Вимірює блок коду; атрибути можна доповнити через повернений словник."""
+    if not enabled or not trace_id:
+        yield attributes
+        return
+    start_ns = time.time_ns()
+    try:
+        yield attributes
+    finally:
+        record(trace_id, name, start_ns, time.time_ns(), **attributes)
+
+
+def trace_id_from_context(context):
+    """Дістає trace id з вхідних метаданих gRPC."""
+    if not enabled:
+        return None
+    for key, value in context.invocation_metadata():
+        if key == TRACE_METADATA_KEY:
+            return value
+    return None
+
+
+def metadata(trace_id):
+    return ((TRACE_METADATA_KEY, trace_id),) if enabled and trace_id else None
@@ -0,0 +1,520 @@
+"""Детермінований симулятор протоколу реплікації itr3 з дискретними подіями.
+
+Відтворює роботу майстра та вторинних вузлів на віртуальному годиннику, без
+Docker, gRPC і реальних sleep. Логіку майстра не переписано: черги вузлів,
+ретраї, облік ACK, розбір відповіді ланцюга, вікно надсилання, EWMA затримок
+і контроль допуску беруться з master/replication.py — того самого коду, що
+виконує master.py, лише транспортом тут є події, а годинником — sim.now.
+
+  * майстер: контроль допуску (MAX_INFLIGHT_WRITES, MAX_SECONDARY_BACKLOG),
+    один відправник на вузол із --concurrency одночасних доставок і паузою
+    --retry-pause після невдачі, до --max-attempts спроб із паузою
+    min(2**спроба, 10) с, таймаут RPC, обрізаний дедлайном запису (--timeout-ms),
+    fan-out або ланцюг (--topology), вікно надсилання (--window), SYNC після
+    перезапуску вузла, кумулятивні ACK;
+  * вторинний вузол: ACK у режимі received/applied, частка симульованих помилок,
+    застосування пакетами до APPLY_BATCH_SIZE із затримкою на пакет, дозапит
+    пропусків (FetchRange) після GAP_GRACE_SECONDS, пересилання наступному вузлу
+    ланцюга, Acknowledge лише для водяного знака, який не поїхав у відповідях.
+
+Збої задаються розбиттям мережі (--partition) та падінням вузла (--crash):
+під час розбиття вузол недосяжний, але пам'ятає все; після падіння втрачає
+незастосовану чергу і при старті надсилає SYNC зі своїм applied_through.
+
+    python simulate.py --messages 100000 --rate 10 --w 3
+    python simulate.py --rate 50 --apply-delay 0.05,0.1 --partition 1:300:600 --crash 2:900:960
+    python simulate.py --rate 200 --apply-delay 0.01,0.02 --topology chain --window 8 --timeout-ms 500
+
+Звіт: пропускна здатність, затримка коміту (до w ACK) p50/p95/p99, записи, що
+не вклалися в очікування клієнта, відмови контролю допуску та час відновлення
+кожного вузла після збою (доки він не застосує весь лог станом на момент
+відновлення). Той самий --seed дає той самий результат.
+"""
+import argparse
+import heapq
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "master"))
+import replication  # noqa: E402
+
+GAP_GRACE_SECONDS = 0.5
+MAX_RANGE_SIZE = 1000
+ACK_COALESCE_SECONDS = 0.2
+LATENCY_EWMA_ALPHA = 0.2
+
+
+def parse_window(value):
+    node, start, end = value.split(":")
+    return int(node), float(start), float(end)
+
+
+def parse_pair(value):
+    low, high = value.split(",")
+    return float(low), float(high)
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q / 100 * len(values))) - 1)]
+
+
+class Simulation:
+    """Віртуальний годинник та черга подій; події з однаковим часом виконуються в порядку додавання."""
+
+    def __init__(self, seed):
+        self.now = 0.0
+        self.events = []
+        self.counter = itertools.count()
+        self.rng = random.Random(seed)
+        self.processed = 0
+
+    def at(self, delay, callback, *args):
+        heapq.heappush(self.events, (self.now + delay, next(self.counter), callback, args))
+
+    def clock(self):
+        return self.now
+
+    def run(self):
+        while self.events:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            self.processed += 1
+            callback(*args)
+
+
+class Secondary:
+    def __init__(self, sim, index, args, total):
+        self.sim = sim
+        self.index = index
+        # Номер у масивах майстра; index — як у назві secondary1, secondary2 та в --partition/--crash.
+        self.node = index - 1
+        self.args = args
+        self.slow = dict(args.slow).get(index, 1.0)
+        self.partitions = [(start, end) for node, start, end in args.partition if node == index]
+        self.crashes = [(start, end) for node, start, end in args.crash if node == index]
+        self.applied = bytearray(total)
+        self.in_flight = bytearray(total)
+        self.applied_through = -1
+        # Найбільший applied_through, що вже поїхав майстру у відповіді чи Acknowledge.
+        self.reported_through = -1
+        self.max_applied = -1
+        self.apply_queue = deque()
+        self.waiters = {}
+        self.applying = False
+        self.gap_pending = False
+        self.ack_pending = False
+        self.acknowledges = 0
+        # Збільшується при кожному падінні: події попереднього «життя» вузла ігноруються.
+        self.epoch = 0
+        self.recovery_targets = []
+        self.recoveries = []
+        self.master = None
+
+    def down(self, at):
+        return any(start <= at < end for start, end in self.crashes)
+
+    def reachable(self, at):
+        return not self.down(at) and not any(start <= at < end for start, end in self.partitions)
+
+    def one_way(self):
+        return self.sim.rng.lognormvariate(math.log(self.args.rtt_ms / 2000), self.args.rtt_jitter) * self.slow
+
+    def replicate(self, msg_id, successors, deadline, reply, forwarded=False):
+        """ReplicateMessage: reply(Reply або None) викликається в момент відповіді вузла.
+
+        Як і справжній вузол, спершу обробляє запис сам, надсилає майстру ACK своєї
+        позиції (acknowledge_position), а потім пересилає запис наступному вузлу
+        ланцюга й додає його ACK до chain_acks.
+        """
+        def own(ok):
+            if not ok:
+                reply(None)
+            elif successors:
+                if self.reachable(self.sim.now):
+                    self.acknowledges += 1
+                    self.sim.at(self.one_way(), self.master.record_ack, self.node, msg_id, None)
+                self.forward(msg_id, successors, deadline, reply, forwarded)
+            else:
+                reply(replication.Reply(True, self.watermark_for_reply(deadline, forwarded), 1))
+
+        if self.applied[msg_id]:
+            own(True)
+            return
+        if not self.in_flight[msg_id]:
+            if self.sim.rng.random() < self.args.drop:
+                own(False)
+                return
+            self.in_flight[msg_id] = 1
+            self.apply_queue.append(msg_id)
+            if not self.applying:
+                self.start_batch()
+        if self.args.ack_mode == "received":
+            own(True)
+        else:
+            self.waiters.setdefault(msg_id, []).append(own)
+
+    def forward(self, msg_id, successors, deadline, reply, forwarded):
+        """Пересилання наступному вузлу ланцюга; якщо він не відповів до дедлайну, ланцюг обривається тут."""
+        state = {"done": False}
+        epoch = self.epoch
+
+        def finish(chain_acks):
+            if state["done"] or epoch != self.epoch:
+                return
+            state["done"] = True
+            reply(replication.Reply(True, self.watermark_for_reply(deadline, forwarded), 1 + chain_acks))
+
+        def answered(downstream):
+            # Помилку наступного вузла forward_to_chain бачить одразу й рахує як 0 ACK.
+            if self.reachable(self.sim.now):
+                self.sim.at(successor.one_way(), finish, downstream.chain_acks if downstream else 0)
+
+        def arrive():
+            if successor.reachable(self.sim.now):
+                successor.replicate(msg_id, successors[1:], deadline, answered, forwarded=True)
+
+        successor = self.master.secondaries[successors[0]]
+        if self.reachable(self.sim.now):
+            self.sim.at(successor.one_way(), arrive)
+        self.sim.at(max(0.0, deadline - self.sim.now), finish, 0)
+
+    def watermark_for_reply(self, deadline, forwarded):
+        """reply_watermark: відповідь попередньому вузлу чи після дедлайну не знімає Acknowledge."""
+        if not forwarded and self.sim.now < deadline:
+            self.reported_through = max(self.reported_through, self.applied_through)
+        return self.applied_through
+
+    def start_batch(self):
+        batch = [self.apply_queue.popleft() for _ in range(min(self.args.batch, len(self.apply_queue)))]
+        self.applying = True
+        low, high = self.args.apply_delay
+        self.sim.at(self.sim.rng.uniform(low, high) * self.slow, self.finish_batch, batch, self.epoch)
+
+    def finish_batch(self, batch, epoch):
+        if epoch != self.epoch:
+            return
+        for msg_id in batch:
+            self.apply(msg_id)
+            for own in self.waiters.pop(msg_id, ()):
+                own(True)
+        self.applying = False
+        if self.apply_queue:
+            self.start_batch()
+        self.schedule_acknowledge()
+
+    def apply(self, msg_id):
+        self.in_flight[msg_id] = 0
+        if self.applied[msg_id]:
+            return
+        self.applied[msg_id] = 1
+        self.max_applied = max(self.max_applied, msg_id)
+        while self.applied_through + 1 < len(self.applied) and self.applied[self.applied_through + 1]:
+            self.applied_through += 1
+        while self.recovery_targets and self.applied_through >= self.recovery_targets[0][1]:
+            healed_at, _ = self.recovery_targets.pop(0)
+            self.recoveries.append(self.sim.now - healed_at)
+        if self.max_applied > self.applied_through and not self.gap_pending:
+            self.gap_pending = True
+            self.sim.at(GAP_GRACE_SECONDS, self.repair_gaps, self.epoch)
+
+    def schedule_acknowledge(self):
+        if not self.ack_pending:
+            self.ack_pending = True
+            self.sim.at(ACK_COALESCE_SECONDS, self.acknowledge, self.epoch)
+
+    def acknowledge(self, epoch):
+        """report_applied: Acknowledge лише тоді, коли відповіді не віднесли водяний знак майстру."""
+        if epoch != self.epoch:
+            return
+        self.ack_pending = False
+        through = self.applied_through
+        if through <= self.reported_through or not self.reachable(self.sim.now):
+            return
+        self.acknowledges += 1
+        self.reported_through = through
+        self.sim.at(self.one_way(), self.master.record_ack, self.node, None, through)
+
+    def repair_gaps(self, epoch):
+        """FetchRange: дозапитує в майстра id, яких бракує і які зараз не застосовуються."""
+        if epoch != self.epoch:
+            return
+        self.gap_pending = False
+        missing = [msg_id for msg_id in range(self.applied_through + 1, self.max_applied)
+                   if not self.applied[msg_id] and not self.in_flight[msg_id]]
+        if not missing:
+            return
+        if not self.reachable(self.sim.now):
+            self.gap_pending = True
+            self.sim.at(1.0, self.repair_gaps, epoch)
+            return
+        chunks = math.ceil(len(missing) / MAX_RANGE_SIZE)
+        self.sim.at(2 * self.one_way() * chunks, self.fetched, missing, epoch)
+
+    def fetched(self, missing, epoch):
+        if epoch != self.epoch:
+            return
+        for msg_id in missing:
+            if msg_id < self.master.log_length:
+                self.apply(msg_id)
+        self.schedule_acknowledge()
+
+    def crash(self):
+        self.epoch += 1
+        self.apply_queue.clear()
+        self.waiters.clear()
+        self.in_flight = bytearray(len(self.in_flight))
+        self.applying = False
+        self.gap_pending = False
+        self.ack_pending = False
+        self.reported_through = -1
+
+    def heal(self, restarted):
+        self.recovery_targets.append((self.sim.now, self.master.log_length - 1))
+        if restarted:
+            # Стан застосованих записів переживає падіння (DATA_DIR), тож вузол надсилає SYNC.
+            self.sim.at(self.one_way(), self.master.sync, self.node, self.applied_through)
+
+
+class Master(replication.Replicator):
+    """Майстер поверх master/replication.py: тут лише події замість gRPC, потоків і sleep."""
+
+    def __init__(self, sim, args, secondaries, total):
+        nodes = range(len(secondaries))
+        super().__init__(
+            [replication.DeliveryQueue(args.concurrency, args.retry_pause, args.max_backlog) for _ in nodes],
+            replication.AckTracker(nodes), replication.LatencyTracker(nodes, LATENCY_EWMA_ALPHA),
+            replication.SendWindow(args.window), replication.RetryPolicy(args.rpc_timeout, args.max_attempts),
+            args.ack_mode)
+        self.sim = sim
+        self.args = args
+        self.secondaries = secondaries
+        self.needed = args.w - 1
+        self.log_length = 0
+        self.append_time = [0.0] * total
+        self.commit_time = [None] * total
+        self.deadlines = [None] * total
+        self.acks = bytearray(total)
+        self.counted = [bytearray(total) for _ in secondaries]
+        # Запис рахується в MAX_INFLIGHT_WRITES, доки не закомічений або клієнт не перестав чекати.
+        self.waiting = bytearray(total)
+        self.inflight = 0
+        self.rejected = Counter()
+        self.resume_scheduled = [False] * len(secondaries)
+        self.attempts = 0
+        self.failed_attempts = 0
+        # Спроби, які обірвав дедлайн клієнта: невдачею вони не рахуються.
+        self.cut_attempts = 0
+
+    def clock(self):
+        return self.sim.now
+
+    def call_later(self, seconds, callback, *args):
+        self.sim.at(seconds, callback, *args)
+
+    def chain_for(self, node):
+        if self.args.topology == "chain" and node == 0:
+            return list(range(len(self.secondaries)))
+        return [node]
+
+    def deadline_of(self, msg_id):
+        return self.deadlines[msg_id]
+
+    def targets(self):
+        """Вузли, яким майстер надсилає новий запис сам (replication_targets)."""
+        if self.args.topology == "chain":
+            return [0]
+        return self.latency.order(range(len(self.secondaries)), self.args.ack_mode)
+
+    def append(self):
+        lags = [self.tracker.lag(node, self.log_length - 1) for node in range(len(self.secondaries))]
+        reason = replication.admission(self.inflight, self.args.max_inflight, lags, self.args.max_backlog,
+                                       self.args.w)
+        if reason:
+            self.rejected[reason] += 1
+            return
+        msg_id = self.log_length
+        self.log_length += 1
+        self.append_time[msg_id] = self.sim.now
+        if self.args.timeout_ms:
+            self.deadlines[msg_id] = self.sim.now + self.args.timeout_ms / 1000
+        if self.needed <= 0:
+            self.commit_time[msg_id] = self.sim.now
+        else:
+            self.waiting[msg_id] = 1
+            self.inflight += 1
+            wait = self.args.timeout_ms / 1000 if self.args.timeout_ms else self.args.ack_wait
+            self.sim.at(wait, self.stop_waiting, msg_id)
+        for node in self.targets():
+            self.queues[node].offer(msg_id, None, lags[node])
+            self.wake(node)
+
+    def stop_waiting(self, msg_id):
+        if self.waiting[msg_id]:
+            self.waiting[msg_id] = 0
+            self.inflight -= 1
+
+    def record_ack(self, node, msg_id=None, applied_through=None):
+        previous, through = self.tracker.record(node, msg_id, applied_through)
+        if msg_id is not None:
+            self.count_ack(node, msg_id)
+        for acked in range(previous + 1, through + 1):
+            self.count_ack(node, acked)
+
+    def count_ack(self, node, msg_id):
+        if self.counted[node][msg_id]:
+            return
+        self.counted[node][msg_id] = 1
+        self.acks[msg_id] += 1
+        if self.acks[msg_id] == self.needed:
+            self.commit_time[msg_id] = self.sim.now
+            self.stop_waiting(msg_id)
+
+    def wake(self, node):
+        """Потік відправника вузла: розбирає чергу одразу, а після паузи — ще раз."""
+        pause = self.pump(node)
+        if pause > 0 and not self.resume_scheduled[node]:
+            self.resume_scheduled[node] = True
+            self.sim.at(pause, self.resume, node)
+
+    def resume(self, node):
+        self.resume_scheduled[node] = False
+        self.wake(node)
+
+    def rebuild(self, node):
+        start = self.tracker.watermark[node] + 1
+        return self.queues[node].rebuild(((msg_id, None) for msg_id in range(start, self.log_length)),
+                                         lambda msg_id: self.is_acked(node, msg_id))
+
+    def transport(self, node, msg_id, message, chain, step, done):
+        """Одна спроба ReplicateMessage: done викликається відповіддю вузла або таймаутом."""
+        self.attempts += 1
+        secondary = self.secondaries[node]
+        deadline = self.sim.now + step.timeout
+        state = {"done": False}
+
+        def finish(reply):
+            if state["done"]:
+                return
+            state["done"] = True
+            if reply is None and self.policy.cut_by_deadline(step, self.deadlines[msg_id], self.sim.now):
+                self.cut_attempts += 1
+            elif reply is None:
+                self.failed_attempts += 1
+            done(reply)
+
+        def answered(reply):
+            if secondary.reachable(self.sim.now):
+                self.sim.at(secondary.one_way(), finish, reply)
+
+        def arrive(epoch):
+            if secondary.reachable(self.sim.now) and epoch == secondary.epoch:
+                secondary.replicate(msg_id, chain[1:], deadline, answered)
+
+        self.sim.at(secondary.one_way(), arrive, secondary.epoch)
+        self.sim.at(step.timeout, finish, None)
+
+    def sync(self, node, applied_through):
+        """SYNC: довіряємо водяному знаку вузла і перебудовуємо його чергу з логу."""
+        self.tracker.reset(node, applied_through)
+        self.rebuild(node)
+        self.wake(node)
+
+
+def run(args):
+    sim = Simulation(args.seed)
+    secondaries = [Secondary(sim, index, args, args.messages) for index in range(1, args.secondaries + 1)]
+    master = Master(sim, args, secondaries, args.messages)
+    for secondary in secondaries:
+        secondary.master = master
+        for start, end in secondary.partitions:
+            sim.at(end, secondary.heal, False)
+        for start, end in secondary.crashes:
+            sim.at(start, secondary.crash)
+            sim.at(end, secondary.heal, True)
+
+    arrival = 0.0
+    for _ in range(args.messages):
+        sim.at(arrival, master.append)
+        arrival += sim.rng.expovariate(args.rate)
+
+    started = time.perf_counter()
+    sim.run()
+    wall = time.perf_counter() - started
+    return sim, master, secondaries, wall
+
+
+def report(args, sim, master, secondaries, wall):
+    appended = master.log_length
+    latencies = [commit - start for commit, start in zip(master.commit_time[:appended], master.append_time)
+                 if commit is not None]
+    wait = args.timeout_ms / 1000 if args.timeout_ms else args.ack_wait
+    in_time = [latency for latency in latencies if latency <= wait]
+    last_commit = max((commit for commit in master.commit_time if commit is not None), default=0.0)
+    print(f"Повідомлень: {args.messages}, w={args.w}, вторинних вузлів: {args.secondaries}, "
+          f"ACK: {args.ack_mode}, топологія: {args.topology}, seed={args.seed}")
+    print(f"Симульовано {sim.now:.1f} с за {wall:.2f} с реального часу ({sim.processed} подій, "
+          f"{sim.processed / wall:.0f} подій/с)")
+    print(f"Пропускна здатність: {len(latencies) / last_commit if last_commit else 0:.1f} комітів/с "
+          f"(вхідний потік {args.rate}/с)")
+    print(f"Затримка коміту: p50 {percentile(latencies, 50) * 1000:.0f} мс, "
+          f"p95 {percentile(latencies, 95) * 1000:.0f} мс, p99 {percentile(latencies, 99) * 1000:.0f} мс")
+    print(f"Прийнято записів: {appended}, відхилено: {master.rejected['inflight']} (MAX_INFLIGHT_WRITES), "
+          f"{master.rejected['backlog']} (відставання вузлів)")
+    print(f"Вклалися в {wait:.1f} с очікування клієнта: {len(in_time)}, "
+          f"закомічено пізніше: {len(latencies) - len(in_time)}, без коміту: {appended - len(latencies)}")
+    print(f"Спроб ReplicateMessage: {master.attempts}, невдалих: {master.failed_attempts}, "
+          f"обірваних дедлайном клієнта: {master.cut_attempts}, "
+          f"Acknowledge: {sum(secondary.acknowledges for secondary in secondaries)}")
+    for secondary in secondaries:
+        lag = master.log_length - 1 - secondary.applied_through
+        recoveries = ", ".join(f"{seconds:.1f} с" for seconds in secondary.recoveries) or "—"
+        unrecovered = len(secondary.recovery_targets)
+        print(f"  secondary{secondary.index}: застосовано до id {secondary.applied_through} (відставання {lag}), "
+              f"відновлення: {recoveries}" + (f", не відновився після {unrecovered} збоїв" if unrecovered else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=10, help="вхідний потік записів за секунду (Пуассон)")
+    parser.add_argument("--w", type=int, default=3, help="write concern, разом із майстром")
+    parser.add_argument("--secondaries", type=int, default=2)
+    parser.add_argument("--ack-mode", choices=["received", "applied"], default="applied")
+    parser.add_argument("--topology", choices=["fanout", "chain"], default="fanout",
+                        help="REPLICATION_TOPOLOGY майстра")
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="медіана RTT до вузла")
+    parser.add_argument("--rtt-jitter", type=float, default=0.5, help="sigma логнормального розподілу RTT")
+    parser.add_argument("--apply-delay", type=parse_pair, default=(5.0, 10.0),
+                        help="затримка застосування пакета, рівномірно в межах low,high секунд")
+    parser.add_argument("--batch", type=int, default=100, help="APPLY_BATCH_SIZE")
+    parser.add_argument("--drop", type=float, default=0.1, help="частка симульованих внутрішніх помилок")
+    parser.add_argument("--rpc-timeout", type=float, default=10.0)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=256, help="REPLICATION_CONCURRENCY")
+    parser.add_argument("--retry-pause", type=float, default=5.0, help="RETRY_PAUSE_SECONDS")
+    parser.add_argument("--window", type=int, default=0, help="REPLICATION_WINDOW (0 — без обмеження)")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="MAX_INFLIGHT_WRITES")
+    parser.add_argument("--max-backlog", type=int, default=10000, help="MAX_SECONDARY_BACKLOG")
+    parser.add_argument("--timeout-ms", type=float, default=0,
+                        help="timeout_ms кожного запису (0 — клієнт чекає --ack-wait)")
+    parser.add_argument("--ack-wait", type=float, default=60.0, help="скільки майстер чекає на w ACK")
+    parser.add_argument("--slow", type=lambda v: (int(v.split(":")[0]), float(v.split(":")[1])),
+                        action="append", default=[], help="вузол:множник затримок, напр. 2:10")
+    parser.add_argument("--partition", type=parse_window, action="append", default=[],
+                        help="вузол:початок:кінець (с) — вузол недосяжний для майстра")
+    parser.add_argument("--crash", type=parse_window, action="append", default=[],
+                        help="вузол:початок:кінець (с) — вузол впав і перезапустився")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    report(args, *run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Розбивка затримки найповільніших записів за етапами.
+
+Читає файли спанів (TRACE_FILE майстра та вторинних вузлів), збирає спани за
+trace id і для N найповільніших POST /messages показує, скільки часу зайняли
+розбір HTTP, додавання в лог, очікування в черзі, виклики gRPC, застосування
+на вторинному вузлі та очікування ACK.
+
+    python trace_report.py traces/master.jsonl traces/secondary*.jsonl --top 10
+"""
+import argparse
+import json
+from collections import defaultdict
+
+MASTER_STAGES = ["http.parse", "append", "ack.wait"]
+
+
+def load_spans(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                traces[span["traceId"]].append(span)
+    return traces
+
+
+def duration_ms(span):
+    return (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e6
+
+
+def breakdown(spans):
+    """Повертає (кореневий спан, етапи майстра, етапи по кожному вторинному вузлу)."""
+    root = None
+    stages = defaultdict(float)
+    per_node = defaultdict(lambda: {"queue": 0.0, "grpc": 0.0, "attempts": 0, "apply": 0.0})
+    for span in spans:
+        name, attrs = span["name"], span.get("attributes", {})
+        if name == "http.append":
+            root = span
+        elif name in MASTER_STAGES:
+            stages[name] += duration_ms(span)
+        elif name == "queue":
+            per_node[attrs["addr"]]["queue"] += duration_ms(span)
+        elif name == "grpc.replicate":
+            per_node[attrs["addr"]]["grpc"] += duration_ms(span)
+            per_node[attrs["addr"]]["attempts"] += 1
+        elif name == "secondary.apply":
+            per_node[attrs.get("addr", span["service"])]["apply"] += duration_ms(span)
+    return root, stages, per_node
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="файли спанів майстра та вторинних вузлів")
+    parser.add_argument("--top", type=int, default=10, help="скільки найповільніших записів показати")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for trace_id, spans in load_spans(args.files).items():
+        root, stages, per_node = breakdown(spans)
+        if root is not None:
+            rows.append((duration_ms(root), trace_id, root, stages, per_node))
+    rows.sort(key=lambda row: row[0], reverse=True)
+
+    print(f"Записів із трасою: {len(rows)}, найповільніші {min(args.top, len(rows))}:")
+    totals = defaultdict(float)
+    for total, trace_id, root, stages, per_node in rows[:args.top]:
+        attrs = root.get("attributes", {})
+        print(f"\ntrace {trace_id}  всього {total:.1f} мс  (w={attrs.get('w')}, status={attrs.get('status')})")
+        for name in MASTER_STAGES:
+            print(f"  {name:<12} {stages.get(name, 0.0):10.1f} мс")
+            totals[name] += stages.get(name, 0.0)
+        for addr, node in sorted(per_node.items()):
+            print(f"  {addr:<24} черга {node['queue']:.1f} мс | gRPC {node['grpc']:.1f} мс "
+                  f"({node['attempts']} спроб) | застосування {node['apply']:.1f} мс")
+            for key in ("queue", "grpc", "apply"):
+                totals[f"{addr} {key}"] += node[key]
+
+    shown = min(args.top, len(rows))
+    if shown:
+        print(f"\nСереднє по {shown} найповільніших:")
+        for name, value in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"  {name:<36} {value / shown:10.1f} мс")
+
+
+if __name__ == "__main__":
+    main()